@@ -0,0 +1,60 @@
+# crud.py 的异步版本，供 async def 路由使用。
+# 这里不重复实现任何查询逻辑：每个函数都只是把 crud.py 里同名的同步函数交给 database.run_db 执行，
+# 所以两边永远保持一致，修改查询时只需要改 crud.py。
+# 调用方式与同步版本相同，只是第一个参数可以是 Session 或 AsyncSession，并且需要 await：
+#     check_in = await async_crud.get_check_in(db, check_in_id)
+# 需要直接返回给前端的结果，可以额外传 response_model=...，在数据库上下文里完成序列化前的校验（见 run_db 的说明）。
+import functools
+
+from . import crud
+from .database import run_db
+
+
+def _async_version(fn):
+    @functools.wraps(fn)
+    async def wrapper(db, *args, response_model=None, **kwargs):
+        return await run_db(db, fn, *args, response_model=response_model, **kwargs)
+    return wrapper
+
+
+# 用户
+get_user = _async_version(crud.get_user)
+get_user_by_username = _async_version(crud.get_user_by_username)
+get_user_by_invitation_code = _async_version(crud.get_user_by_invitation_code)
+create_user = _async_version(crud.create_user)
+update_user_refresh_token = _async_version(crud.update_user_refresh_token)
+bind_partners = _async_version(crud.bind_partners)
+
+# 任务
+get_task = _async_version(crud.get_task)
+get_tasks = _async_version(crud.get_tasks)
+create_task = _async_version(crud.create_task)
+update_task = _async_version(crud.update_task)
+get_checkins_by_task = _async_version(crud.get_checkins_by_task)
+
+# 打卡
+get_check_in = _async_version(crud.get_check_in)
+create_check_in = _async_version(crud.create_check_in)
+delete_check_in = _async_version(crud.delete_check_in)
+get_check_ins_for_user_on_date = _async_version(crud.get_check_ins_for_user_on_date)
+get_media_usage = _async_version(crud.get_media_usage)
+
+# 评论
+create_comment = _async_version(crud.create_comment)
+get_comment_by_user = _async_version(crud.get_comment_by_user)
+get_comments_by_check_in = _async_version(crud.get_comments_by_check_in)
+delete_comment = _async_version(crud.delete_comment)
+
+# 点赞
+create_like = _async_version(crud.create_like)
+delete_like = _async_version(crud.delete_like)
+apply_like_actions = _async_version(crud.apply_like_actions)
+get_likes_by_check_in = _async_version(crud.get_likes_by_check_in)
+get_like_count_by_check_in = _async_version(crud.get_like_count_by_check_in)
+
+# 得分申请
+create_score_request = _async_version(crud.create_score_request)
+get_score_request = _async_version(crud.get_score_request)
+get_score_requests_for_user = _async_version(crud.get_score_requests_for_user)
+count_pending_score_requests = _async_version(crud.count_pending_score_requests)
+respond_to_score_request = _async_version(crud.respond_to_score_request)
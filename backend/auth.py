@@ -1,13 +1,20 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 import pytz
-from sqlalchemy.orm import Session
-from . import schemas, models, crud
-from .database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from . import schemas, models, crud, metrics
+from .cache import TTLCache
+from .database import DBSession, get_async_db, run_db
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
+import threading
+import time
+from typing import NamedTuple
 
 # 尝试从 .env 加载环境变量（若安装了 python-dotenv）
 try:
@@ -28,9 +35,15 @@ if not SECRET_KEY:
 ALGORITHM = "HS256" # JWT 签名算法，这里使用对称的 HS256
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 # 访问令牌有效期30分钟
 REFRESH_TOKEN_EXPIRE_DAYS = 30 # 刷新令牌有效期30天
+# SSE 票据（见 create_stream_ticket）的有效秒数，只需要够客户端拿到票据后建立连接
+STREAM_TICKET_EXPIRE_SECONDS = int(os.getenv("STREAM_TICKET_EXPIRE_SECONDS", "60"))
+STREAM_TICKET_SCOPE = "events"
 
 # 密码哈希
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto") # 使用 passlib 的 CryptContext，方案为 bcrypt，用 bcrypt 生成/校验密码哈希。bcrypt 会自动加盐，安全性较好。保证密码只以哈希形式存储，永不保存明文
+# bcrypt 的计算成本（cost factor）。每加 1 计算量翻倍：12 大约 100~300ms 一次，可以按登录吞吐量的容量规划来调整。
+# 已有的哈希里记录了各自的 cost，调整这个值不影响老密码的校验。
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS) # 使用 passlib 的 CryptContext，方案为 bcrypt，用 bcrypt 生成/校验密码哈希。bcrypt 会自动加盐，安全性较好。保证密码只以哈希形式存储，永不保存明文
 
 # OAuth2 an'd token URL
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token") # 告诉 Swagger 文档如何进行密码模式的认证流程（使用 /auth/token 获取令牌）
@@ -39,13 +52,75 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token") # 告诉 Swagger 文
 # --- 密码操作 ---
 def verify_password(plain_password, hashed_password):# 
     '''校验明文密码与哈希是否匹配（登录时用）'''
+    metrics.record_password_hash("verify")
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     '''注册时对明文密码进行哈希处理（注册时用）'''
+    metrics.record_password_hash("hash")
     return pwd_context.hash(password)
 
 
+# --- 密码哈希线程池 ---
+# bcrypt 一次要算 100~300ms，如果直接在 async def 路由里调用，整个事件循环都会被卡住，同一 worker 上的其他请求全部排队。
+# 这里把哈希/校验放进一个固定大小的专用线程池（bcrypt 计算时会释放 GIL，多个线程可以真正并行），
+# 并限制排队深度：正在执行和排队中的任务超过 PASSWORD_HASH_MAX_PENDING 时直接返回 503，
+# 让登录洪峰快速失败，而不是越积越多、拖慢所有请求。
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_password_lock = threading.Lock()
+_password_pending = 0
+_password_stats = {"completed": 0, "rejected": 0}
+
+
+async def _run_password_job(fn, *args):
+    '''在密码哈希线程池里执行 fn，线程池饱和时抛出 503'''
+    global _password_pending
+    with _password_lock:
+        if _password_pending >= PASSWORD_HASH_MAX_PENDING:
+            _password_stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please retry later",
+                headers={"Retry-After": "1"},
+            )
+        _password_pending += 1
+    future = _password_executor.submit(fn, *args)
+    # 在线程池里的任务结束时才减少排队数：请求被取消（客户端断开、超时）时任务仍在排队或执行，不能提前腾出名额
+    future.add_done_callback(_password_job_done)
+    return await asyncio.wrap_future(future)
+
+
+def _password_job_done(future):
+    global _password_pending
+    with _password_lock:
+        _password_pending -= 1
+        _password_stats["completed"] += 1
+
+
+async def verify_password_async(plain_password, hashed_password):
+    '''verify_password 的异步版本，在密码哈希线程池里执行'''
+    return await _run_password_job(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password):
+    '''get_password_hash 的异步版本，在密码哈希线程池里执行'''
+    return await _run_password_job(get_password_hash, password)
+
+
+def password_pool_stats() -> dict:
+    '''密码哈希线程池的当前排队数和累计完成/拒绝次数'''
+    with _password_lock:
+        return {
+            "workers": PASSWORD_HASH_WORKERS,
+            "max_pending": PASSWORD_HASH_MAX_PENDING,
+            "pending": _password_pending,
+            **_password_stats,
+        }
+
+
 
 # 一个完整的 JWT 由三部分组成，用点 . 连接，像这样： Header.Payload.Signature
 # 1. 1.
@@ -107,11 +182,54 @@ def create_refresh_token(data: dict, expires_delta: timedelta | None = None):
 # 简单来说，上面这两个函数就是把**“你是谁 ( sub )” 和 “你能用到什么时候 ( exp )” 这两个信息，用一把只有服务器知道的 “钥匙 ( SECRET_KEY )”**锁起来，做成一个防伪的“通行证 (JWT)”。
 
 
+# --- 认证缓存 ---
+# 每个受保护的请求都要 jwt.decode 一次，再按用户名查一次数据库（带 JOIN 伴侣）。
+# 前端一个页面会连续发很多请求，这里用两层进程内缓存跳过这两步：
+# - _token_cache: token -> 用户名，省掉 jwt.decode；缓存时间不超过令牌本身的剩余有效期。
+# - _user_cache: 用户名 -> 用户快照（与任何会话都无关的 detached 对象），省掉查库。
+# 修改用户的写操作（绑定伴侣、更新 refresh token、审批加分）会调用 invalidate_cached_users 显式失效。
+# 缓存是每个 worker 进程各一份，其他 worker 上的旧快照最多存活 AUTH_CACHE_TTL_SECONDS 秒。
+AUTH_CACHE_ENABLED = os.getenv("AUTH_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "30"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "1024"))
+
+_token_cache = TTLCache(maxsize=AUTH_CACHE_MAX_ENTRIES, ttl=AUTH_CACHE_TTL_SECONDS)
+_user_cache = TTLCache(maxsize=AUTH_CACHE_MAX_ENTRIES, ttl=AUTH_CACHE_TTL_SECONDS)
+
+
+def _copy_user(user: models.User) -> models.User:
+    '''只复制表字段，得到一个不属于任何会话的新 User 对象'''
+    return models.User(**{column.key: getattr(user, column.key) for column in models.User.__table__.columns})
+
+
+def _snapshot_user(user: models.User) -> models.User:
+    '''为缓存生成用户快照（连同已加载的伴侣），快照是 detached 状态，可以安全地 merge 进任意会话'''
+    snapshot = _copy_user(user)
+    if user.partner is not None:
+        partner = _copy_user(user.partner)
+        make_transient_to_detached(partner)
+        snapshot.partner = partner
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+def invalidate_cached_users(*users: models.User | None):
+    '''用户数据被修改后调用，让这些用户的缓存快照失效（只影响当前进程）'''
+    for user in users:
+        if user is not None:
+            _user_cache.pop(user.username)
+
+
+def auth_cache_stats() -> dict:
+    '''认证缓存的命中/未命中计数，用于压测或监控时确认缓存效果'''
+    return {"token": _token_cache.stats(), "user": _user_cache.stats()}
+
+
 
 # --- 获取当前用户 ---
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: DBSession = Depends(get_async_db)):
     # token: str = Depends(oauth2_scheme)：这部分是 FastAPI 依赖注入的魔法。你不需要手动传参。Depends(oauth2_scheme) 会告诉 FastAPI：“在处理这个请求前，请自动去请求头 (Header) 里寻找 Authorization 字段，提取出 Bearer <token> 中的 <token> 部分，然后把它作为 token 参数传给我的函数。”如果找不到 Authorization: Bearer ... ，FastAPI 会直接报错，连 get_current_user 的代码都不会执行。
-    # db: Session = Depends(get_db)：这和我们之前用的一样，就是从依赖注入系统中获取一个数据库会话，以便我们查询用户数据。
+    # db: DBSession = Depends(get_async_db)：从依赖注入系统中获取一个数据库会话，以便我们查询用户数据。DB_ASYNC 关闭时它和路由里的 Depends(get_db) 是同一个会话。
     '''这是整个认证系统的“守门员”。它不是一个普通的函数，而是一个 FastAPI 依赖,作为一个“守卫”被安插在需要保护的 API 路由上'''
     '''检查请求中是否包含一个 有效 的访问令牌 (Access Token)，如果有效，就把这个令牌对应的 用户完整信息从数据库里捞出来，并提供给后续的业务逻辑使用'''
     '''如果令牌无效或不存在，它会直接 拒绝 请求，返回一个 401 Unauthorized 错误。'''
@@ -120,14 +238,86 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str | None = payload.get("sub")
-        if username is None:
+    username = _token_cache.get(token) if AUTH_CACHE_ENABLED else None
+    if AUTH_CACHE_ENABLED:
+        metrics.record_auth_cache("token", username is not None)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username = payload.get("sub")
+            # 带 scope 的是 SSE 票据之类的专用令牌，不能当作访问令牌使用
+            if username is None or payload.get("scope") is not None:
+                raise credentials_exception
+        except JWTError:
             raise credentials_exception
+        if AUTH_CACHE_ENABLED:
+            # 缓存时间不超过令牌剩余有效期，过期的令牌永远不会从缓存里命中
+            remaining = payload.get("exp", 0) - time.time()
+            if remaining > 0:
+                _token_cache.set(token, username, ttl=min(AUTH_CACHE_TTL_SECONDS, remaining))
+
+    snapshot = _user_cache.get(username) if AUTH_CACHE_ENABLED else None
+    if AUTH_CACHE_ENABLED:
+        metrics.record_auth_cache("user", snapshot is not None)
+    if snapshot is not None:
+        # merge(load=False) 把快照复制成当前会话里的一个实例，不发 SQL；
+        # 各请求拿到的是各自的副本，修改它不会影响缓存里的快照
+        if isinstance(db, AsyncSession):
+            return await db.merge(snapshot, load=False)
+        return db.merge(snapshot, load=False)
+
+    user = await run_db(db, crud.get_user_by_username, username=username)
+    if user is None:
+        raise credentials_exception
+    if AUTH_CACHE_ENABLED:
+        _user_cache.set(username, _snapshot_user(user))
+    return user
+
+
+# --- SSE 票据 ---
+# 浏览器的 EventSource 不能设置请求头，凭证只能放在 URL 里，而 URL 会被 uvicorn、Nginx 记进访问日志。
+# 所以不在 URL 里放访问令牌，而是先带着访问令牌 POST /events/ticket 换一张票据：
+# - 只能用来建立 GET /events 连接（get_current_user 拒绝带 scope 的令牌），STREAM_TICKET_EXPIRE_SECONDS 秒后失效，
+#   日志里留下的票据很快就没有用了；
+# - 票据里记着访问令牌的过期时间，连接到那时由服务端关闭，客户端刷新令牌、换一张新票据再连。
+class StreamSession(NamedTuple):
+    user: models.User
+    expires_at: float  # 访问令牌的过期时间戳，连接最多保持到这时
+
+
+def create_stream_ticket(access_token: str) -> tuple[str, int]:
+    '''用（已经由 get_current_user 校验过的）访问令牌换一张 SSE 票据，返回 (票据, 有效秒数)'''
+    claims = jwt.get_unverified_claims(access_token)
+    expires_in = max(0, min(STREAM_TICKET_EXPIRE_SECONDS, int(claims["exp"] - time.time())))
+    ticket = jwt.encode(
+        {
+            "sub": claims["sub"],
+            "scope": STREAM_TICKET_SCOPE,
+            "exp": int(time.time()) + expires_in,
+            "session_exp": claims["exp"],
+        },
+        SECRET_KEY,
+        algorithm=ALGORITHM,
+    )
+    return ticket, expires_in
+
+
+async def get_stream_session(
+    ticket: str = Query(..., description="POST /events/ticket 换来的票据"), db: DBSession = Depends(get_async_db)
+) -> StreamSession:
+    '''SSE 长连接（GET /events）的认证：校验查询参数里的票据'''
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate stream ticket",
+    )
+    try:
+        payload = jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         raise credentials_exception
-    user = crud.get_user_by_username(db, username=username)
+    username = payload.get("sub")
+    if username is None or payload.get("scope") != STREAM_TICKET_SCOPE:
+        raise credentials_exception
+    user = await run_db(db, crud.get_user_by_username, username=username)
     if user is None:
         raise credentials_exception
-    return user
\ No newline at end of file
+    return StreamSession(user=user, expires_at=float(payload["session_exp"]))
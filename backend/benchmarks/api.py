@@ -0,0 +1,412 @@
+'''
+接口级的可复现压测：用 crud 在临时数据库里生成一份合成数据，然后驱动真正的 main.app 跑几组典型场景。
+
+数据集（--seed 固定随机数，同样的参数每次生成同样的数据）：
+- --couples 对情侣（每人一个账号，已绑定伴侣）、--tasks 个任务；
+- 每人 --checkins 条打卡，分散在过去 --days 天里；
+- 伴侣按 --like-ratio / --comment-ratio 的比例给对方的打卡点赞、评论。
+
+场景（--scenarios 选择，默认全部，按下面的顺序执行）：
+- login_burst：一批用户同时登录（bcrypt 校验，请求数是 --requests 的 1/10）；
+- dashboard：查看过去几天里随机一天的仪表盘；
+- task_timeline / task_checkins：随机任务的时间线和打卡列表；
+- like_storm：伴侣之间对随机打卡反复点赞/取消点赞；
+- checkin_with_images：带 1～3 张图片的打卡（请求数是 --requests 的 1/10）。
+  缩略图在后台线程生成，场景结束时等它们完成，它们的 SQL 也计在这个场景里。
+
+--transport asgi 在进程内通过 ASGI 直接调用 app，只测应用本身；--transport http 在本进程里启动 uvicorn，
+经过真实的 HTTP 连接。每个场景报告 p50/p95/p99 延迟、吞吐和每个请求平均执行的 SQL 条数。
+--output 把结果（连同当前 git 提交和参数）写成 JSON，--compare 与之前保存的结果逐项对比，方便在提交之间比较回归。
+
+用法（在仓库根目录执行）：
+    python -m backend.benchmarks.api --couples 1000 --requests 500 --concurrency 16 --output bench.json
+    python -m backend.benchmarks.api --couples 1000 --requests 500 --concurrency 16 --compare bench.json
+    DB_ASYNC=true python -m backend.benchmarks.api --transport http
+
+应用的配置仍然来自环境变量（DB_ASYNC、SQLITE_PROFILE、ETAGS_ENABLED……），只有 DATABASE_URL 和 UPLOAD_DIR
+会被指向临时目录；--database-url 可以换成一个空的 PostgreSQL 库。
+'''
+import argparse
+import asyncio
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+
+PASSWORD = "benchmark-password"
+SEED_BATCH = 200  # 生成数据时每隔多少对情侣输出一次进度
+
+
+@dataclass
+class Dataset:
+    couples: list[tuple[int, int]] = field(default_factory=list)  # (user_id, partner_id)
+    usernames: dict[int, str] = field(default_factory=dict)
+    task_ids: list[int] = field(default_factory=list)
+    check_ins: dict[int, list[int]] = field(default_factory=dict)  # 情侣下标 -> 两人的打卡 id
+    dates: list[str] = field(default_factory=list)  # 打卡分布的日期（仪表盘场景从中随机选）
+    tokens: dict[int, str] = field(default_factory=dict)
+
+
+class StatementCounter:
+    '''数 engine 上执行的 SQL 条数（同步、异步会话以及后台线程都算在内）'''
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args):
+        with self._lock:
+            self.value += 1
+
+    def install(self):
+        from sqlalchemy import event
+        from backend import database
+
+        event.listen(database.engine, "before_cursor_execute", self)
+        if database.async_engine is not None:
+            event.listen(database.async_engine.sync_engine, "before_cursor_execute", self)
+
+
+def configure_environment(workdir: str, database_url: str | None):
+    '''必须在导入 backend 之前调用：应用在导入时读取这些环境变量'''
+    os.environ["DATABASE_URL"] = database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["UPLOAD_DIR"] = os.path.join(workdir, "uploads")
+    os.environ["AUTO_MIGRATE"] = "true"
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+    os.environ.setdefault("SQLITE_PROFILE", "production")
+
+
+def log(message: str):
+    print(message, file=sys.stderr, flush=True)
+
+
+def seed(args, rng: random.Random) -> Dataset:
+    from backend import auth, crud, models, schemas
+    from backend.database import SessionLocal
+
+    dataset = Dataset()
+    hashed_password = auth.get_password_hash(PASSWORD)  # 所有账号共用一个密码，只算一次 bcrypt
+    now = datetime.datetime.now()
+    dataset.dates = [(now.date() - datetime.timedelta(days=day)).isoformat() for day in range(args.days)]
+    timestamps = []
+
+    db = SessionLocal()
+    try:
+        for index in range(args.couples):
+            user, partner = (
+                crud.create_user(db, schemas.UserCreate(username=f"bench{index}{side}", password=PASSWORD), hashed_password)
+                for side in ("a", "b")
+            )
+            crud.bind_partners(db, user, partner)
+            dataset.couples.append((user.id, partner.id))
+            dataset.usernames[user.id] = user.username
+            dataset.usernames[partner.id] = partner.username
+
+            if len(dataset.task_ids) < args.tasks:
+                task = crud.create_task(db, schemas.TaskCreate(title=f"任务 {len(dataset.task_ids)}", description="benchmark"), creator_id=user.id)
+                dataset.task_ids.append(task.id)
+
+            check_in_ids = []
+            for owner, other in ((user.id, partner.id), (partner.id, user.id)):
+                for _ in range(args.checkins):
+                    check_in = crud.create_check_in(db, owner, rng.choice(dataset.task_ids), f"打卡 {rng.randrange(10**6)}")
+                    check_in_ids.append(check_in.id)
+                    timestamps.append({
+                        "id": check_in.id,
+                        "timestamp": now - datetime.timedelta(days=rng.randrange(args.days), seconds=rng.randrange(86400)),
+                    })
+                    if rng.random() < args.like_ratio:
+                        crud.create_like(db, other, check_in.id)
+                    if rng.random() < args.comment_ratio:
+                        crud.create_comment(db, other, check_in.id, "好棒！")
+            dataset.check_ins[index] = check_in_ids
+
+            if (index + 1) % SEED_BATCH == 0:
+                log(f"已生成 {index + 1}/{args.couples} 对情侣")
+
+        # 打卡时间分散到过去几天，仪表盘和时间线看到的是有历史的数据
+        db.bulk_update_mappings(models.CheckIn, timestamps)
+        db.commit()
+    finally:
+        db.close()
+
+    expires = datetime.timedelta(hours=12)
+    dataset.tokens = {
+        user_id: auth.create_access_token(data={"sub": username}, expires_delta=expires)
+        for user_id, username in dataset.usernames.items()
+    }
+    return dataset
+
+
+def make_png(rng: random.Random) -> bytes:
+    from PIL import Image
+
+    image = Image.new("RGB", (640, 480), tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class Scenarios:
+    '''每个场景生成一个请求：(method, url, httpx 关键字参数, 可以接受的状态码)'''
+
+    ORDER = ["login_burst", "dashboard", "task_timeline", "task_checkins", "like_storm", "checkin_with_images"]
+    # 这些场景每个请求很重（bcrypt、写图片），只跑 --requests 的一部分
+    FRACTION = {"login_burst": 0.1, "checkin_with_images": 0.1}
+
+    def __init__(self, dataset: Dataset, rng: random.Random):
+        self.dataset = dataset
+        self.rng = rng
+        self.liked: set[tuple[int, int]] = set()
+        self.images = [make_png(rng) for _ in range(3)]
+
+    def _couple(self) -> tuple[int, int, int]:
+        index = self.rng.randrange(len(self.dataset.couples))
+        user_id, partner_id = self.dataset.couples[index]
+        if self.rng.random() < 0.5:
+            user_id, partner_id = partner_id, user_id
+        return index, user_id, partner_id
+
+    def _auth(self, user_id: int) -> dict:
+        return {"Authorization": f"Bearer {self.dataset.tokens[user_id]}"}
+
+    def login_burst(self):
+        _, user_id, _ = self._couple()
+        data = {"username": self.dataset.usernames[user_id], "password": PASSWORD}
+        return "POST", "/auth/token", {"data": data}, {200}
+
+    def dashboard(self):
+        _, user_id, _ = self._couple()
+        day = self.rng.choice(self.dataset.dates[:7])
+        return "GET", f"/dashboard/{day}", {"headers": self._auth(user_id)}, {200}
+
+    def task_timeline(self):
+        _, user_id, _ = self._couple()
+        task_id = self.rng.choice(self.dataset.task_ids)
+        return "GET", f"/tasks/{task_id}/timeline", {"headers": self._auth(user_id)}, {200}
+
+    def task_checkins(self):
+        _, user_id, _ = self._couple()
+        task_id = self.rng.choice(self.dataset.task_ids)
+        return "GET", f"/tasks/{task_id}/checkins", {"headers": self._auth(user_id)}, {200}
+
+    def like_storm(self):
+        index, user_id, _ = self._couple()
+        check_in_id = self.rng.choice(self.dataset.check_ins[index])
+        key = (user_id, check_in_id)
+        # 按本地记录的状态切换；并发的两次切换可能撞在一起，所以 400/404 也算正常结果
+        method = "DELETE" if key in self.liked else "POST"
+        self.liked.symmetric_difference_update({key})
+        return method, f"/checkins/{check_in_id}/likes", {"headers": self._auth(user_id)}, {200, 400, 404}
+
+    def checkin_with_images(self):
+        _, user_id, _ = self._couple()
+        task_id = self.rng.choice(self.dataset.task_ids)
+        count = self.rng.randint(1, len(self.images))
+        files = [("images", (f"bench{i}.png", self.images[i], "image/png")) for i in range(count)]
+        kwargs = {"headers": self._auth(user_id), "data": {"text_content": "压测打卡"}, "files": files}
+        return "POST", f"/tasks/{task_id}/checkin", kwargs, {200}
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    '''最近秩法求分位数'''
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(fraction * len(sorted_values) + 0.5))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def run_scenario(client, build, requests: int, concurrency: int, counter: StatementCounter) -> dict:
+    from backend import media
+
+    latencies: list[float] = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            method, url, kwargs, ok_statuses = build()
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code not in ok_statuses:
+                errors += 1
+
+    statements_before = counter.value
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    elapsed = time.perf_counter() - started
+    # 后台生成的缩略图也算进这个场景的 SQL 条数（不计入延迟和吞吐）
+    await asyncio.to_thread(media.wait_idle)
+    statements = counter.value - statements_before
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "sql_per_request": round(statements / len(latencies), 2) if latencies else 0.0,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def drive(args, dataset: Dataset, counter: StatementCounter) -> dict:
+    import httpx
+    from backend.main import app
+
+    scenarios = Scenarios(dataset, random.Random(args.seed + 1))
+    names = [name for name in Scenarios.ORDER if name in args.scenarios]
+    results = {}
+
+    async def run_all(client):
+        for name in names:
+            requests = max(1, int(args.requests * Scenarios.FRACTION.get(name, 1)))
+            log(f"场景 {name}：{requests} 个请求")
+            results[name] = await run_scenario(client, getattr(scenarios, name), requests, args.concurrency, counter)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if args.transport == "asgi":
+        # ASGITransport 不触发 lifespan，这里手动进入，让实时推送等启动逻辑照常执行
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+                await run_all(client)
+        return results
+
+    import uvicorn
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        await asyncio.sleep(0.05)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+            await run_all(client)
+    finally:
+        server.should_exit = True
+        thread.join()
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results: dict):
+    print(f"{'scenario':<22}{'requests':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'sql/req':>10}")
+    for name, row in results.items():
+        print(
+            f"{name:<22}{row['requests']:>10}{row['errors']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}"
+            f"{row['p99_ms']:>10}{row['throughput_rps']:>10}{row['sql_per_request']:>10}"
+        )
+
+
+def print_comparison(results: dict, baseline: dict):
+    '''逐个场景对比关键指标，括号里是相对基线的变化（延迟、SQL 条数变大是退步，吞吐变小是退步）'''
+    print(f"\n对比基线 {baseline['meta'].get('commit') or '?'}（{baseline['meta'].get('timestamp')}）")
+    metrics = ["p50_ms", "p95_ms", "p99_ms", "throughput_rps", "sql_per_request"]
+    print(f"{'scenario':<22}" + "".join(f"{metric:>26}" for metric in metrics))
+    for name, row in results.items():
+        old = baseline["scenarios"].get(name)
+        if old is None:
+            continue
+        cells = []
+        for metric in metrics:
+            before, after = old[metric], row[metric]
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+            cells.append(f"{before}->{after} ({change})")
+        print(f"{name:<22}" + "".join(f"{cell:>26}" for cell in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在合成数据上压测 HeartBeat 的主要接口")
+    parser.add_argument("--couples", type=int, default=500, help="情侣对数")
+    parser.add_argument("--tasks", type=int, default=20, help="任务数")
+    parser.add_argument("--checkins", type=int, default=10, help="每人的打卡数")
+    parser.add_argument("--days", type=int, default=30, help="打卡分布在过去多少天里")
+    parser.add_argument("--like-ratio", type=float, default=0.6, help="伴侣给打卡点赞的比例")
+    parser.add_argument("--comment-ratio", type=float, default=0.3, help="伴侣给打卡评论的比例")
+    parser.add_argument("--seed", type=int, default=42, help="随机数种子")
+    parser.add_argument("--requests", type=int, default=500, help="每个场景的请求数")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发请求数")
+    parser.add_argument("--transport", choices=["asgi", "http"], default="asgi", help="进程内 ASGI 调用或真实 HTTP")
+    parser.add_argument("--scenarios", default=",".join(Scenarios.ORDER), help="逗号分隔的场景名")
+    parser.add_argument("--database-url", help="使用这个（空的）数据库代替临时 SQLite 文件")
+    parser.add_argument("--output", help="把结果写成 JSON 文件")
+    parser.add_argument("--compare", help="与之前 --output 保存的 JSON 结果对比")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(Scenarios.ORDER)
+    if unknown:
+        parser.error(f"未知的场景：{', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(workdir, args.database_url)
+        from backend import migrate
+        migrate.upgrade_to_head()  # 生成数据之前先建表
+
+        log(f"生成数据：{args.couples} 对情侣，每人 {args.checkins} 条打卡")
+        started = time.perf_counter()
+        dataset = seed(args, random.Random(args.seed))
+        log(f"数据生成完成，用时 {time.perf_counter() - started:.1f}s")
+
+        counter = StatementCounter()
+        counter.install()
+        results = asyncio.run(drive(args, dataset, counter))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "db_async": os.getenv("DB_ASYNC", "false"),
+            "sqlite_profile": os.getenv("SQLITE_PROFILE"),
+            "params": {
+                key: getattr(args, key)
+                for key in ("couples", "tasks", "checkins", "days", "like_ratio", "comment_ratio", "seed",
+                            "requests", "concurrency", "transport")
+            },
+        },
+        "scenarios": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_table(results)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
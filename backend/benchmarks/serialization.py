@@ -0,0 +1,135 @@
+'''
+对比列表接口几种 JSON 序列化方式的单条耗时，以及其中有多少发生在事件循环上。
+
+用不落库的 ORM 对象构造一页时间线（TimelineCheckIn：打卡 + 用户和伴侣 + 图片 + 评论 + 点赞）。
+每种方式拆成几个阶段分别计时，结果是每条记录的平均微秒数；loop 列是 def 路由里落在事件循环上的那部分
+（FastAPI 在线程池里执行 def 路由和响应校验，但最后的 JSON 编码在事件循环上进行）：
+- jsonable_encoder：旧版 FastAPI 的做法，校验后 jsonable_encoder 转成 dict 再用标准库 json 编码；
+- orjson：校验后 dump_python(mode="json") 再用 orjson 编码（即 ORJSONResponse 的路径，需要安装 orjson）；
+- fastapi：现在的默认路径，线程池里校验（响应校验对已经是模型的列表几乎不花时间），事件循环上 dump_json；
+- fast_json：FAST_JSON=true 的路径，校验和 dump_json 都在路由所在的线程池里完成。
+
+用法（在仓库根目录执行）：
+    python -m backend.benchmarks.serialization --items 200 --rounds 50
+'''
+import argparse
+import datetime
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from backend import models, schemas, serialization
+
+try:
+    import orjson
+except ImportError:  # orjson 是可选的对比项
+    orjson = None
+
+RESPONSE_MODEL = list[schemas.TimelineCheckIn]
+
+
+def make_page(items: int, comments: int, likes: int) -> list[models.CheckIn]:
+    '''一页时间线：情侣两人交替打卡，每条打卡带两张图片、若干评论和点赞'''
+    now = datetime.datetime.now()
+    alice = models.User(id=1, username="alice", score=42, invitation_code="ALICE001", bind_date=now)
+    bob = models.User(id=2, username="bob", score=17, invitation_code="BOB00001", bind_date=now)
+    alice.partner_id, bob.partner_id = bob.id, alice.id
+    alice.partner, bob.partner = bob, alice
+    users = (alice, bob)
+
+    page = []
+    for i in range(items):
+        owner, partner = users[i % 2], users[(i + 1) % 2]
+        check_in = models.CheckIn(
+            id=i + 1, task_id=1, user_id=owner.id, user=owner, timestamp=now - datetime.timedelta(minutes=i),
+            text=f"打卡 {i}", like_count=likes, comment_count=comments,
+        )
+        check_in.images = [
+            models.CheckInImage(
+                id=i * 2 + n, check_in_id=i + 1, position=n, original=f"ab/cd/{i:04d}{n}.jpg",
+                thumb=f"ab/cd/{i:04d}{n}.thumb.webp", medium=f"ab/cd/{i:04d}{n}.medium.webp", width=1280, height=960,
+            )
+            for n in range(2)
+        ]
+        check_in.comments = [
+            models.Comment(id=i * comments + n, check_in_id=i + 1, user_id=partner.id, user=partner, content="好棒！", timestamp=now)
+            for n in range(comments)
+        ]
+        check_in.likes = [
+            models.Like(id=i * likes + n, check_in_id=i + 1, user_id=partner.id, user=partner, timestamp=now)
+            for n in range(likes)
+        ]
+        page.append(check_in)
+    return page
+
+
+def validate(adapter: TypeAdapter, page):
+    return adapter.validate_python(page, from_attributes=True)
+
+
+def strategies(adapter: TypeAdapter) -> dict:
+    '''方式 -> [(阶段函数, 是否在事件循环上)]；每个阶段接收上一阶段的输出'''
+    result = {
+        "jsonable_encoder": [
+            (lambda page: validate(adapter, page), False),
+            (lambda models: json.dumps(jsonable_encoder(models)).encode(), True),
+        ],
+        "fastapi": [
+            (lambda page: validate(adapter, page), False),
+            (lambda models: validate(adapter, models), False),
+            (adapter.dump_json, True),
+        ],
+        "fast_json": [
+            (lambda page: serialization.dump_json(page, RESPONSE_MODEL), False),
+        ],
+    }
+    if orjson is not None:
+        result["orjson"] = [
+            (lambda page: validate(adapter, page), False),
+            (lambda models: orjson.dumps(adapter.dump_python(models, mode="json")), True),
+        ]
+    return result
+
+
+def measure(stages, page, rounds: int) -> dict:
+    '''逐个阶段计时（先预热一轮），返回每条记录的总耗时、事件循环上的耗时（微秒）和输出字节数'''
+    total = on_loop = 0.0
+    value = page
+    for stage, loop in stages:
+        stage(value)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            result = stage(value)
+        elapsed = (time.perf_counter() - started) / rounds / len(page) * 1e6
+        total += elapsed
+        on_loop += elapsed if loop else 0.0
+        value = result
+    return {"us_per_item": round(total, 2), "loop_us_per_item": round(on_loop, 2), "bytes": len(value)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比列表接口的 JSON 序列化方式")
+    parser.add_argument("--items", type=int, default=200, help="每页的打卡条数")
+    parser.add_argument("--comments", type=int, default=3, help="每条打卡的评论数")
+    parser.add_argument("--likes", type=int, default=1, help="每条打卡的点赞数")
+    parser.add_argument("--rounds", type=int, default=50, help="每种方式重复的次数")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    page = make_page(args.items, args.comments, args.likes)
+    rows = [
+        {"method": name, **measure(stages, page, args.rounds)}
+        for name, stages in strategies(TypeAdapter(RESPONSE_MODEL)).items()
+    ]
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+    print(f"{'method':<20}{'us/item':>12}{'loop us/item':>14}{'bytes':>12}")
+    for row in rows:
+        print(f"{row['method']:<20}{row['us_per_item']:>12}{row['loop_us_per_item']:>14}{row['bytes']:>12}")
+
+
+if __name__ == "__main__":
+    main()
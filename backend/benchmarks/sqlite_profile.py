@@ -0,0 +1,143 @@
+'''
+对比 SQLITE_PROFILE 开/关时的 SQLite 读写吞吐。
+
+模拟 README 里 gunicorn 多 worker 共用一个数据库文件的场景：启动若干个进程，
+每个进程在固定时长内循环执行"按任务倒序读取一页打卡"和"写一条打卡并提交"，
+统计每秒完成的读/写次数以及 "database is locked" 错误数。
+
+用法（在仓库根目录执行）：
+    python -m backend.benchmarks.sqlite_profile --workers 4 --duration 10 --write-ratio 0.2
+'''
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.exc import OperationalError
+
+from backend import models
+from backend.database import Base, apply_sqlite_profile, pool_options
+
+TASK_COUNT = 10
+USER_COUNT = 2
+SEED_CHECKINS = 2000
+PAGE_SIZE = 50
+
+
+def make_engine(db_path: str, profile: str):
+    url = f"sqlite:///{db_path}"
+    engine = create_engine(url, connect_args={"check_same_thread": False}, **pool_options(profile, url))
+    apply_sqlite_profile(engine, profile)
+    return engine
+
+
+def seed(db_path: str, profile: str):
+    engine = make_engine(db_path, profile)
+    Base.metadata.create_all(bind=engine)
+    now = datetime.datetime.now()
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"id": i + 1, "username": f"bench{i}", "hashed_password": "x", "score": 0} for i in range(USER_COUNT)
+        ])
+        conn.execute(insert(models.Task), [
+            {"id": i + 1, "title": f"task{i}", "description": "", "is_active": True, "creator_id": 1} for i in range(TASK_COUNT)
+        ])
+        conn.execute(insert(models.CheckIn), [
+            {
+                "task_id": i % TASK_COUNT + 1,
+                "user_id": i % USER_COUNT + 1,
+                "timestamp": now - datetime.timedelta(seconds=i),
+                "text": "seed",
+            }
+            for i in range(SEED_CHECKINS)
+        ])
+    engine.dispose()
+
+
+def worker(db_path: str, profile: str, duration: float, write_ratio: float, seed_value: int, results):
+    rng = random.Random(seed_value)
+    engine = make_engine(db_path, profile)
+    check_ins = models.CheckIn.__table__
+    reads = writes = locked = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        task_id = rng.randint(1, TASK_COUNT)
+        try:
+            if rng.random() < write_ratio:
+                with engine.begin() as conn:
+                    conn.execute(insert(check_ins).values(
+                        task_id=task_id,
+                        user_id=rng.randint(1, USER_COUNT),
+                        timestamp=datetime.datetime.now(),
+                        text="bench",
+                    ))
+                writes += 1
+            else:
+                with engine.connect() as conn:
+                    conn.execute(
+                        select(check_ins)
+                        .where(check_ins.c.task_id == task_id)
+                        .order_by(check_ins.c.timestamp.desc(), check_ins.c.id.desc())
+                        .limit(PAGE_SIZE)
+                    ).all()
+                reads += 1
+        except OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            locked += 1
+    engine.dispose()
+    results.put({"reads": reads, "writes": writes, "locked": locked})
+
+
+def run(profile: str, workers: int, duration: float, write_ratio: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        seed(db_path, profile)
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        procs = [
+            ctx.Process(target=worker, args=(db_path, profile, duration, write_ratio, i, results))
+            for i in range(workers)
+        ]
+        for p in procs:
+            p.start()
+        totals = {"reads": 0, "writes": 0, "locked": 0}
+        for _ in procs:
+            for key, value in results.get().items():
+                totals[key] += value
+        for p in procs:
+            p.join()
+    return {
+        "profile": profile,
+        "workers": workers,
+        "duration_s": duration,
+        "reads_per_s": round(totals["reads"] / duration, 1),
+        "writes_per_s": round(totals["writes"] / duration, 1),
+        "locked_errors": totals["locked"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比 SQLite 生产调优配置开/关时的读写吞吐")
+    parser.add_argument("--workers", type=int, default=4, help="并发进程数（对应 gunicorn worker 数）")
+    parser.add_argument("--duration", type=float, default=10.0, help="每种配置压测的秒数")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="写操作占比")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    rows = [run(profile, args.workers, args.duration, args.write_ratio) for profile in ("default", "production")]
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+    print(f"{'profile':<12}{'reads/s':>12}{'writes/s':>12}{'locked':>10}")
+    for row in rows:
+        print(f"{row['profile']:<12}{row['reads_per_s']:>12}{row['writes_per_s']:>12}{row['locked_errors']:>10}")
+
+
+if __name__ == "__main__":
+    main()
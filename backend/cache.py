@@ -0,0 +1,83 @@
+# 进程内缓存工具。
+# 这里的缓存只存在于当前进程（每个 gunicorn worker 各有一份），写操作只能让本进程的缓存失效，
+# 所以放进来的数据都要配一个较短的 TTL，让其他 worker 上的旧数据最多只存活 TTL 这么久。
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    '''
+    线程安全的 LRU + TTL 缓存。
+    - maxsize: 最多保存多少条，超出时淘汰最久未使用的一条。
+    - ttl: 默认过期秒数；set() 时可以为单条数据单独指定更短的过期时间，ttl=None 表示永不过期（只会被 LRU 淘汰）。
+    - hits / misses: 命中与未命中计数，用来在压测时确认缓存是否生效。
+    '''
+
+    def __init__(self, maxsize: int, ttl: float | None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()  # key -> (过期时间点, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        '''读取缓存，过期或不存在时返回 default'''
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float | None = -1):
+        '''写入缓存；ttl 默认使用构造时的 TTL'''
+        if self.maxsize <= 0:
+            return
+        if ttl == -1:
+            ttl = self.ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        '''删除一条缓存（用于写操作后的失效）'''
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return None if entry is None else entry[1]
+
+    def pop_where(self, predicate) -> int:
+        '''删除所有 predicate(key) 为真的缓存，返回删除的条数（用于按条件批量失效）'''
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        '''返回命中率等统计信息'''
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+    def __len__(self):
+        return len(self._data)
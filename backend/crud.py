@@ -13,9 +13,12 @@
 # - db.add() : 将新创建的对象添加到数据库会话中。
 # - db.delete() : 将对象从数据库会话中删除。
 
-from sqlalchemy.orm import Session, joinedload
-from . import models, schemas, auth
-from datetime import date, datetime, time
+from sqlalchemy import and_, distinct, func, select, tuple_, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, selectinload
+from . import models, schemas, auth, dashboard, etags, events
+from datetime import date, datetime, time, timedelta
+import pytz
 import secrets
 import string
 
@@ -46,9 +49,10 @@ def get_user_by_invitation_code(db: Session, invitation_code: str):
     return db.query(models.User).filter(models.User.invitation_code == invitation_code).first()
 
 
-def create_user(db: Session, user: schemas.UserCreate): # 创建用户。
-    '''创建一个新用户，将用户名和密码哈希后存储到数据库中。'''
-    hashed_password = auth.get_password_hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str | None = None): # 创建用户。
+    '''创建一个新用户，将用户名和密码哈希后存储到数据库中。调用方已经算好哈希（例如在密码哈希线程池里）时可以通过 hashed_password 传入。'''
+    if hashed_password is None:
+        hashed_password = auth.get_password_hash(user.password)
     invitation_code = generate_invitation_code(db)
     db_user = models.User(
         username=user.username, 
@@ -65,6 +69,7 @@ def update_user_refresh_token(db: Session, user: models.User, refresh_token: str
     '''更新用户的 Refresh Token。这通常在用户登录后调用，用于存储长效 Refresh Token。'''
     user.refresh_token = refresh_token
     db.commit()
+    auth.invalidate_cached_users(user)
     db.refresh(user)
     return user
 
@@ -92,7 +97,10 @@ def bind_partners(db: Session, user_a: models.User, user_b: models.User): # 绑
         user_b.bind_date = bind_time
         db.add(user_a)
         db.add(user_b)
+        bump_versions(db, etags.USERS)
         db.commit()
+        auth.invalidate_cached_users(user_a, user_b)
+        dashboard.invalidate_all()  # 仪表盘里的用户信息带着伴侣字段
         db.refresh(user_a)
         db.refresh(user_b)
         return user_a, user_b
@@ -105,21 +113,28 @@ def bind_partners(db: Session, user_a: models.User, user_b: models.User): # 绑
 # 任务 (Task) 相关的 CRUD 函数
 # ==================================================
 
+def _with_creator(query):
+    """schemas.Task 里嵌着创建者和创建者的伴侣，用 JOIN 一并取出，不在序列化时逐个懒加载"""
+    return query.options(joinedload(models.Task.creator).joinedload(models.User.partner))
+
+
 def get_task(db: Session, task_id: int): # 根据任务的唯一 ID 从数据库中精确查找并返回一个任务。
     """通过 ID 获取单个任务""" 
-    return db.query(models.Task).filter(models.Task.id == task_id).first()
+    return _with_creator(db.query(models.Task)).filter(models.Task.id == task_id).first()
 
 
 def get_tasks(db: Session, skip: int = 0, limit: int = 100): # 获取数据库中所有的任务列表，支持分页查询，这在未来任务数量增多时能有效提升性能。
     """获取所有任务（支持分页）"""
-    return db.query(models.Task).offset(skip).limit(limit).all()
+    return _with_creator(db.query(models.Task)).order_by(models.Task.id).offset(skip).limit(limit).all()
 
 
 def create_task(db: Session, task: schemas.TaskCreate, creator_id: int):
     """创建一个新任务"""
     db_task = models.Task(**task.model_dump(), creator_id=creator_id)
     db.add(db_task)
+    bump_versions(db, etags.TASKS)
     db.commit()
+    dashboard.invalidate_all()  # 任务是所有情侣共用的，每个仪表盘都要刷新
     db.refresh(db_task)
     return db_task
 
@@ -132,33 +147,196 @@ def update_task(db: Session, task_id: int, task_update: schemas.TaskUpdate):
     for key, value in update_data.items():
         setattr(db_task, key, value)
     db.add(db_task)
+    bump_versions(db, etags.TASKS)
     db.commit()
+    dashboard.invalidate_all()
     db.refresh(db_task)
     return db_task
 
-def get_checkins_by_task(db: Session, task_id: int):
-    """获取某个特定任务的所有打卡记录"""
-    return db.query(models.CheckIn).filter(models.CheckIn.task_id == task_id).order_by(models.CheckIn.timestamp.desc()).all()
+def get_checkins_by_task(
+    db: Session,
+    task_id: int,
+    user_ids: list[int] | None = None,
+    with_interactions: bool = False,
+    limit: int | None = None,
+    before: tuple[datetime, int] | None = None,
+):
+    """获取某个特定任务的打卡记录，按 (timestamp, id) 倒序
+
+    - user_ids: 只返回这些用户的打卡（例如当前用户和伴侣），为 None 时不过滤。
+    - with_interactions: 为 True 时一并预加载评论、点赞以及它们的用户，供时间线聚合接口使用。
+    - limit / before: 游标分页，只返回排序键严格小于 before=(timestamp, id) 的至多 limit 条记录。
+      配合 check_ins(task_id, timestamp, id) 复合索引，每一页的代价与任务的打卡总数无关。
+    """
+    # 打卡人及其伴侣直接 JOIN 进来，避免序列化 schemas.CheckIn.user 时逐条懒加载
+    query = db.query(models.CheckIn).options(
+        joinedload(models.CheckIn.user).joinedload(models.User.partner)
+    ).filter(models.CheckIn.task_id == task_id)
+    if user_ids is not None:
+        query = query.filter(models.CheckIn.user_id.in_(user_ids))
+    if with_interactions:
+        # selectinload 每个集合固定一条 IN 查询，总语句数与打卡条数无关
+        query = query.options(
+            selectinload(models.CheckIn.comments).joinedload(models.Comment.user).joinedload(models.User.partner),
+            selectinload(models.CheckIn.likes).joinedload(models.Like.user).joinedload(models.User.partner),
+        )
+    if before is not None:
+        query = query.filter(tuple_(models.CheckIn.timestamp, models.CheckIn.id) < tuple_(*before))
+    # id 作为第二排序键，保证同一秒内的多条打卡也有稳定的先后顺序
+    query = query.order_by(models.CheckIn.timestamp.desc(), models.CheckIn.id.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
 
 
 # ==================================================
 # 打卡 (Check-in) 相关的 CRUD 函数
 # ==================================================
 
-def create_check_in(db: Session, user_id: int, task_id: int, text_content: str | None, image_url: str | None):# 这是功能的核心之一。它为指定的用户和任务创建一个新的打卡记录，同时可以附带一条文字消息和一张图片的 URL。
-    """为指定用户和任务创建一个新的打卡记录"""
+def get_check_in(db: Session, check_in_id: int):
+    """通过 ID 获取单条打卡记录"""
+    return db.query(models.CheckIn).filter(models.CheckIn.id == check_in_id).first()
+
+
+def create_check_in(db: Session, user_id: int, task_id: int, text_content: str | None, images=()):# 这是功能的核心之一。它为指定的用户和任务创建一个新的打卡记录，同时可以附带一条文字消息和最多三张图片。
+    """为指定用户和任务创建一个新的打卡记录；images 是本次上传的图片（uploads.StoredImage），在同一个事务里登记图片并增加文件的引用计数"""
     db_check_in = models.CheckIn(
         user_id=user_id,
         task_id=task_id,
         text=text_content,
-        image_url=image_url
+        images=[
+            models.CheckInImage(
+                position=position, original=image.url, sha256=image.sha256, size=image.size, mime_type=image.mime_type
+            )
+            for position, image in enumerate(images)
+        ],
     )
+    for image in images:
+        _acquire_media_blob(db, image)
     db.add(db_check_in)
+    couple = _couple_of(db, user_id)
+    bump_versions(db, etags.task_scope(task_id), etags.couple_scope(*couple))
     db.commit()
     db.refresh(db_check_in)
+    dashboard.invalidate_user_day(user_id, db_check_in.timestamp.date())
+    events.publish(*couple, "check_in.created", db_check_in, schemas.CheckIn)
     return db_check_in
 
 
+def _couple_of(db: Session, user_id: int) -> tuple[int, int | None]:
+    """(用户, 伴侣) 的 id，用来确定事件推送的频道；要在 commit 之前调用，当前用户通常已在会话里，不需要查询"""
+    user = db.get(models.User, user_id)
+    return user_id, user.partner_id if user is not None else None
+
+
+def _acquire_media_blob(db: Session, blob):
+    """给一个内容寻址文件的引用计数加一，第一次引用时登记这个文件（不提交）"""
+    updated = db.query(models.MediaBlob).filter(models.MediaBlob.sha256 == blob.sha256).update(
+        {models.MediaBlob.ref_count: models.MediaBlob.ref_count + 1, models.MediaBlob.released_at: None},
+        synchronize_session=False,
+    )
+    if updated:
+        return
+    try:
+        # 另一个请求可能同时在登记同一个文件，用 SAVEPOINT 包住插入，冲突时退回到加一
+        with db.begin_nested():
+            db.add(models.MediaBlob(
+                sha256=blob.sha256, path=blob.path, size=blob.size, mime_type=blob.mime_type, ref_count=1
+            ))
+    except IntegrityError:
+        db.query(models.MediaBlob).filter(models.MediaBlob.sha256 == blob.sha256).update(
+            {models.MediaBlob.ref_count: models.MediaBlob.ref_count + 1, models.MediaBlob.released_at: None},
+            synchronize_session=False,
+        )
+
+
+def _release_media_blob(db: Session, sha256: str):
+    """给一个内容寻址文件的引用计数减一（不提交）；减到 0 时记下时间，文件留给 uploads.collect_garbage 在宽限期后清理"""
+    blob = db.query(models.MediaBlob).filter(models.MediaBlob.sha256 == sha256)
+    blob.update({models.MediaBlob.ref_count: models.MediaBlob.ref_count - 1}, synchronize_session=False)
+    blob.filter(models.MediaBlob.ref_count <= 0).update(
+        {models.MediaBlob.released_at: datetime.now(pytz.timezone('Asia/Shanghai'))}, synchronize_session=False
+    )
+
+
+def delete_check_in(db: Session, check_in_id: int, user_id: int):
+    """删除打卡（只能删除自己的打卡），连同它的评论、点赞和图片登记，并释放图片文件的引用"""
+    check_in = db.query(models.CheckIn).filter(
+        models.CheckIn.id == check_in_id,
+        models.CheckIn.user_id == user_id
+    ).first()
+    if check_in is None:
+        return False
+    for image in check_in.images:
+        if image.sha256 is not None:
+            _release_media_blob(db, image.sha256)
+    db.query(models.Comment).filter(models.Comment.check_in_id == check_in_id).delete(synchronize_session=False)
+    db.query(models.Like).filter(models.Like.check_in_id == check_in_id).delete(synchronize_session=False)
+    db.delete(check_in)
+    couple = _couple_of(db, user_id)
+    bump_versions(
+        db, etags.task_scope(check_in.task_id), etags.couple_scope(*couple), etags.check_in_scope(check_in_id)
+    )
+    db.commit()
+    dashboard.invalidate_user_day(user_id, check_in.timestamp.date())
+    events.publish(*couple, "check_in.deleted", {"id": check_in_id, "task_id": check_in.task_id, "user_id": user_id})
+    return True
+
+
+def get_media_blob_hashes(db: Session, hashes: list[str]) -> set[str]:
+    """hashes 里已经在 media_blobs 登记过的那些"""
+    return {row.sha256 for row in db.query(models.MediaBlob.sha256).filter(models.MediaBlob.sha256.in_(hashes))}
+
+
+def delete_released_media_blobs(db: Session, grace_seconds: float) -> list[str]:
+    """
+    删除引用计数为 0 且已经超过宽限期的文件登记，返回被删除的 sha256（对应的文件由调用方删除）。
+    删除条件里再检查一次 ref_count = 0：期间又被引用的文件不会被删掉。
+    """
+    cutoff = datetime.now(pytz.timezone('Asia/Shanghai')) - timedelta(seconds=grace_seconds)
+    unused = (models.MediaBlob.ref_count <= 0, models.MediaBlob.released_at < cutoff)
+    hashes = [row.sha256 for row in db.query(models.MediaBlob.sha256).filter(*unused)]
+    deleted = []
+    for sha256 in hashes:
+        if db.query(models.MediaBlob).filter(models.MediaBlob.sha256 == sha256, *unused).delete(synchronize_session=False):
+            deleted.append(sha256)
+    db.commit()
+    return deleted
+
+
+def set_check_in_image_variants(db: Session, check_in_id: int, variants: list[dict]):
+    """记录后台生成的缩略图地址和图片尺寸；variants 与打卡图片按 position 一一对应，每项可以包含 thumb、medium、width、height"""
+    check_in = db.get(models.CheckIn, check_in_id)
+    if check_in is None:
+        return None
+    for image, variant in zip(check_in.images, variants):
+        for field in ("thumb", "medium", "width", "height"):
+            if field in variant:
+                setattr(image, field, variant[field])
+    couple = _couple_of(db, check_in.user_id)
+    bump_versions(db, etags.task_scope(check_in.task_id), etags.couple_scope(*couple))
+    db.commit()
+    dashboard.invalidate_user_day(check_in.user_id, check_in.timestamp.date())
+    events.publish(*couple, "check_in.updated", {
+        "id": check_in.id,
+        "task_id": check_in.task_id,
+        "images": [schemas.CheckInImage.model_validate(image).model_dump(mode="json") for image in check_in.images],
+    })
+    return check_in
+
+
+def get_media_usage(db: Session, user_id: int):
+    """某个用户所有打卡图片的数量、总字节数和不重复的文件数（同一张图片多次打卡只占一份存储）"""
+    image_count, total_bytes, blob_count = db.query(
+        func.count(models.CheckInImage.id),
+        func.coalesce(func.sum(models.CheckInImage.size), 0),
+        func.count(distinct(models.CheckInImage.sha256)),
+    ).join(models.CheckIn, models.CheckIn.id == models.CheckInImage.check_in_id).filter(
+        models.CheckIn.user_id == user_id
+    ).one()
+    return schemas.MediaUsage(image_count=image_count, total_bytes=total_bytes, blob_count=blob_count)
+
+
 def get_check_ins_for_user_on_date(db: Session, user_id: int, target_date: date):
     """获取某个用户在特定一天的所有打卡记录"""
     start_of_day = datetime.combine(target_date, time.min)
@@ -172,6 +350,29 @@ def get_check_ins_for_user_on_date(db: Session, user_id: int, target_date: date)
 # 这是为"每日仪表盘"量身打造的函数。它能高效地查询出某个用户在 特定某一天 的所有打卡记录。为了实现这一点，它会根据传入的 target_date （日期），自动计算出那一天的开始时间（00:00:00）和结束时间（23:59:59），然后查询这个时间范围内的所有打卡数据。
 
 
+def get_daily_dashboard_rows(db: Session, user_ids: list[int], target_date: date):
+    """
+    每日仪表盘的数据：一次查询取出所有任务，以及 user_ids 这些用户在 target_date 当天的打卡。
+    tasks LEFT JOIN check_ins，返回 (Task, CheckIn | None) 列表；一个任务当天有多次打卡时会有多行，按打卡时间升序排列。
+    任务创建者、打卡用户以及他们的伴侣、打卡图片都在同一条 SQL 里 JOIN 出来，组装返回数据时不会再触发懒加载。
+    """
+    start_of_day = datetime.combine(target_date, time.min)
+    end_of_day = datetime.combine(target_date, time.max)
+    return db.query(models.Task, models.CheckIn).outerjoin(
+        models.CheckIn,
+        and_(
+            models.CheckIn.task_id == models.Task.id,
+            models.CheckIn.user_id.in_(user_ids),
+            models.CheckIn.timestamp >= start_of_day,
+            models.CheckIn.timestamp <= end_of_day,
+        ),
+    ).options(
+        joinedload(models.Task.creator).joinedload(models.User.partner),
+        joinedload(models.CheckIn.user).joinedload(models.User.partner),
+        joinedload(models.CheckIn.images),
+    ).order_by(models.Task.id, models.CheckIn.timestamp, models.CheckIn.id).all()
+
+
 # ==================================================
 # 评论 (Comment) 相关的 CRUD 函数
 # ==================================================
@@ -184,11 +385,23 @@ def create_comment(db: Session, user_id: int, check_in_id: int, content: str):
         content=content
     )
     db.add(db_comment)
+    couple = _couple_of(db, user_id)
+    owner_day = _count_reaction(db, check_in_id, "comment_count", 1, couple)
     db.commit()
+    _invalidate_owner_day(owner_day)
     db.refresh(db_comment)
+    events.publish(*couple, "comment.created", db_comment, schemas.Comment)
     return db_comment
 
 
+def get_comment_by_user(db: Session, check_in_id: int, user_id: int):
+    """获取某个用户对某条打卡记录的评论（每人每条打卡最多一条评论）"""
+    return db.query(models.Comment).filter(
+        models.Comment.check_in_id == check_in_id,
+        models.Comment.user_id == user_id
+    ).first()
+
+
 def get_comments_by_check_in(db: Session, check_in_id: int):
     """获取某个打卡记录的所有评论"""
     return db.query(models.Comment).filter(
@@ -204,7 +417,11 @@ def delete_comment(db: Session, comment_id: int, user_id: int):
     ).first()
     if comment:
         db.delete(comment)
+        couple = _couple_of(db, user_id)
+        owner_day = _count_reaction(db, comment.check_in_id, "comment_count", -1, couple)
         db.commit()
+        _invalidate_owner_day(owner_day)
+        events.publish(*couple, "comment.deleted", {"id": comment_id, "check_in_id": comment.check_in_id, "user_id": user_id})
         return True
     return False
 
@@ -214,23 +431,28 @@ def delete_comment(db: Session, comment_id: int, user_id: int):
 # ==================================================
 
 def create_like(db: Session, user_id: int, check_in_id: int):
-    """为指定的打卡记录点赞"""
-    # 检查是否已经点过赞
-    existing_like = db.query(models.Like).filter(
-        models.Like.user_id == user_id,
-        models.Like.check_in_id == check_in_id
-    ).first()
-    
-    if existing_like:
-        return None  # 已经点过赞了
-    
+    """为指定的打卡记录点赞；已经点过赞时返回 None"""
+    # 不先查再插：(user_id, check_in_id) 上有唯一索引，重复点赞（包括并发的两次请求）由数据库拒绝
     db_like = models.Like(
         user_id=user_id,
         check_in_id=check_in_id
     )
-    db.add(db_like)
+    couple = _couple_of(db, user_id)
+    # 先改计数和版本号：pysqlite 只在 INSERT/UPDATE/DELETE 之前隐式 BEGIN，不会在 SAVEPOINT 之前发出，
+    # 要先有一条 UPDATE 开启事务，下面的 SAVEPOINT 才在事务里面，否则 RELEASE 时点赞就单独提交了
+    owner_day = _count_reaction(db, check_in_id, "like_count", 1, couple)
+    try:
+        # 点赞单独放在一个 SAVEPOINT 里插入并 flush：重复点赞在这里就被拒绝，
+        # 不会拖到提交时才失败，也不会被 bump_versions 的 flush 当成版本号的插入冲突吞掉
+        with db.begin_nested():
+            db.add(db_like)
+    except IntegrityError:
+        db.rollback()  # 连同上面的计数和版本号一起回滚
+        return None  # 已经点过赞了
     db.commit()
+    _invalidate_owner_day(owner_day)
     db.refresh(db_like)
+    events.publish(*couple, "like.created", {"id": db_like.id, "check_in_id": check_in_id, "user_id": user_id})
     return db_like
 
 
@@ -243,11 +465,94 @@ def delete_like(db: Session, user_id: int, check_in_id: int):
     
     if like:
         db.delete(like)
+        couple = _couple_of(db, user_id)
+        owner_day = _count_reaction(db, check_in_id, "like_count", -1, couple)
         db.commit()
+        _invalidate_owner_day(owner_day)
+        events.publish(*couple, "like.deleted", {"check_in_id": check_in_id, "user_id": user_id})
         return True
     return False
 
 
+
+def apply_like_actions(db: Session, user_id: int, actions: list[schemas.LikeAction]) -> list[dict]:
+    """
+    批量点赞/取消点赞，所有改动在一个事务里只提交一次，返回每一项的结果（见 schemas.LikeActionResult）。
+    查询条数与条目数无关：一条 IN 查询取出涉及的打卡并校验归属，一条查询取出已有的点赞，
+    然后一次批量插入、一条 DELETE、每个方向一条 UPDATE 调整点赞数。同一条打卡出现多次时按顺序生效。
+    """
+    couple = _couple_of(db, user_id)
+    check_in_ids = {action.check_in_id for action in actions}
+    for attempt in range(2):
+        check_ins = {
+            row.id: row
+            for row in db.query(
+                models.CheckIn.id, models.CheckIn.user_id, models.CheckIn.task_id, models.CheckIn.timestamp
+            ).filter(models.CheckIn.id.in_(check_in_ids))
+        }
+        liked_before = {
+            row.check_in_id
+            for row in db.query(models.Like.check_in_id).filter(
+                models.Like.user_id == user_id, models.Like.check_in_id.in_(check_in_ids)
+            )
+        }
+        liked = set(liked_before)
+        results = []
+        for action in actions:
+            check_in_id = action.check_in_id
+            row = check_ins.get(check_in_id)
+            if row is None:
+                status = "not_found"
+            elif row.user_id not in couple:
+                status = "forbidden"
+            elif action.action == "like":
+                status = "already_liked" if check_in_id in liked else "liked"
+                liked.add(check_in_id)
+            else:
+                status = "unliked" if check_in_id in liked else "not_liked"
+                liked.discard(check_in_id)
+            results.append({"check_in_id": check_in_id, "action": action.action, "status": status})
+
+        added = liked - liked_before
+        removed = liked_before - liked
+        if not added and not removed:
+            return results
+        changed = [check_ins[check_in_id] for check_in_id in sorted(added | removed)]
+        # 先更新版本号再添加点赞（原因见 create_like）
+        bump_versions(db, etags.couple_scope(*couple), *sorted(
+            {etags.task_scope(row.task_id) for row in changed} | {etags.check_in_scope(row.id) for row in changed}
+        ))
+        for delta, check_in_ids_changed in ((1, added), (-1, removed)):
+            if check_in_ids_changed:
+                db.query(models.CheckIn).filter(models.CheckIn.id.in_(check_in_ids_changed)).update(
+                    {models.CheckIn.like_count: models.CheckIn.like_count + delta}, synchronize_session=False
+                )
+        if removed:
+            db.query(models.Like).filter(
+                models.Like.user_id == user_id, models.Like.check_in_id.in_(removed)
+            ).delete(synchronize_session=False)
+        new_likes = [models.Like(user_id=user_id, check_in_id=check_in_id) for check_in_id in sorted(added)]
+        db.add_all(new_likes)
+        try:
+            db.flush()
+        except IntegrityError:
+            # 另一个请求刚好同时点了其中某一条的赞：整批回滚，重新读取点赞状态再来一次
+            db.rollback()
+            if attempt:
+                raise
+            continue
+        created = [(like.id, like.check_in_id) for like in new_likes]
+        db.commit()
+        break
+
+    for owner_day in {(row.user_id, row.timestamp.date()) for row in changed}:
+        dashboard.invalidate_user_day(*owner_day)
+    for like_id, check_in_id in created:
+        events.publish(*couple, "like.created", {"id": like_id, "check_in_id": check_in_id, "user_id": user_id})
+    for check_in_id in sorted(removed):
+        events.publish(*couple, "like.deleted", {"check_in_id": check_in_id, "user_id": user_id})
+    return results
+
 def get_likes_by_check_in(db: Session, check_in_id: int):
     """获取某个打卡记录的所有点赞"""
     return db.query(models.Like).filter(
@@ -256,7 +561,243 @@ def get_likes_by_check_in(db: Session, check_in_id: int):
 
 
 def get_like_count_by_check_in(db: Session, check_in_id: int):
-    """获取某个打卡记录的点赞数量"""
-    return db.query(models.Like).filter(
-        models.Like.check_in_id == check_in_id
-    ).count()
+    """获取某个打卡记录的点赞数量（读冗余的 like_count 列，不做 COUNT）"""
+    return db.query(models.CheckIn.like_count).filter(models.CheckIn.id == check_in_id).scalar() or 0
+
+
+def _count_reaction(db: Session, check_in_id: int, counter: str, delta: int, couple: tuple[int, int | None]):
+    """
+    点赞/评论增删的公共部分（不提交）：在 SQL 里给打卡的 like_count 或 comment_count 加 delta（UPDATE ... SET x = x + :delta，
+    并发的点赞不会互相覆盖），并更新读接口的版本号——打卡数据里带着这两个计数，所以任务的打卡列表也要更新。
+    返回 (打卡用户, 打卡日期)，提交后交给 _invalidate_owner_day 失效那一天的仪表盘缓存。
+    """
+    check_in = db.get(models.CheckIn, check_in_id)  # 路由已经查过这条打卡，通常直接从会话里取，不需要查询
+    if check_in is None:
+        bump_versions(db, etags.couple_scope(*couple), etags.check_in_scope(check_in_id))
+        return None
+    setattr(check_in, counter, getattr(models.CheckIn, counter) + delta)
+    bump_versions(
+        db, etags.task_scope(check_in.task_id), etags.couple_scope(*couple), etags.check_in_scope(check_in_id)
+    )
+    return check_in.user_id, check_in.timestamp.date()
+
+
+def _invalidate_owner_day(owner_day):
+    if owner_day is not None:
+        dashboard.invalidate_user_day(*owner_day)
+
+
+def recount_reactions(db: Session, batch_size: int = 1000) -> int:
+    """
+    按 likes、comments 表重新统计所有打卡的 like_count / comment_count，返回修正的打卡条数。
+    按 id 分批：每批先找出计数不一致的打卡，只更新这些行，每批一个事务，不会长时间锁住整张表。
+    """
+    like_counts = db.query(func.count(models.Like.id)).filter(
+        models.Like.check_in_id == models.CheckIn.id
+    ).scalar_subquery()
+    comment_counts = db.query(func.count(models.Comment.id)).filter(
+        models.Comment.check_in_id == models.CheckIn.id
+    ).scalar_subquery()
+    fixed = 0
+    last_id = 0
+    while True:
+        ids = [row.id for row in db.query(models.CheckIn.id).filter(
+            models.CheckIn.id > last_id
+        ).order_by(models.CheckIn.id).limit(batch_size)]
+        if not ids:
+            return fixed
+        last_id = ids[-1]
+        stale = db.query(
+            models.CheckIn.id, models.CheckIn.task_id, models.CheckIn.user_id, like_counts, comment_counts
+        ).filter(
+            models.CheckIn.id.in_(ids),
+            (models.CheckIn.like_count != like_counts) | (models.CheckIn.comment_count != comment_counts),
+        ).all()
+        if not stale:
+            continue
+        db.bulk_update_mappings(models.CheckIn, [
+            {"id": row[0], "like_count": row[3], "comment_count": row[4]} for row in stale
+        ])
+        scopes = set()
+        for check_in_id, task_id, user_id, _, _ in stale:
+            scopes.add(etags.task_scope(task_id))
+            scopes.add(etags.check_in_scope(check_in_id))
+            scopes.add(etags.couple_scope(*_couple_of(db, user_id)))
+        bump_versions(db, *sorted(scopes))
+        db.commit()
+        fixed += len(stale)
+
+
+# ==================================================
+# 得分申请 (ScoreRequest) 相关的 CRUD 函数
+# ==================================================
+
+def create_score_request(db: Session, requester_id: int, target_id: int, points: int, reason: str):
+    """创建一条待审批的得分申请"""
+    db_request = models.ScoreRequest(
+        requester_id=requester_id,
+        target_id=target_id,
+        points=points,
+        reason=reason,
+        status="pending"
+    )
+    db.add(db_request)
+    bump_versions(db, etags.couple_scope(requester_id, target_id))
+    db.commit()
+    db.refresh(db_request)
+    events.publish(requester_id, target_id, "score_request.created", _score_request_event(db_request))
+    return db_request
+
+
+def _score_request_event(score_request: models.ScoreRequest) -> dict:
+    return {
+        "id": score_request.id,
+        "requester_id": score_request.requester_id,
+        "target_id": score_request.target_id,
+        "points": score_request.points,
+        "reason": score_request.reason,
+        "status": score_request.status,
+    }
+
+
+def get_score_request(db: Session, request_id: int):
+    """通过 ID 获取得分申请"""
+    return db.query(models.ScoreRequest).filter(models.ScoreRequest.id == request_id).first()
+
+
+def get_score_requests_for_user(
+    db: Session,
+    user_id: int,
+    status: str | None = None,
+    direction: str = "all",
+    limit: int | None = None,
+    before: tuple[datetime, int] | None = None,
+):
+    """获取与某个用户相关的得分申请，按 (timestamp, id) 倒序
+
+    - status: 只返回这个状态（pending / approved / rejected）的申请，为 None 时不过滤。
+    - direction: incoming 收到的（我是被申请人）、outgoing 发出的（我是申请人）、all 两者都要。
+    - limit / before: 游标分页，与 get_checkins_by_task 相同。
+    all 不用 requester_id = ? OR target_id = ?（数据库往往只能全表扫描后排序），而是两个方向各走一个复合索引、
+    各取至多 limit 条，UNION ALL 之后再取前 limit 条。申请人和被申请人（及其伴侣）每页各用一条 IN 查询加载。
+    """
+    columns = {
+        "incoming": [models.ScoreRequest.target_id],
+        "outgoing": [models.ScoreRequest.requester_id],
+        "all": [models.ScoreRequest.requester_id, models.ScoreRequest.target_id],
+    }[direction]
+    order_by = (models.ScoreRequest.timestamp.desc(), models.ScoreRequest.id.desc())
+
+    def matching(query, column):
+        query = query.filter(column == user_id)
+        if status is not None:
+            query = query.filter(models.ScoreRequest.status == status)
+        if before is not None:
+            query = query.filter(tuple_(models.ScoreRequest.timestamp, models.ScoreRequest.id) < tuple_(*before))
+        return query.order_by(*order_by).limit(limit)
+
+    query = db.query(models.ScoreRequest).options(
+        selectinload(models.ScoreRequest.requester).joinedload(models.User.partner),
+        selectinload(models.ScoreRequest.target).joinedload(models.User.partner),
+    )
+    if len(columns) == 1:
+        return matching(query, columns[0]).all()
+    branches = [matching(db.query(models.ScoreRequest.id), column).subquery() for column in columns]
+    ids = union_all(*(select(branch.c.id) for branch in branches))
+    return query.filter(models.ScoreRequest.id.in_(ids)).order_by(*order_by).limit(limit).all()
+
+
+def count_pending_score_requests(db: Session, user_id: int) -> int:
+    """等待这个用户审批的申请数（只在索引上计数，不取出任何行），用于前端的角标"""
+    return db.query(func.count(models.ScoreRequest.id)).filter(
+        models.ScoreRequest.target_id == user_id,
+        models.ScoreRequest.status == "pending",
+    ).scalar()
+
+def respond_to_score_request(db: Session, score_request: models.ScoreRequest, approve: bool) -> bool:
+    """
+    审批得分申请，返回这次调用是否完成了审批；申请已经不是 pending（被并发的另一次审批抢先）时返回 False，不做任何修改。
+    - 状态用条件更新切换：UPDATE score_requests SET status=... WHERE id=... AND status='pending'，
+      两个请求（包括不同 worker 上的）同时审批同一条申请时只有一个能更新到这一行，不会重复加分；
+    - 加分在 SQL 里完成：UPDATE users SET score = score + :points，不会覆盖同时发生的其他加分；
+    - 每次加分追加一条得分流水，和状态切换、加分在同一个事务里提交。
+    整个过程只锁住这条申请和申请人两行，不需要先 SELECT ... FOR UPDATE。
+    """
+    new_status = "approved" if approve else "rejected"
+    transitioned = db.query(models.ScoreRequest).filter(
+        models.ScoreRequest.id == score_request.id,
+        models.ScoreRequest.status == "pending",
+    ).update({models.ScoreRequest.status: new_status}, synchronize_session=False)
+    if not transitioned:
+        return False
+
+    requester_id, target_id = score_request.requester_id, score_request.target_id
+    event = {**_score_request_event(score_request), "status": new_status}
+    scopes = [etags.couple_scope(requester_id, target_id)]
+    changed_users = []
+    if approve:
+        db.query(models.User).filter(models.User.id == requester_id).update(
+            {models.User.score: models.User.score + score_request.points}, synchronize_session=False
+        )
+        db.add(models.ScoreLedgerEntry(
+            user_id=requester_id,
+            delta=score_request.points,
+            kind="score_request",
+            score_request_id=score_request.id,
+        ))
+        # 认证缓存按用户名失效，提交前取出；申请人和被申请人通常已经在会话里
+        changed_users = [db.get(models.User, requester_id), db.get(models.User, target_id)]
+        scopes.append(etags.USERS)
+    bump_versions(db, *scopes)
+    db.commit()
+    events.publish(requester_id, target_id, "score_request.responded", event)
+    if approve:
+        # 申请人的得分变了；被申请人的 partner.score 里也带着这个分数，两边的认证缓存都要失效
+        auth.invalidate_cached_users(*changed_users)
+        # 仪表盘里的任务创建者、打卡用户都带着得分，哪些仪表盘包含申请人无从得知，只能全部失效
+        dashboard.invalidate_all()
+    return True
+
+
+def replay_score_ledger(db: Session) -> int:
+    """按得分流水重算所有用户的 score（一条 UPDATE，只改不一致的行），返回被修正的用户数"""
+    ledger_sum = db.query(func.coalesce(func.sum(models.ScoreLedgerEntry.delta), 0)).filter(
+        models.ScoreLedgerEntry.user_id == models.User.id
+    ).scalar_subquery()
+    fixed = db.query(models.User).filter(models.User.score != ledger_sum).update(
+        {models.User.score: ledger_sum}, synchronize_session=False
+    )
+    if fixed:
+        bump_versions(db, etags.USERS)
+    db.commit()
+    return fixed
+
+
+# ==================================================
+# 读接口的版本号（见 etags 模块）
+# ==================================================
+
+def bump_versions(db: Session, *scopes: str):
+    """给这些范围的版本号加一（不提交）：要和数据的修改放在同一个事务里，一起提交或回滚"""
+    for scope in scopes:
+        updated = db.query(models.VersionStamp).filter(models.VersionStamp.scope == scope).update(
+            {models.VersionStamp.version: models.VersionStamp.version + 1}, synchronize_session=False
+        )
+        if updated:
+            continue
+        try:
+            # 第一次写这个范围；和 _acquire_media_blob 一样，并发插入冲突时退回到加一
+            with db.begin_nested():
+                db.add(models.VersionStamp(scope=scope, version=1))
+        except IntegrityError:
+            db.query(models.VersionStamp).filter(models.VersionStamp.scope == scope).update(
+                {models.VersionStamp.version: models.VersionStamp.version + 1}, synchronize_session=False
+            )
+
+
+def get_versions(db: Session, scopes: list[str]) -> list[int]:
+    """一次查询取回这些范围的版本号，顺序与 scopes 相同；从来没有写过的范围是 0"""
+    versions = dict(db.query(models.VersionStamp.scope, models.VersionStamp.version).filter(
+        models.VersionStamp.scope.in_(scopes)
+    ).all())
+    return [versions.get(scope, 0) for scope in scopes]
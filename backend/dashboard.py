@@ -0,0 +1,100 @@
+# 每日仪表盘的组装与缓存。
+# 仪表盘 = 所有任务 × (我, 伴侣) 当天的打卡状态。数据由 crud.get_daily_dashboard_rows 一条 SQL 查出，
+# 然后按 (情侣, 日期) 缓存一份与"谁在看"无关的快照，我和伴侣打开仪表盘时共用这一份，只是"我"和"伴侣"两列对调。
+# - 今天及以后的日期：缓存 DASHBOARD_CACHE_TTL_SECONDS 秒；任何一方打卡时显式失效。
+# - 过去的日期：打卡本身不会再变，但快照里还有点赞数、评论数、用户得分、伴侣信息和缩略图地址，这些之后仍会变化，
+#   而其他 worker 的写操作不会让本进程的缓存失效，所以缓存 DASHBOARD_PAST_CACHE_TTL_SECONDS 秒（比今天长，但有上限）。
+# - 新建/修改任务、绑定伴侣、审批加分会改变所有仪表盘里的任务或用户信息，这些写操作会清空整个缓存。
+# 与认证缓存一样，缓存是每个 worker 进程各一份，显式失效只作用于当前进程。
+# 为了让其他 worker 的写入也能生效，缓存键里带着仪表盘所依赖范围的版本号（tasks、users、情侣，见 etags）：
+# 任何一个版本号变了，旧快照就再也不会被命中，不会出现 ETag 是新的、内容却是旧快照的情况。
+import os
+from datetime import date, datetime
+
+import pytz
+from sqlalchemy.orm import Session
+
+from . import crud, models, schemas
+from .cache import TTLCache
+
+DASHBOARD_CACHE_ENABLED = os.getenv("DASHBOARD_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+DASHBOARD_CACHE_TTL_SECONDS = float(os.getenv("DASHBOARD_CACHE_TTL_SECONDS", "30"))
+DASHBOARD_PAST_CACHE_TTL_SECONDS = float(os.getenv("DASHBOARD_PAST_CACHE_TTL_SECONDS", "300"))
+DASHBOARD_CACHE_MAX_ENTRIES = int(os.getenv("DASHBOARD_CACHE_MAX_ENTRIES", "2048"))
+
+# 打卡时间按北京时间记录，"今天"也按北京时间算
+_beijing_tz = pytz.timezone('Asia/Shanghai')
+
+# (情侣, 日期, 版本号) -> (任务列表, {(task_id, user_id): 当天最后一次打卡})
+_dashboard_cache = TTLCache(
+    maxsize=DASHBOARD_CACHE_MAX_ENTRIES if DASHBOARD_CACHE_ENABLED else 0,
+    ttl=DASHBOARD_CACHE_TTL_SECONDS,
+)
+
+
+def _couple_key(user: models.User) -> tuple[int, ...]:
+    '''情侣双方共用的缓存键；未绑定伴侣时只有自己'''
+    return tuple(sorted(uid for uid in (user.id, user.partner_id) if uid is not None))
+
+
+def _assemble(snapshot, current_user: models.User, target_date: date) -> schemas.DailyDashboard:
+    '''把快照按当前用户的视角组装成仪表盘'''
+    tasks, check_ins = snapshot
+    return schemas.DailyDashboard(
+        date=target_date,
+        tasks_status=[
+            schemas.DailyCheckInStatus(
+                task=task,
+                user_checked_in=check_ins.get((task.id, current_user.id)),
+                partner_checked_in=check_ins.get((task.id, current_user.partner_id)),
+            )
+            for task in tasks
+        ],
+    )
+
+
+def get_cached_dashboard(
+    current_user: models.User, target_date: date, versions: list[int]
+) -> schemas.DailyDashboard | None:
+    '''命中缓存时直接返回仪表盘（不需要数据库），未命中返回 None；versions 是请求开始时读到的版本号'''
+    snapshot = _dashboard_cache.get((_couple_key(current_user), target_date, tuple(versions)))
+    if snapshot is None:
+        return None
+    return _assemble(snapshot, current_user, target_date)
+
+
+def build_daily_dashboard(
+    db: Session, current_user: models.User, target_date: date, versions: list[int]
+) -> schemas.DailyDashboard:
+    '''查询并组装某一天的仪表盘，同时按版本号写入缓存'''
+    couple = _couple_key(current_user)
+    key = (couple, target_date, tuple(versions))
+    tasks: dict[int, schemas.Task] = {}
+    check_ins: dict[tuple[int, int], schemas.CheckIn] = {}
+    for task, check_in in crud.get_daily_dashboard_rows(db, list(couple), target_date):
+        if task.id not in tasks:
+            tasks[task.id] = schemas.Task.model_validate(task)
+        if check_in is not None:
+            # 行按打卡时间升序，同一天多次打卡时保留最后一次
+            check_ins[(task.id, check_in.user_id)] = schemas.CheckIn.model_validate(check_in)
+
+    snapshot = (list(tasks.values()), check_ins)
+    if target_date < datetime.now(_beijing_tz).date():
+        _dashboard_cache.set(key, snapshot, ttl=DASHBOARD_PAST_CACHE_TTL_SECONDS)
+    else:
+        _dashboard_cache.set(key, snapshot)
+    return _assemble(snapshot, current_user, target_date)
+
+
+def invalidate_user_day(user_id: int, day: date):
+    '''某个用户在某天打了卡：让包含这个用户的当天仪表盘失效（只影响当前进程）'''
+    _dashboard_cache.pop_where(lambda key: key[1] == day and user_id in key[0])
+
+
+def invalidate_all():
+    '''任务或用户信息变化时清空所有仪表盘缓存'''
+    _dashboard_cache.clear()
+
+
+def dashboard_cache_stats() -> dict:
+    return _dashboard_cache.stats()
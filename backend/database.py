@@ -1,15 +1,120 @@
-from sqlalchemy import create_engine
+from functools import lru_cache
+import os
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+# 数据库配置在导入时就要读取环境变量，而本模块先于 auth 被导入，所以这里也尝试加载 .env（若安装了 python-dotenv）
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:
+    pass
+
+# 数据库地址，默认使用 SQLite，数据库文件名为 a_love_story.db。
+# 多节点部署时改成 PostgreSQL，例如 postgresql+psycopg2://heartbeat:heartbeat@db:5432/heartbeat（需要安装 psycopg2-binary）。
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./a_love_story.db")
+IS_SQLITE = make_url(SQLALCHEMY_DATABASE_URL).get_backend_name() == "sqlite"
+
+# 同步驱动 -> 对应的异步驱动，用于从 DATABASE_URL 推导 DB_ASYNC 模式使用的地址
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+
+def to_async_url(url: str) -> str:
+    '''把同步数据库地址换成同一个库的异步驱动地址；已经是异步驱动（如 psycopg 3）的地址原样返回'''
+    parsed = make_url(url)
+    backend, driver = parsed.get_backend_name(), parsed.get_driver_name()
+    if driver in ASYNC_DRIVERS.values() or driver == "psycopg":
+        return url
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"无法为数据库地址推导异步驱动：{parsed.drivername}，请设置 ASYNC_DATABASE_URL")
+    return parsed.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+# 是否启用异步数据库会话。开启后 async def 路由通过 AsyncSession（aiosqlite / asyncpg 等异步驱动）访问数据库，
+# 关闭时这些路由仍使用同步 Session，但数据库调用会被放到线程池里执行，两种模式都不会阻塞事件循环。
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
+
+# --- SQLite 生产环境调优 ---
+# SQLITE_PROFILE=production 时，每个新连接建立后执行下面这组 PRAGMA：
+# - journal_mode=WAL：写操作追加到 WAL 文件，读不阻塞写、写不阻塞读；多个 gunicorn worker 共用一个库文件时不再频繁 "database is locked"。
+# - synchronous=NORMAL：WAL 模式下只在 checkpoint 时 fsync，提交变快；断电最多丢失最近几次提交，不会损坏数据库。
+# - busy_timeout：遇到锁时最多等待这么多毫秒再报错，而不是立即失败。
+# - cache_size：每个连接的页缓存大小（负数表示 KiB）。
+# - mmap_size：用内存映射读数据库文件，减少 read() 系统调用和内存拷贝。
+# - temp_store=MEMORY：排序、临时索引等临时表放在内存里。
+# 默认（SQLITE_PROFILE=default）不做任何修改，保持 SQLite 的出厂行为。
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "default").lower()
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": "MEMORY",
+}
+# --- 连接池配置 ---
+# 常驻连接数、高峰时允许额外创建的连接数、取连接的最长等待秒数。
+# 多个 worker / 多台应用节点连同一个 PostgreSQL 时，总连接数约为 节点数 × worker 数 × (DB_POOL_SIZE + DB_MAX_OVERFLOW)，注意不要超过数据库的 max_connections。
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# pool_pre_ping：取出连接时先发一条轻量探测，自动丢弃被数据库或中间网络断开的连接
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# pool_recycle：连接存活超过这么多秒就重建，避免被数据库或负载均衡的空闲超时断开；-1 表示不回收
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+
+def pool_options(profile: str = SQLITE_PROFILE, url: str = SQLALCHEMY_DATABASE_URL) -> dict:
+    '''
+    引擎的连接池参数。
+    SQLite 只在生产配置下调整连接池，默认配置下返回空字典，沿用 SQLAlchemy 的默认连接池；
+    其他数据库（PostgreSQL 等）总是使用这里配置的连接池。
+    '''
+    if make_url(url).get_backend_name() == "sqlite" and profile != "production":
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
 
-# 使用SQLite数据库，数据库文件名为 a_love_story.db
-SQLALCHEMY_DATABASE_URL = "sqlite:///./a_love_story.db"
+
+def apply_sqlite_profile(target_engine, profile: str = SQLITE_PROFILE):
+    '''为引擎注册 connect 事件，让每个新建的 SQLite 连接都执行生产配置的 PRAGMA；非 SQLite 引擎不做处理'''
+    if profile != "production" or target_engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(target_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in SQLITE_PRAGMAS.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
 
 
 # SQLite 默认限制同一连接仅能被创建它的线程使用，这里关闭检查是为了让同一个连接可以被不同线程复用，便于在 Web 场景下运行。
+# 这个参数只有 SQLite 驱动认识，其他数据库不传。
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False} if IS_SQLITE else {},
+    **pool_options(),
 )
+apply_sqlite_profile(engine)
 
 # 创建每次请求使用的数据库会话工厂。autocommit=False 意味着你需要显式 db.commit()；autoflush=False 可以避免在访问属性时自动发出 flush，通常搭配手动控制提交更直观。
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -25,4 +130,57 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# --- 异步数据库会话 ---
+# async def 路由使用 Depends(get_async_db)，拿到的会话类型取决于 DB_ASYNC：
+# - 开启：AsyncSession，数据库 I/O 由异步驱动在事件循环上完成；
+# - 关闭：get_async_db 就是 get_db 本身，于是同一请求里 get_current_user 和路由拿到的是同一个同步 Session。
+# 路由里不直接调用会话，而是通过 run_db（或 async_crud 里的包装函数）执行 crud 函数。
+DBSession = Session | AsyncSession
+
+if DB_ASYNC:
+    # 异步驱动地址：默认由 DATABASE_URL 推导，也可以通过 ASYNC_DATABASE_URL 单独指定
+    ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(SQLALCHEMY_DATABASE_URL)
+    async_engine = create_async_engine(
+        ASYNC_SQLALCHEMY_DATABASE_URL, **pool_options(url=ASYNC_SQLALCHEMY_DATABASE_URL)
+    )
+    # 异步引擎的 connect 事件注册在它包装的同步引擎上
+    apply_sqlite_profile(async_engine.sync_engine)
+    # expire_on_commit=False：提交后对象属性不过期，路由在事件循环上读取已加载的字段时不会触发隐式 I/O
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def get_async_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+else:
+    ASYNC_SQLALCHEMY_DATABASE_URL = None
+    async_engine = None
+    AsyncSessionLocal = None
+    get_async_db = get_db
+
+
+@lru_cache(maxsize=None)
+def _type_adapter(response_model):
+    return TypeAdapter(response_model)
+
+
+async def run_db(db: DBSession, fn, /, *args, response_model=None, **kwargs):
+    '''
+    在不阻塞事件循环的前提下执行同步的数据库函数 fn(session, *args, **kwargs)。
+    - AsyncSession：通过 run_sync 在 greenlet 里执行，底层 I/O 是异步的；
+    - Session：放到线程池里执行。
+    传入 response_model 时，会在同一个上下文里把结果校验成对应的 Pydantic 模型。
+    ORM 对象的关系属性（比如 CheckIn.user、UserOut.partner）是懒加载的，
+    如果留到 FastAPI 在事件循环上序列化时才加载，就会阻塞事件循环（异步模式下则直接报错），所以要在这里一并完成。
+    '''
+    def call(session: Session):
+        result = fn(session, *args, **kwargs)
+        if response_model is not None:
+            result = _type_adapter(response_model).validate_python(result, from_attributes=True)
+        return result
+
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(call)
+    return await run_in_threadpool(call, db)
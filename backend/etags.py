@@ -0,0 +1,96 @@
+# 读接口的条件请求（ETag / If-None-Match）。
+# 任务列表、打卡列表、评论、得分申请、仪表盘这些接口以前每次都重新查询、重新序列化完整的数据，即使什么都没变。
+# 现在每个接口的数据都由几个"范围"的版本号决定（version_stamps 表，一条主键 IN 查询就能取回）：
+# - tasks：任务本身（新建、修改任务）；
+# - users：用户的公开信息（得分、伴侣），几乎所有返回数据里都嵌着 UserOut；
+# - task:<id>：某个任务下所有人的打卡（包括后台生成的缩略图）；
+# - couple:<情侣频道>：这对情侣的打卡、缩略图、评论、点赞、得分申请；
+# - check_in:<id>：某条打卡的评论和点赞。
+# crud 的写操作在同一个事务里给受影响的范围加一（见 crud.bump_versions），回滚时版本号也一起回滚。
+# 读接口先取版本号，和请求路径、查询参数、当前用户一起算出弱 ETag；与请求头 If-None-Match 相同时直接返回 304，
+# 不执行重的 ORM 查询，也不做 Pydantic 序列化。版本号在数据之前读取，并发写入时最多让客户端多下载一次，不会拿到过期数据。
+# 响应带 Cache-Control: private, no-cache：浏览器可以保存响应，但每次使用前都要带着 If-None-Match 重新验证。
+# 不经过 crud 的写入（手工改库、脚本）不会更新版本号，改完后需要调用 crud.bump_versions。
+import hashlib
+import os
+
+from fastapi import Request, Response, status
+from sqlalchemy.orm import Session
+
+from . import crud, events, models
+from .database import DBSession, run_db
+
+ETAGS_ENABLED = os.getenv("ETAGS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+CACHE_CONTROL = "private, no-cache"
+
+TASKS = "tasks"
+USERS = "users"
+
+
+def task_scope(task_id: int) -> str:
+    '''一个任务下所有人的打卡'''
+    return f"task:{task_id}"
+
+
+def couple_scope(user_id: int, partner_id: int | None) -> str:
+    '''一对情侣的打卡、评论、点赞、得分申请'''
+    return f"couple:{events.couple_channel(user_id, partner_id)}"
+
+
+def check_in_scope(check_in_id: int) -> str:
+    '''一条打卡的评论和点赞'''
+    return f"check_in:{check_in_id}"
+
+
+def make_etag(*parts) -> str:
+    return f'W/"{hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()}"'
+
+
+def if_none_match(header: str | None, etag: str) -> bool:
+    '''If-None-Match 是否命中：支持逗号分隔的多个值和 *，按弱比较忽略 W/ 前缀'''
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+def _evaluate(
+    request: Request, response: Response, current_user: models.User, scopes: list[str], versions: list[int]
+) -> Response | None:
+    etag = make_etag(request.url.path, request.url.query, current_user.id, scopes, versions)
+    if if_none_match(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return None
+
+
+def check(request: Request, response: Response, db: Session, current_user: models.User, scopes: list[str]) -> Response | None:
+    '''
+    同步路由使用：客户端的缓存仍然有效时返回 304 响应，路由应直接返回它；
+    否则把 ETag 写进 response 的响应头并返回 None，路由照常查询。
+    '''
+    if not ETAGS_ENABLED:
+        return None
+    return _evaluate(request, response, current_user, scopes, crud.get_versions(db, scopes))
+
+
+async def check_async(
+    request: Request, response: Response, db: DBSession, current_user: models.User, scopes: list[str]
+) -> Response | None:
+    '''check 的异步版本，供 async def 路由使用'''
+    if not ETAGS_ENABLED:
+        return None
+    return _evaluate(request, response, current_user, scopes, await run_db(db, crud.get_versions, scopes))
+
+
+def check_versions(
+    request: Request, response: Response, current_user: models.User, scopes: list[str], versions: list[int]
+) -> Response | None:
+    '''路由自己已经取了版本号时使用（仪表盘还要拿版本号做缓存键），返回值同 check'''
+    if not ETAGS_ENABLED:
+        return None
+    return _evaluate(request, response, current_user, scopes, versions)
@@ -0,0 +1,240 @@
+# 伴侣动态的实时推送（Server-Sent Events）。
+# 以前前端只能反复请求打卡列表、评论和点赞接口才能看到伴侣的新动态。现在写操作成功提交后由 crud 调用 publish()，
+# 把一条很小的增量事件（新打卡、新评论、点赞/取消点赞、加分申请的审批结果……）发到这对情侣的频道，
+# 前端通过 GET /events 建立一条长连接（text/event-stream）接收，只在收到 resync 时才重新拉取完整列表。
+#
+# 频道按情侣划分（两个人的 user_id 排序后拼接），同一对情侣的所有连接共享一个频道。
+# 事件的分发由 broker 负责，通过 EVENTS_BROKER 选择：
+# - memory（默认）：进程内分发，只能送到同一个 worker 进程里的连接，适合单 worker 部署和本地开发；
+# - redis：通过 Redis 的 PUBLISH / PSUBSCRIBE 在所有 worker、所有应用节点之间广播（需要安装 redis），
+#   每个进程只占一条订阅连接，收到后再分发给本进程的连接。本地可以用 docker compose --profile redis 启动 Redis。
+#
+# crud 函数在线程池里（或 AsyncSession.run_sync 里）执行，publish() 是线程安全的同步函数：
+# 事件在调用方线程里序列化，然后交给事件循环异步投递，不会阻塞写请求。
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from collections.abc import AsyncIterator
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+EVENTS_ENABLED = os.getenv("EVENTS_ENABLED", "true").lower() in ("1", "true", "yes")
+EVENTS_BROKER = os.getenv("EVENTS_BROKER", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+EVENTS_REDIS_PREFIX = os.getenv("EVENTS_REDIS_PREFIX", "heartbeat:events:")
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))  # 每条连接最多积压的事件数
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", "15"))  # 没有事件时发送心跳注释的间隔
+
+# 连接积压过多（客户端读得太慢）时丢弃积压的事件，改发这个事件，客户端收到后重新拉取完整数据
+RESYNC_FRAME = "event: resync\ndata: {}\n\n"
+
+
+def couple_channel(user_id: int, partner_id: int | None) -> str:
+    '''一对情侣共用的频道名；未绑定伴侣时只有自己'''
+    return "-".join(str(uid) for uid in sorted(uid for uid in (user_id, partner_id) if uid is not None))
+
+
+class Subscription:
+    '''一条 SSE 连接的事件队列'''
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+
+    def put(self, frame: str):
+        '''只能在事件循环线程里调用'''
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC_FRAME)
+
+
+class InProcessBroker:
+    '''进程内的事件分发：频道 -> 本进程里订阅这个频道的连接'''
+
+    def __init__(self):
+        self._subscriptions: dict[str, set[Subscription]] = {}
+        self._ids = itertools.count(1)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, message: str):
+        self.dispatch(channel, message)
+
+    def dispatch(self, channel: str, message: str):
+        '''把一条事件（JSON：{"type", "data"}）分发给本进程里订阅了这个频道的连接；SSE 帧只格式化一次'''
+        subscriptions = self._subscriptions.get(channel)
+        if not subscriptions:
+            return
+        event = json.loads(message)
+        frame = f"id: {next(self._ids)}\nevent: {event['type']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+        for subscription in list(subscriptions):
+            subscription.put(frame)
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(channel)
+        self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.channel)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.channel]
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self._subscriptions),
+            "subscriptions": sum(len(subs) for subs in self._subscriptions.values()),
+        }
+
+
+class RedisBroker(InProcessBroker):
+    '''跨进程的事件分发：发布走 Redis，每个进程用一条 PSUBSCRIBE 连接接收所有频道，再分发给本进程的连接'''
+
+    def __init__(self, url: str, prefix: str = EVENTS_REDIS_PREFIX, client=None):
+        super().__init__()
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError as e:  # redis 是可选依赖
+                raise RuntimeError("EVENTS_BROKER=redis 需要安装 redis") from e
+            client = redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self._pubsub = None
+        self._listener: asyncio.Task | None = None
+
+    async def start(self):
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.psubscribe(f"{self.prefix}*")
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    async def _listen(self):
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    channel = message["channel"]
+                    data = message["data"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    if isinstance(data, bytes):
+                        data = data.decode()
+                    self.dispatch(channel[len(self.prefix):], data)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Redis 断线等错误：记录后稍等重连，期间的事件会丢失，客户端通过下拉刷新兜底
+                logger.exception("事件订阅连接出错，1 秒后重试")
+                await asyncio.sleep(1)
+
+    async def publish(self, channel: str, message: str):
+        await self.client.publish(f"{self.prefix}{channel}", message)
+
+
+def _create_broker():
+    if EVENTS_BROKER == "redis":
+        return RedisBroker(REDIS_URL)
+    if EVENTS_BROKER == "memory":
+        return InProcessBroker()
+    raise RuntimeError(f"未知的 EVENTS_BROKER: {EVENTS_BROKER}")
+
+
+broker = _create_broker()
+_loop: asyncio.AbstractEventLoop | None = None
+_pending: set[asyncio.Task] = set()  # 正在投递的事件，持有引用防止任务被垃圾回收
+
+
+async def start():
+    '''应用启动时调用：记录事件循环并启动 broker'''
+    global _loop
+    _loop = asyncio.get_running_loop()
+    await broker.start()
+
+
+async def stop():
+    '''应用关闭时调用'''
+    global _loop
+    _loop = None
+    await broker.stop()
+
+
+def _deliver(channel: str, message: str):
+    task = asyncio.ensure_future(broker.publish(channel, message))
+    _pending.add(task)
+    task.add_done_callback(_on_delivered)
+
+
+def _on_delivered(task: asyncio.Task):
+    _pending.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("事件投递失败", exc_info=task.exception())
+
+
+def publish(user_id: int, partner_id: int | None, event_type: str, data, schema: type[BaseModel] | None = None):
+    '''
+    向一对情侣的频道发布事件（线程安全，不阻塞）。应当在写操作提交之后调用。
+    data 是可 JSON 序列化的 dict；给出 schema 时 data 可以是 ORM 对象，按 schema 转换。
+    转换和序列化都在调用方线程里进行，推送未启用时直接跳过。
+    '''
+    loop = _loop
+    if not EVENTS_ENABLED or loop is None:
+        return
+    if schema is not None:
+        data = schema.model_validate(data).model_dump(mode="json")
+    message = json.dumps({"type": event_type, "data": data}, ensure_ascii=False)
+    try:
+        loop.call_soon_threadsafe(_deliver, couple_channel(user_id, partner_id), message)
+    except RuntimeError:  # 事件循环已经关闭（应用正在退出）
+        pass
+
+
+async def stream(channel: str, is_disconnected, expires_at: float | None = None) -> AsyncIterator[str]:
+    '''
+    一条 SSE 连接的响应体：先告诉客户端断线 3 秒后重连，然后持续输出事件和心跳；
+    到了 expires_at（时间戳，访问令牌过期的时间）就结束，客户端需要重新认证后再连接。
+    '''
+    subscription = broker.subscribe(channel)
+    try:
+        yield "retry: 3000\n\n"
+        while not await is_disconnected():
+            timeout = EVENTS_KEEPALIVE_SECONDS
+            if expires_at is not None:
+                remaining = expires_at - time.time()
+                if remaining <= 0:
+                    break
+                timeout = min(timeout, remaining)
+            try:
+                yield await asyncio.wait_for(subscription.queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def events_stats() -> dict:
+    return broker.stats()
@@ -0,0 +1,9 @@
+# gunicorn 配置：gunicorn -c gunicorn.conf.py ...（在当前目录下时 gunicorn 也会自动加载）
+import os
+
+
+def child_exit(server, worker):
+    # 通过 PROMETHEUS_MULTIPROC_DIR 多进程汇总 /metrics 时，清理退出的 worker 留下的在途请求数、借出连接数
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,164 @@
+# 每个请求的 SQL 统计（条数、数据库耗时）和慢查询日志。
+# 很多查询不是路由函数直接发出的：schemas.Task.creator、CheckIn.user、UserOut.partner 这些关系是懒加载的，
+# 在路由返回之后、Pydantic 序列化响应时才触发，逐条多出来的 N+1 查询在代码里看不出来。
+# 这里在 engine 的 before/after_cursor_execute 事件上计时，把每条 SQL 记到当前请求上（用 contextvar 关联，
+# 线程池里的同步路由、AsyncSession 的 greenlet 都继承请求的上下文；媒体后台线程不计入任何请求）：
+# - 每个响应带 Server-Timing 头：db;dur=<毫秒>;desc="<条数> queries"，浏览器开发者工具的 Timing 面板里可以直接看到；
+# - 单条 SQL 超过 SLOW_QUERY_MS 毫秒时记一条警告日志，带上发出它的路由模板；
+# - 路由可以用 @query_budget(n) 声明每个请求最多执行的 SQL 条数，超出时记警告日志；
+#   QUERY_BUDGET_STRICT=true 时（测试、CI 中使用）超出预算的请求直接返回 500，让 N+1 回归立刻暴露出来。
+# 响应头在 http.response.start 时写入，此时 FastAPI 已经完成了序列化，懒加载的查询都已计入。
+import contextvars
+import json
+import logging
+import os
+import time
+
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+SQL_INSTRUMENTATION_ENABLED = os.getenv("SQL_INSTRUMENTATION_ENABLED", "true").lower() in ("1", "true", "yes")
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "false").lower() in ("1", "true", "yes")
+
+_MAX_LOGGED_STATEMENT = 500  # 慢查询日志里 SQL 文本的最大长度
+
+
+class RequestStats:
+    '''一个请求里执行的 SQL 条数和数据库耗时'''
+
+    __slots__ = ("scope", "statements", "db_seconds")
+
+    def __init__(self, scope: Scope):
+        self.scope = scope
+        self.statements = 0
+        self.db_seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        '''路由模板（如 /tasks/{task_id}/timeline）；还没匹配到路由时用请求路径'''
+        route = self.scope.get("route")
+        return f"{self.scope['method']} {route.path if route is not None else self.scope['path']}"
+
+    @property
+    def budget(self) -> int | None:
+        route = self.scope.get("route")
+        return getattr(getattr(route, "endpoint", None), "query_budget", None)
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.db_seconds * 1000:.1f};desc="{self.statements} queries"'
+
+
+_current: contextvars.ContextVar[RequestStats | None] = contextvars.ContextVar("sql_request_stats", default=None)
+
+
+def current_stats() -> RequestStats | None:
+    return _current.get()
+
+
+def query_budget(statements: int):
+    '''
+    声明路由每个请求最多执行多少条 SQL，写在 @app.get(...) 等装饰器的下面：
+        @app.get("/tasks/{task_id}/timeline")
+        @instrumentation.query_budget(6)
+        async def read_task_timeline(...): ...
+    预算应当与数据量无关（列表再长也是这么多条），超出说明出现了 N+1 查询。
+    '''
+    def decorator(endpoint):
+        endpoint.query_budget = statements
+        return endpoint
+    return decorator
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._instrumentation_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_instrumentation_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = _current.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning(
+            "慢查询 %.1fms [%s]: %s",
+            elapsed * 1000,
+            stats.route if stats is not None else "后台任务",
+            " ".join(statement.split())[:_MAX_LOGGED_STATEMENT],
+        )
+
+
+def install(engine):
+    '''在 engine 上注册计时事件；异步引擎传入它的 sync_engine'''
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class SQLInstrumentationMiddleware:
+    '''为每个 HTTP 请求建立 RequestStats，在响应头写入 Server-Timing，并检查路由的 SQL 预算'''
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        over_budget = False
+
+        async def send_with_timing(message: Message):
+            nonlocal over_budget
+            if message["type"] == "http.response.start":
+                budget = stats.budget
+                if budget is not None and stats.statements > budget:
+                    logger.warning("[%s] 执行了 %d 条 SQL，超出预算 %d", stats.route, stats.statements, budget)
+                    over_budget = QUERY_BUDGET_STRICT
+                if over_budget:
+                    # 丢弃原来的响应，改为 500；后面的响应体消息也一并丢弃
+                    body = json.dumps({
+                        "detail": f"Query budget exceeded: {stats.statements} statements, budget {budget}",
+                    }).encode()
+                    message = {
+                        "type": "http.response.start",
+                        "status": 500,
+                        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+                    }
+                    if SERVER_TIMING_ENABLED:
+                        MutableHeaders(scope=message).append("Server-Timing", stats.server_timing())
+                    await send(message)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                if SERVER_TIMING_ENABLED:
+                    MutableHeaders(scope=message).append("Server-Timing", stats.server_timing())
+            elif over_budget:
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+
+
+def setup(app):
+    '''注册引擎事件和中间件；SQL_INSTRUMENTATION_ENABLED=false 时什么都不做'''
+    if not SQL_INSTRUMENTATION_ENABLED:
+        return
+    install(database.engine)
+    if database.async_engine is not None:
+        install(database.async_engine.sync_engine)
+    app.add_middleware(SQLInstrumentationMiddleware)
@@ -0,0 +1,199 @@
+# 事件循环阻塞检测和同步/异步路由审计。
+# async def 路由和依赖直接运行在事件循环上，在里面做同步的数据库查询、bcrypt、文件读写，
+# 会让同一个 worker 上的所有请求一起等待，表现为零星、难以复现的延迟尖刺。
+#
+# 阻塞检测（LOOP_MONITOR_ENABLED=true 时启用，可以在生产环境开启）：
+# 事件循环上的心跳协程每隔 LOOP_MONITOR_INTERVAL_MS 毫秒记录一次时间，另一个看门狗线程检查心跳，
+# 心跳停顿超过 LOOP_BLOCK_THRESHOLD_MS 毫秒时抓取事件循环线程当前的调用栈和正在执行的请求路由，
+# 等事件循环恢复后记一条警告日志（阻塞时长、路由、调用栈），并计入 /metrics 的 heartbeat_event_loop_blocks_total。
+# 看门狗只在阻塞时才抓栈，平时每个周期只是比较一次时间。
+#
+# 路由审计：启动时检查所有 async def 的路由和依赖，参数类型是同步 Session 的会被列出来并记警告日志
+# （同步 Session 的查询会直接在事件循环上执行；应当改用 DBSession + run_db / async_crud，或者把路由改成 def）。
+# 也可以在 CI 里执行 python -m backend.manage audit-routes，发现问题时返回非零退出码。
+import asyncio
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from fastapi.routing import APIRoute
+from sqlalchemy.orm import Session
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "false").lower() in ("1", "true", "yes")
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+LOOP_MONITOR_INTERVAL_MS = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "20"))
+
+_MAX_STACK_FRAMES = 30  # 日志里保留调用栈最内层的多少帧
+
+
+# --- 阻塞检测 ---
+
+# 正在处理的请求：asyncio 任务 -> ASGI scope。看门狗线程按事件循环当前的任务找到阻塞它的请求
+_task_scopes: dict[asyncio.Task, Scope] = {}
+
+
+class LoopMonitorMiddleware:
+    '''记录每个请求由哪个 asyncio 任务处理，阻塞时据此找出路由'''
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        task = asyncio.current_task()
+        if scope["type"] != "http" or task is None:
+            await self.app(scope, receive, send)
+            return
+        _task_scopes[task] = scope
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _task_scopes.pop(task, None)
+
+
+def _describe(scope: Scope | None) -> str:
+    if scope is None:
+        return "（不在请求中）"
+    route = scope.get("route")
+    return f"{scope['method']} {route.path if route is not None else scope['path']}"
+
+
+class LoopMonitor:
+    '''心跳协程 + 看门狗线程'''
+
+    def __init__(self, threshold: float, interval: float):
+        self.threshold = threshold
+        self.interval = interval
+        self.blocks = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._last_beat = time.monotonic()
+        self._heartbeat: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat = asyncio.create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    async def _beat(self):
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        captured = None  # 本次阻塞抓到的 (心跳时间, 路由, 调用栈)
+        while not self._stopped.wait(self.interval / 2):
+            last_beat = self._last_beat
+            stalled = time.monotonic() - last_beat - self.interval
+            if captured is None:
+                if stalled >= self.threshold:
+                    captured = (last_beat, *self._capture())
+            elif last_beat != captured[0]:
+                # 心跳恢复：阻塞结束，时长是两次心跳的间隔减去正常的 sleep
+                self._report(last_beat - captured[0] - self.interval, captured[1], captured[2])
+                captured = None
+
+    def _capture(self) -> tuple[str, str]:
+        '''在看门狗线程里读取事件循环线程的调用栈和它正在执行的请求'''
+        task = asyncio.current_task(self._loop)
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)[-_MAX_STACK_FRAMES:]) if frame is not None else ""
+        return _describe(_task_scopes.get(task)), stack
+
+    def _report(self, blocked: float, route: str, stack: str):
+        self.blocks += 1
+        metrics.record_loop_block(route, blocked)
+        logger.warning("事件循环被阻塞 %.0fms [%s]，阻塞时的调用栈：\n%s", blocked * 1000, route, stack)
+
+    def stats(self) -> dict:
+        return {"blocks": self.blocks, "threshold_ms": self.threshold * 1000}
+
+
+monitor = LoopMonitor(LOOP_BLOCK_THRESHOLD_MS / 1000, LOOP_MONITOR_INTERVAL_MS / 1000)
+
+
+async def start():
+    '''应用启动时调用'''
+    if LOOP_MONITOR_ENABLED:
+        await monitor.start()
+
+
+async def stop():
+    if LOOP_MONITOR_ENABLED:
+        await monitor.stop()
+
+
+# --- 路由审计 ---
+
+def _sync_session_params(call) -> list[str]:
+    '''async 函数里类型标注为同步 Session 的参数名'''
+    if not inspect.iscoroutinefunction(call):
+        return []
+    try:
+        parameters = inspect.signature(call).parameters.values()
+    except (TypeError, ValueError):
+        return []
+    return [parameter.name for parameter in parameters if parameter.annotation in (Session, "Session")]
+
+
+def audit_routes(app) -> list[str]:
+    '''列出所有在事件循环上使用同步 Session 的 async def 路由或依赖，每个问题一行说明'''
+    problems = []
+    seen = set()
+    for route in app.routes:
+        if not isinstance(route, APIRoute):
+            continue
+        stack = [route.dependant]
+        while stack:
+            dependant = stack.pop()
+            stack.extend(dependant.dependencies)
+            key = (route.path, dependant.call)
+            if dependant.call is None or key in seen:
+                continue
+            seen.add(key)
+            for name in _sync_session_params(dependant.call):
+                where = "路由" if dependant is route.dependant else f"依赖 {dependant.call.__qualname__}"
+                problems.append(
+                    f"{','.join(sorted(route.methods))} {route.path}：async def {where} 的参数 {name} 是同步 Session，"
+                    f"查询会阻塞事件循环"
+                )
+    return problems
+
+
+def report_routes(app):
+    '''启动时调用：把审计发现的问题记到警告日志里'''
+    for problem in audit_routes(app):
+        logger.warning("路由审计：%s", problem)
+
+
+def setup(app):
+    '''注册中间件（阻塞检测需要知道请求对应的任务）；未启用时什么都不做'''
+    if LOOP_MONITOR_ENABLED:
+        app.add_middleware(LoopMonitorMiddleware)
@@ -1,24 +1,41 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Query, Request, Response
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import timedelta, date
+import secrets
 from jose import JWTError, jwt
-from typing import List
-import os
-import shutil
-import datetime
-import magic
-import pytz
-from . import crud, models, schemas, auth
-from .database import engine, get_db
+from typing import List, Literal
+from . import crud, async_crud, models, schemas, auth, pagination, migrate, dashboard, uploads, media, events, etags, instrumentation, metrics, loop_monitor, serialization
+from .database import get_db, get_async_db, run_db, DBSession
+from .storage import storage
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import RedirectResponse, StreamingResponse
+from contextlib import asynccontextmanager
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 
-# 创建数据库表
-# 会基于上述模型自动创建 users 表（如果尚未存在）。
-models.Base.metadata.create_all(bind=engine)
+# 创建 / 升级数据库表
+# 表结构由 Alembic 迁移管理（见 backend/migrations），AUTO_MIGRATE=false 时需要在启动前手动执行 python -m backend.migrate。
+if migrate.AUTO_MIGRATE:
+    migrate.upgrade_to_head()
 
-app = FastAPI(title="HeartBeat App for Couples")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 实时推送需要知道事件循环，并在使用 Redis 时建立订阅连接
+    await events.start()
+    await metrics.start()
+    # 列出在事件循环上使用同步 Session 的 async def 路由，并开始检测事件循环阻塞（LOOP_MONITOR_ENABLED=true 时）
+    loop_monitor.report_routes(app)
+    await loop_monitor.start()
+    yield
+    await loop_monitor.stop()
+    await metrics.stop()
+    await events.stop()
+
+
+app = FastAPI(title="HeartBeat App for Couples", lifespan=lifespan)
 
 # 允许前端跨域访问（包括预检请求）
 app.add_middleware(
@@ -33,14 +50,22 @@ app.add_middleware(
     ],
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER, "ETag"],  # 让前端能读到分页游标和 ETag 响应头
 )
+# 每个请求的 SQL 条数和数据库耗时（Server-Timing 响应头）、慢查询日志、路由的 SQL 预算
+instrumentation.setup(app)
+# Prometheus 指标：请求耗时、在途请求、连接池、上传字节、认证缓存、事件循环延迟（需要安装 prometheus_client）
+metrics.setup(app)
+# 事件循环阻塞检测：记录每个请求由哪个 asyncio 任务处理
+loop_monitor.setup(app)
 
 # --- 静态文件服务 ---
-# 挂载 static 目录，使得 /static/uploads/filename.jpg 可以通过 URL 访问
-UPLOAD_DIR = "static/uploads"
-if not os.path.exists(UPLOAD_DIR):
-    os.makedirs(UPLOAD_DIR)
+# 挂载 static 目录，使得 /static/uploads/filename.jpg 可以通过 URL 访问（上传目录由 uploads 模块创建）
+# 上传目录里的文件按内容哈希命名、永不改变，单独挂载并带上 immutable 的长期缓存头；必须挂在 /static 之前才能优先匹配
+# 使用对象存储（STORAGE_BACKEND=s3）时图片不在本机，不挂载上传目录，图片地址指向对象存储或下面的 /media 重定向
+if not storage.supports_direct_upload:
+    app.mount("/static/uploads", uploads.ImmutableStaticFiles(directory=uploads.UPLOAD_DIR), name="uploads")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 # 这是实现图片访问的关键。它告诉 FastAPI，任何以 /static/ 开头的 URL 请求，都应该去服务器的 static 文件夹下查找对应的文件。这样，我们保存在 static/uploads 目录下的图片就能通过 http://<your-domain>/static/uploads/image.jpg 这样的链接被手机 App 访问到了。
 
@@ -48,21 +73,24 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 
 @app.post("/auth/register", response_model=schemas.UserOut, tags=["Auth"]) # 这是一个“装饰器”，它告诉 FastAPI：下面这个 register_user 函数是用来处理发送到 /auth/register 这个 URL 的 POST 请求的。
 # response_model:这是一个强大的特性。它规定了 这个接口成功时返回的 JSON 数据必须符合 schemas.UserOut 的格式。
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_username(db, username=user.username)
+async def register_user(user: schemas.UserCreate, db: DBSession = Depends(get_async_db)):
+    db_user = await async_crud.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
+    # bcrypt 哈希在专用的密码哈希线程池里计算，线程池饱和时这里会直接返回 503
+    hashed_password = await auth.get_password_hash_async(user.password)
     # - 函数最后返回的是一个 models.User 数据库对象（包含了 hashed_password ）。
     # - FastAPI 会利用我们之前讨论的 from_attributes = True 配置，自动将 models.User 对象转换为 schemas.UserOut 对象。
     # - 这个转换过程会 自动过滤掉 hashed_password ，只保留 id , username , partner_id ，确保了密码哈希值不会泄露给客户端。
-    return crud.create_user(db=db, user=user)
+    return await async_crud.create_user(db, user=user, hashed_password=hashed_password, response_model=schemas.UserOut)
 
 @app.post("/auth/token", response_model=schemas.Token, tags=["Auth"]) # 这个接口是整个认证系统的入口。当用户在登录页面输入用户名和密码点击登录时，前端就会调用这个接口。
-async def login_for_access_token(# 注意这里我们用了 async 关键字。虽然在这个函数内部没有执行 await 操作，但 FastAPI 的很多内部机制是异步的，使用 async def 是推荐的最佳实践，能获得更好的性能。
-    form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db) # 是 FastAPI 提供的一个特殊依赖类。它不是从 JSON 请求体里读取数据，而是专门用来处理标准的 application/x-www-form-urlencoded 格式的表单数据，这是 OAuth2 规范中“密码模式”的标准要求。它告诉 FastAPI：“我期望的请求体格式是 username=someuser&password=somepass 这样的字符串，而不是 JSON。”
+async def login_for_access_token(# 注意这里我们用了 async 关键字。数据库调用都通过 async_crud 以 await 的方式执行（异步会话或线程池），不会阻塞事件循环。
+    form_data: OAuth2PasswordRequestForm = Depends(), db: DBSession = Depends(get_async_db) # 是 FastAPI 提供的一个特殊依赖类。它不是从 JSON 请求体里读取数据，而是专门用来处理标准的 application/x-www-form-urlencoded 格式的表单数据，这是 OAuth2 规范中“密码模式”的标准要求。它告诉 FastAPI：“我期望的请求体格式是 username=someuser&password=somepass 这样的字符串，而不是 JSON。”
 ):# Depends() 会自动解析这种格式的数据，并把 username 和 password 填充到 form_data 对象中，我们就可以通过 form_data.username 和 form_data.password 来访问它们。
-    user = crud.get_user_by_username(db, username=form_data.username)
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+    user = await async_crud.get_user_by_username(db, username=form_data.username)
+    # bcrypt 校验在专用的密码哈希线程池里执行，不占用事件循环；线程池饱和时直接返回 503
+    if not user or not await auth.verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -85,7 +113,7 @@ async def login_for_access_token(# 注意这里我们用了 async 关键字。
     # - 我们调用了一个新的 CRUD 函数 update_user_refresh_token ，将刚刚生成的 refresh_token 字符串 保存到该用户的数据库记录中 。
     # - 为什么要保存它？ 这是为了安全。当用户稍后拿着 Refresh Token 来换取新 Access Token 时，我们不仅要验证这个 Refresh Token 本身是否有效，还要验证它 是否和数据库里存的那个完全一致 。这可以防止令牌泄露后被滥用，并且允许我们通过从数据库中删除它来“吊销”用户的登录会话。
     # 将新的 refresh_token 存入数据库
-    crud.update_user_refresh_token(db, user, refresh_token)
+    await async_crud.update_user_refresh_token(db, user, refresh_token)
     
     return {
         "access_token": access_token,
@@ -96,7 +124,7 @@ async def login_for_access_token(# 注意这里我们用了 async 关键字。
     # - 客户端（前端应用）需要将这两个令牌安全地存储起来（通常在 localStorage 或 HttpOnly Cookie 中）。 
 
 @app.post("/auth/refresh", response_model=schemas.Token, tags=["Auth"])
-async def refresh_token(refresh_token: str, db: Session = Depends(get_db)):
+async def refresh_token(refresh_token: str, db: DBSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -124,7 +152,7 @@ async def refresh_token(refresh_token: str, db: Session = Depends(get_db)):
         #    - 用户存在，但是他数据库里存的 Refresh Token 和客户端这次发来的不一样。
         #    - 这通常意味着数据库里存的是一个更新的令牌，而客户端用的这个是旧的、已作废的。
         #    - 这可以防止令牌被盗用后，在用户自己刷新了令牌之后，攻击者还能用旧令牌继续刷新。
-        user = crud.get_user_by_username(db, username=username) if username else None
+        user = await async_crud.get_user_by_username(db, username=username) if username else None
         if user is None or user.refresh_token != refresh_token:
             # 只要上面两种情况发生任意一种，就说明这个请求有问题，立刻拒绝！
             raise credentials_exception
@@ -140,7 +168,7 @@ async def refresh_token(refresh_token: str, db: Session = Depends(get_db)):
         new_refresh_token = auth.create_refresh_token(
             data={"sub": user.username}, expires_delta=refresh_token_expires
         )
-        crud.update_user_refresh_token(db, user, new_refresh_token)
+        await async_crud.update_user_refresh_token(db, user, new_refresh_token)
 
         return {
             "access_token": new_access_token,
@@ -157,18 +185,65 @@ async def read_users_me(current_user: models.User = Depends(auth.get_current_use
     return current_user
 
 
+@app.get("/users/me/media-usage", response_model=schemas.MediaUsage, tags=["Users"])
+async def read_my_media_usage(
+    db: DBSession = Depends(get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """当前用户打卡图片占用的存储：由 check_in_images 表上的一条聚合查询算出"""
+    return await async_crud.get_media_usage(db, current_user.id)
+
+
+# --- 实时推送 ---
+@app.post("/events/ticket", response_model=schemas.StreamTicket, tags=["Users"])
+async def create_stream_ticket(
+    token: str = Depends(auth.oauth2_scheme),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """换一张建立 SSE 连接用的短期票据（访问令牌不放进 URL，见 auth.create_stream_ticket）"""
+    ticket, expires_in = auth.create_stream_ticket(token)
+    return {"ticket": ticket, "expires_in": expires_in}
+
+
+@app.get("/events", tags=["Users"])
+async def stream_events(
+    request: Request,
+    db: DBSession = Depends(get_async_db),
+    session: auth.StreamSession = Depends(auth.get_stream_session)
+):
+    """
+    伴侣动态的实时推送（Server-Sent Events），先 POST /events/ticket 换票据，再用 EventSource 连接：
+    new EventSource("/events?ticket=...")。连接在访问令牌过期时由服务端关闭，客户端要换一张新票据重连。
+    事件类型：check_in.created、check_in.updated（缩略图生成完成）、check_in.deleted、comment.created、comment.deleted、
+    like.created、like.deleted、score_request.created、score_request.responded；
+    收到 resync 时说明有事件被丢弃，需要重新拉取完整数据。
+    """
+    current_user = session.user
+    channel = events.couple_channel(current_user.id, current_user.partner_id)
+    # 长连接期间不再访问数据库，先关闭会话把连接还给连接池，否则每个在线用户都会一直占着一个连接
+    if isinstance(db, AsyncSession):
+        await db.close()
+    else:
+        await run_in_threadpool(db.close)
+    return StreamingResponse(
+        events.stream(channel, request.is_disconnected, expires_at=session.expires_at),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # 禁止 Nginx 缓冲，事件立即送达
+    )
+
+
 # --- 新增：绑定伴侣路由 ---
 @app.post("/users/bind_partner", response_model=schemas.BindResult, tags=["Users"])
 async def bind_partner(
     req: schemas.PartnerBindRequest,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user),
 ):
     # 不能与自己绑定
     if req.invitation_code == current_user.invitation_code:
         raise HTTPException(status_code=400, detail="Cannot bind to yourself")
 
-    partner = crud.get_user_by_invitation_code(db, invitation_code=req.invitation_code)
+    partner = await async_crud.get_user_by_invitation_code(db, invitation_code=req.invitation_code)
     if not partner:
         raise HTTPException(status_code=404, detail="Invalid invitation code")
 
@@ -179,8 +254,9 @@ async def bind_partner(
         raise HTTPException(status_code=400, detail="Partner already has a partner")
 
     try:
-        user_a, user_b = crud.bind_partners(db, current_user, partner)
-        return {"user": user_a, "partner": user_b}
+        user_a, user_b = await async_crud.bind_partners(db, current_user, partner)
+        # 双方的 partner 关系刚刚变化、需要重新加载，所以在数据库上下文里完成序列化
+        return await run_db(db, lambda _: {"user": user_a, "partner": user_b}, response_model=schemas.BindResult)
     except ValueError as e:
         # 业务校验抛错
         raise HTTPException(status_code=400, detail=str(e))
@@ -206,21 +282,34 @@ def create_task(
     return crud.create_task(db=db, task=task, creator_id=current_user.id)
 
 @app.get("/tasks/", response_model=List[schemas.Task], tags=["Tasks & Check-ins"])
+@instrumentation.query_budget(3)
 def read_tasks(
+    request: Request,
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
+    # 带 If-None-Match 且任务和用户信息都没变时直接返回 304（见 etags 模块）
+    not_modified = etags.check(request, response, db, current_user, [etags.TASKS, etags.USERS])
+    if not_modified is not None:
+        return not_modified
     tasks = crud.get_tasks(db, skip=skip, limit=limit)
-    return tasks
+    return serialization.fast_json(response, tasks, List[schemas.Task])
 
 @app.get("/tasks/{task_id}", response_model=schemas.Task, tags=["Tasks & Check-ins"])
+@instrumentation.query_budget(3)
 def read_task(
     task_id: int, 
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
+    not_modified = etags.check(request, response, db, current_user, [etags.TASKS, etags.USERS])
+    if not_modified is not None:
+        return not_modified
     db_task = crud.get_task(db, task_id=task_id)
     if db_task is None:
         raise HTTPException(status_code=404, detail="Task not found")
@@ -238,21 +327,122 @@ def update_task(
         raise HTTPException(status_code=404, detail="Task not found")
     return db_task
 
+def _parse_cursor(cursor: str | None):
+    """把查询参数里的游标解析成 (timestamp, id)，格式错误时返回 400"""
+    if cursor is None:
+        return None
+    try:
+        return pagination.decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @app.get("/tasks/{task_id}/checkins", response_model=List[schemas.CheckIn], tags=["Tasks & Check-ins"])
+@instrumentation.query_budget(5)
 def read_checkins_for_task(
     task_id: int,
+    request: Request,
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=pagination.MAX_PAGE_SIZE),
+    cursor: str | None = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """获取特定任务的所有打卡记录"""
+    """
+    分页获取特定任务的打卡记录（按时间倒序）。
+    - **limit**: 每页条数，默认 DEFAULT_PAGE_SIZE。
+    - **cursor**: 上一页响应头 X-Next-Cursor 的值；响应头里没有 X-Next-Cursor 说明已经是最后一页。
+    带上次响应的 ETag（If-None-Match）请求、且这个任务下没有新打卡时返回 304。
+    """
+    before = _parse_cursor(cursor)
     db_task = crud.get_task(db, task_id=task_id)
     if db_task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
     # 这里可以加入权限检查，比如只有任务的创建者或其伴侣才能查看
     
-    check_ins = crud.get_checkins_by_task(db, task_id=task_id)
-    return check_ins
+    not_modified = etags.check(request, response, db, current_user, [etags.task_scope(task_id), etags.USERS])
+    if not_modified is not None:
+        return not_modified
+
+    page_size = pagination.resolve_page_size(limit)
+    rows = crud.get_checkins_by_task(db, task_id=task_id, limit=page_size + 1, before=before)
+    check_ins, next_cursor = pagination.split_page(rows, page_size)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return serialization.fast_json(response, check_ins, List[schemas.CheckIn])
+
+
+@app.get("/tasks/{task_id}/timeline", response_model=List[schemas.TimelineCheckIn], tags=["Tasks & Check-ins"])
+@instrumentation.query_budget(7)
+def read_task_timeline(
+    task_id: int,
+    request: Request,
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=pagination.MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    获取任务时间线：当前用户和伴侣的打卡记录，连同评论、点赞和点赞数一起返回。
+    替代“先拉打卡列表，再为每条打卡分别请求评论、点赞数、点赞列表”的 3N+1 次请求。
+    分页方式与 /tasks/{task_id}/checkins 相同（limit + cursor，下一页游标在 X-Next-Cursor 响应头里）。
+    """
+    before = _parse_cursor(cursor)
+    db_task = crud.get_task(db, task_id=task_id)
+    if db_task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    # 时间线只包含自己和伴侣的打卡、评论、点赞，它们都会更新这对情侣的版本号
+    not_modified = etags.check(
+        request, response, db, current_user, [etags.couple_scope(current_user.id, current_user.partner_id), etags.USERS]
+    )
+    if not_modified is not None:
+        return not_modified
+
+    # 评论和点赞只对自己和伴侣可见，所以时间线只包含这两个人的打卡
+    user_ids = [current_user.id]
+    if current_user.partner_id is not None:
+        user_ids.append(current_user.partner_id)
+
+    page_size = pagination.resolve_page_size(limit)
+    rows = crud.get_checkins_by_task(
+        db, task_id=task_id, user_ids=user_ids, with_interactions=True, limit=page_size + 1, before=before
+    )
+    check_ins, next_cursor = pagination.split_page(rows, page_size)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+
+    timeline = []
+    for check_in in check_ins:
+        item = schemas.TimelineCheckIn.model_validate(check_in)
+        item.liked_by_me = any(like.user_id == current_user.id for like in item.likes)
+        timeline.append(item)
+    return serialization.fast_json(response, timeline, List[schemas.TimelineCheckIn])
+
+
+# --- 图片直传与访问（对象存储） ---
+
+@app.post("/uploads/presign", response_model=schemas.UploadPresignResponse, tags=["Media"])
+async def presign_image_upload(
+    request: schemas.UploadPresignRequest,
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    申请一个预签名上传地址，客户端把图片直接 PUT 到对象存储，不经过后端。
+    上传完成后把返回的 key 放进打卡接口的 image_keys 字段。只有 STORAGE_BACKEND=s3 时可用。
+    """
+    return await run_in_threadpool(uploads.presign_upload, request.sha256, request.size, request.content_type)
+
+
+@app.get("/media/{key:path}", tags=["Media"])
+async def get_media(key: str):
+    """对象存储里的图片：重定向到有时效的预签名下载地址，图片字节不经过后端"""
+    if not uploads.MEDIA_KEY_PATTERN.match(key):
+        raise HTTPException(status_code=404, detail="Not Found")
+    url = await run_in_threadpool(storage.download_url, key)
+    return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
 
 
 # 这是处理打卡的核心路由
@@ -261,7 +451,8 @@ async def create_check_in_for_task(
     task_id: int,
     text_content: str = Form(None),
     images: List[UploadFile] = File(None),
-    db: Session = Depends(get_db),
+    image_keys: List[str] = Form(None),
+    db: DBSession = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
@@ -269,67 +460,46 @@ async def create_check_in_for_task(
     - **task_id**: 关联的任务ID。
     - **text**: 打卡的文字内容 (可选)。
     - **images**: 上传的图片文件列表 (可选，最多3张)。
+    - **image_keys**: 已经通过 /uploads/presign 直传到对象存储的图片 key (可选，与 images 合计最多3张)。
     """
-    image_urls = []
-    if images and len(images) > 0:
-        # 限制最多3张图片
-        if len(images) > 3:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="最多只能上传3张图片",
-            )
-        
-        for image in images:
-            if image.filename:  # 确保文件不为空
-                # MIME type validation
-                file_content = await image.read(2048)  # Read first 2KB to check type
-                await image.seek(0)  # Reset file pointer
-
-                mime_type = magic.from_buffer(file_content, mime=True)
-                if not mime_type.startswith("image/"):
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="Invalid file type. Only images are allowed.",
-                    )
-
-                # 生成一个安全的文件名，例如用 user_id 和时间戳
-                beijing_tz = pytz.timezone('Asia/Shanghai')
-                timestamp = datetime.datetime.now(beijing_tz).strftime("%Y%m%d%H%M%S")
-                # 为每张图片添加序号
-                image_index = len(image_urls)
-                file_extension = os.path.splitext(image.filename)[1]
-                # 确保文件名安全，防止路径遍历攻击
-                safe_filename = f"{current_user.id}_{timestamp}_{image_index}{file_extension}"
-                file_path = os.path.join(UPLOAD_DIR, safe_filename)
-
-                # 保存文件
-                try:
-                    with open(file_path, "wb") as buffer:
-                        shutil.copyfileobj(image.file, buffer)
-                finally:
-                    image.file.close()
-                
-                # 生成可访问的 URL
-                image_url = f"/static/uploads/{safe_filename}"
-                image_urls.append(image_url)
-
-    # 将多个图片URL用逗号分隔存储（简单方案）
-    image_url_string = ",".join(image_urls) if image_urls else None
-
-    check_in = crud.create_check_in(
-        db=db, 
-        user_id=current_user.id, 
-        task_id=task_id, 
-        text_content=text_content, 
-        image_url=image_url_string
+    # 图片在线程池里分块写盘、校验和计算哈希，最多 3 张并发处理，不阻塞事件循环
+    stored_images = await uploads.save_images(images, image_keys)
+
+    # 每张图片在 check_in_images 表里一行，按上传顺序排列
+    check_in = await async_crud.create_check_in(
+        db,
+        user_id=current_user.id,
+        task_id=task_id,
+        text_content=text_content,
+        images=stored_images,
+        response_model=schemas.CheckIn,
     )
+    # 缩略图在后台生成，不占用这次请求的时间；生成之前 images 里只有原图地址
+    media.enqueue_variants(check_in.id, [stored.path for stored in stored_images])
     return check_in
 
 
+@app.delete("/checkins/{check_in_id}", tags=["Tasks & Check-ins"])
+async def delete_check_in(
+    check_in_id: int,
+    db: DBSession = Depends(get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """删除打卡（只能删除自己的打卡），图片文件的引用随之释放"""
+    success = await async_crud.delete_check_in(db, check_in_id=check_in_id, user_id=current_user.id)
+    if not success:
+        raise HTTPException(status_code=404, detail="Check-in not found or you don't have permission to delete it")
+
+    return {"message": "Check-in deleted successfully"}
+
+
 @app.get("/dashboard/{date_str}", response_model=schemas.DailyDashboard, tags=["Dashboard"])
+@instrumentation.query_budget(3)
 async def get_daily_dashboard(
     date_str: str, # 接收一个 YYYY-MM-DD 格式的日期字符串作为路径参数。
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: DBSession = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
@@ -341,33 +511,22 @@ async def get_daily_dashboard(
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
 
-    # 1. 获取所有任务
-    all_tasks = crud.get_tasks(db)
+    # 版本号既用来算 ETag，也是仪表盘缓存键的一部分，其他 worker 的写入同样会让缓存的快照失效
+    scopes = [etags.TASKS, etags.USERS, etags.couple_scope(current_user.id, current_user.partner_id)]
+    versions = await run_db(db, crud.get_versions, scopes)
 
-    # 2. 获取当前用户和伴侣的打卡记录
-    my_check_ins = crud.get_check_ins_for_user_on_date(db, current_user.id, target_date)
-    
-    partner_check_ins = []
-    partner = None
-    if current_user.partner_id:
-        partner = crud.get_user(db, user_id=current_user.partner_id)
-        if partner:
-            partner_check_ins = crud.get_check_ins_for_user_on_date(db, partner.id, target_date)
-
-    # 3. 构建数据结构
-    my_check_ins_map = {ci.task_id: ci for ci in my_check_ins}
-    partner_check_ins_map = {ci.task_id: ci for ci in partner_check_ins}
-
-    daily_statuses = []
-    for task in all_tasks:
-        status = schemas.DailyCheckInStatus(
-            task=task,
-            user_checked_in=my_check_ins_map.get(task.id),
-            partner_checked_in=partner_check_ins_map.get(task.id)
-        )
-        daily_statuses.append(status)
-        
-    return schemas.DailyDashboard(date=target_date, tasks_status=daily_statuses)
+    # 任务、用户信息和这对情侣的打卡都没变时返回 304，连缓存的快照都不用组装
+    not_modified = etags.check_versions(request, response, current_user, scopes, versions)
+    if not_modified is not None:
+        return not_modified
+
+    # 同一对情侣同一天、同样版本号的仪表盘有缓存时直接返回，不再查询
+    cached = dashboard.get_cached_dashboard(current_user, target_date, versions)
+    if cached is not None:
+        return cached
+
+    # 查询和组装都在数据库上下文里完成（线程池或异步会话），不占用事件循环
+    return await run_db(db, dashboard.build_daily_dashboard, current_user, target_date, versions)
 
 
 # ==================================================
@@ -378,12 +537,12 @@ async def get_daily_dashboard(
 async def create_comment(
     check_in_id: int,
     comment_data: schemas.CommentCreate,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """为指定的打卡记录创建评论"""
     # 检查打卡记录是否存在
-    check_in = db.query(models.CheckIn).filter(models.CheckIn.id == check_in_id).first()
+    check_in = await async_crud.get_check_in(db, check_in_id)
     if not check_in:
         raise HTTPException(status_code=404, detail="Check-in not found")
     
@@ -396,31 +555,32 @@ async def create_comment(
         raise HTTPException(status_code=403, detail="You can only comment on your or your partner's check-ins")
     
     # 检查用户是否已经对这个打卡记录评论过（每人每个打卡记录最多一条评论）
-    existing_comment = db.query(models.Comment).filter(
-        models.Comment.check_in_id == check_in_id,
-        models.Comment.user_id == current_user.id
-    ).first()
-    
+    existing_comment = await async_crud.get_comment_by_user(db, check_in_id=check_in_id, user_id=current_user.id)
+
     if existing_comment:
         raise HTTPException(status_code=400, detail="You have already commented on this check-in")
     
-    return crud.create_comment(
-        db=db, 
-        user_id=current_user.id, 
-        check_in_id=check_in_id, 
-        content=comment_data.content
+    return await async_crud.create_comment(
+        db,
+        user_id=current_user.id,
+        check_in_id=check_in_id,
+        content=comment_data.content,
+        response_model=schemas.Comment,
     )
 
 
 @app.get("/checkins/{check_in_id}/comments", response_model=List[schemas.Comment], tags=["Comments & Likes"])
+@instrumentation.query_budget(5)
 async def get_comments(
     check_in_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: DBSession = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """获取指定打卡记录的所有评论"""
     # 检查打卡记录是否存在
-    check_in = db.query(models.CheckIn).filter(models.CheckIn.id == check_in_id).first()
+    check_in = await async_crud.get_check_in(db, check_in_id)
     if not check_in:
         raise HTTPException(status_code=404, detail="Check-in not found")
     
@@ -431,17 +591,21 @@ async def get_comments(
     if check_in.user_id != current_user.id and check_in.user_id != current_user.partner_id:
         raise HTTPException(status_code=403, detail="You can only view comments on your or your partner's check-ins")
     
-    return crud.get_comments_by_check_in(db=db, check_in_id=check_in_id)
+    not_modified = await etags.check_async(request, response, db, current_user, [etags.check_in_scope(check_in_id), etags.USERS])
+    if not_modified is not None:
+        return not_modified
+
+    return await async_crud.get_comments_by_check_in(db, check_in_id=check_in_id, response_model=List[schemas.Comment])
 
 
 @app.delete("/comments/{comment_id}", tags=["Comments & Likes"])
 async def delete_comment(
     comment_id: int,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """删除评论（只能删除自己的评论）"""
-    success = crud.delete_comment(db=db, comment_id=comment_id, user_id=current_user.id)
+    success = await async_crud.delete_comment(db, comment_id=comment_id, user_id=current_user.id)
     if not success:
         raise HTTPException(status_code=404, detail="Comment not found or you don't have permission to delete it")
     
@@ -455,12 +619,12 @@ async def delete_comment(
 @app.post("/checkins/{check_in_id}/likes", response_model=schemas.Like, tags=["Comments & Likes"])
 async def create_like(
     check_in_id: int,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """为指定的打卡记录点赞"""
     # 检查打卡记录是否存在
-    check_in = db.query(models.CheckIn).filter(models.CheckIn.id == check_in_id).first()
+    check_in = await async_crud.get_check_in(db, check_in_id)
     if not check_in:
         raise HTTPException(status_code=404, detail="Check-in not found")
     
@@ -471,7 +635,7 @@ async def create_like(
     if check_in.user_id != current_user.id and check_in.user_id != current_user.partner_id:
         raise HTTPException(status_code=403, detail="You can only like your or your partner's check-ins")
     
-    like = crud.create_like(db=db, user_id=current_user.id, check_in_id=check_in_id)
+    like = await async_crud.create_like(db, user_id=current_user.id, check_in_id=check_in_id, response_model=schemas.Like | None)
     if like is None:
         raise HTTPException(status_code=400, detail="You have already liked this check-in")
     
@@ -481,11 +645,11 @@ async def create_like(
 @app.delete("/checkins/{check_in_id}/likes", tags=["Comments & Likes"])
 async def delete_like(
     check_in_id: int,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """取消点赞"""
-    success = crud.delete_like(db=db, user_id=current_user.id, check_in_id=check_in_id)
+    success = await async_crud.delete_like(db, user_id=current_user.id, check_in_id=check_in_id)
     if not success:
         raise HTTPException(status_code=404, detail="Like not found")
     
@@ -493,14 +657,17 @@ async def delete_like(
 
 
 @app.get("/checkins/{check_in_id}/likes", response_model=List[schemas.Like], tags=["Comments & Likes"])
+@instrumentation.query_budget(5)
 async def get_likes(
     check_in_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: DBSession = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """获取指定打卡记录的所有点赞"""
     # 检查打卡记录是否存在
-    check_in = db.query(models.CheckIn).filter(models.CheckIn.id == check_in_id).first()
+    check_in = await async_crud.get_check_in(db, check_in_id)
     if not check_in:
         raise HTTPException(status_code=404, detail="Check-in not found")
     
@@ -511,18 +678,25 @@ async def get_likes(
     if check_in.user_id != current_user.id and check_in.user_id != current_user.partner_id:
         raise HTTPException(status_code=403, detail="You can only view likes on your or your partner's check-ins")
     
-    return crud.get_likes_by_check_in(db=db, check_in_id=check_in_id)
+    not_modified = await etags.check_async(request, response, db, current_user, [etags.check_in_scope(check_in_id), etags.USERS])
+    if not_modified is not None:
+        return not_modified
+
+    return await async_crud.get_likes_by_check_in(db, check_in_id=check_in_id, response_model=List[schemas.Like])
 
 
 @app.get("/checkins/{check_in_id}/likes/count", tags=["Comments & Likes"])
+@instrumentation.query_budget(4)
 async def get_like_count(
     check_in_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: DBSession = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """获取指定打卡记录的点赞数量"""
     # 检查打卡记录是否存在
-    check_in = db.query(models.CheckIn).filter(models.CheckIn.id == check_in_id).first()
+    check_in = await async_crud.get_check_in(db, check_in_id)
     if not check_in:
         raise HTTPException(status_code=404, detail="Check-in not found")
     
@@ -533,8 +707,27 @@ async def get_like_count(
     if check_in.user_id != current_user.id and check_in.user_id != current_user.partner_id:
         raise HTTPException(status_code=403, detail="You can only view like count on your or your partner's check-ins")
     
-    count = crud.get_like_count_by_check_in(db=db, check_in_id=check_in_id)
-    return {"count": count}
+    not_modified = await etags.check_async(request, response, db, current_user, [etags.check_in_scope(check_in_id), etags.USERS])
+    if not_modified is not None:
+        return not_modified
+
+    # 点赞数就在打卡记录的 like_count 列里，上面查打卡时已经一并取出
+    return {"count": check_in.like_count}
+
+
+@app.post("/likes/batch", response_model=List[schemas.LikeActionResult], tags=["Comments & Likes"])
+async def batch_likes(
+    request_data: schemas.LikeBatchRequest,
+    db: DBSession = Depends(get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    批量点赞/取消点赞（比如一口气赞完伴侣当天的所有打卡）：所有条目在一个事务里提交，按顺序返回每一项的结果。
+    不存在或不属于自己和伴侣的打卡不会让整个请求失败，只在对应条目的 status 里标出（not_found / forbidden）。
+    """
+    if current_user.partner_id is None:
+        raise HTTPException(status_code=403, detail="You need to bind a partner to like check-ins")
+    return await async_crud.apply_like_actions(db, user_id=current_user.id, actions=request_data.actions)
 
 
 # --- 得分申请相关API ---
@@ -542,7 +735,7 @@ async def get_like_count(
 @app.post("/score-requests/", response_model=schemas.ScoreRequest, tags=["Score System"])
 async def create_score_request(
     request_data: schemas.ScoreRequestCreate,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """创建得分申请"""
@@ -554,46 +747,73 @@ async def create_score_request(
         )
     
     # 创建得分申请
-    db_request = models.ScoreRequest(
+    return await async_crud.create_score_request(
+        db,
         requester_id=current_user.id,
         target_id=current_user.partner_id,
         points=request_data.points,
         reason=request_data.reason,
-        status="pending"
+        response_model=schemas.ScoreRequest,
     )
-    db.add(db_request)
-    db.commit()
-    db.refresh(db_request)
-    
-    return db_request
 
 
 @app.get("/score-requests/", response_model=List[schemas.ScoreRequest], tags=["Score System"])
+@instrumentation.query_budget(5)
 async def get_score_requests(
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    status_filter: Literal["pending", "approved", "rejected"] | None = Query(None, alias="status"),
+    direction: Literal["incoming", "outgoing", "all"] = "all",
+    limit: int | None = Query(None, ge=1, le=pagination.MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    db: DBSession = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """获取与当前用户相关的得分申请（发出的和收到的）"""
-    requests = db.query(models.ScoreRequest).filter(
-        (models.ScoreRequest.requester_id == current_user.id) |
-        (models.ScoreRequest.target_id == current_user.id)
-    ).order_by(models.ScoreRequest.timestamp.desc()).all()
-    
-    return requests
+    """
+    分页获取与当前用户相关的得分申请（按时间倒序）。
+    - **status**: 只看某个状态的申请，例如 status=pending。
+    - **direction**: incoming 收到的、outgoing 发出的、all（默认）两者都要。
+    - **limit** / **cursor**: 与 /tasks/{task_id}/checkins 相同，下一页游标在 X-Next-Cursor 响应头里。
+    """
+    before = _parse_cursor(cursor)
+    not_modified = await etags.check_async(
+        request, response, db, current_user, [etags.couple_scope(current_user.id, current_user.partner_id), etags.USERS]
+    )
+    if not_modified is not None:
+        return not_modified
+
+    page_size = pagination.resolve_page_size(limit)
+    rows = await async_crud.get_score_requests_for_user(
+        db, user_id=current_user.id, status=status_filter, direction=direction, limit=page_size + 1, before=before,
+        response_model=List[schemas.ScoreRequest],
+    )
+    score_requests, next_cursor = pagination.split_page(rows, page_size)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return score_requests
+
+
+@app.get("/score-requests/pending-count", tags=["Score System"])
+@instrumentation.query_budget(2)
+async def get_pending_score_request_count(
+    db: DBSession = Depends(get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """等待我审批的得分申请数，用于角标显示，不返回申请本身"""
+    count = await async_crud.count_pending_score_requests(db, user_id=current_user.id)
+    return {"count": count}
 
 
 @app.post("/score-requests/{request_id}/respond", tags=["Score System"])
 async def respond_to_score_request(
     request_id: int,
     response: schemas.ScoreRequestResponse,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """响应得分申请（同意或拒绝）"""
     # 查找申请
-    score_request = db.query(models.ScoreRequest).filter(
-        models.ScoreRequest.id == request_id
-    ).first()
+    score_request = await async_crud.get_score_request(db, request_id)
     
     if not score_request:
         raise HTTPException(
@@ -616,20 +836,29 @@ async def respond_to_score_request(
         )
     
     # 处理响应
-    if response.action == "approve":
-        score_request.status = "approved"
-        # 给申请人加分
-        requester = db.query(models.User).filter(models.User.id == score_request.requester_id).first()
-        if requester:
-            requester.score += score_request.points
-    elif response.action == "reject":
-        score_request.status = "rejected"
-    else:
+    if response.action not in ("approve", "reject"):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid action. Must be 'approve' or 'reject'"
         )
+    # 上面的状态检查只是快速失败；并发审批时由 crud 里的条件更新保证只有一次生效
+    if not await async_crud.respond_to_score_request(db, score_request, approve=response.action == "approve"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This request has already been processed"
+        )
     
-    db.commit()
-    
-    return {"message": f"Request {response.action}d successfully"}
\ No newline at end of file
+    return {"message": f"Request {response.action}d successfully"}
+
+
+# --- 监控 ---
+if metrics.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def read_metrics(request: Request):
+        """Prometheus 抓取接口；设置了 METRICS_TOKEN 时需要带上 Authorization: Bearer <METRICS_TOKEN>"""
+        if metrics.METRICS_TOKEN and not secrets.compare_digest(
+            request.headers.get("authorization", ""), f"Bearer {metrics.METRICS_TOKEN}"
+        ):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+        body, content_type = metrics.render()
+        return Response(content=body, media_type=content_type)
@@ -0,0 +1,70 @@
+# 运维命令。用法（在仓库根目录执行）：
+#     python -m backend.manage recount-reactions    按 likes、comments 表重新统计所有打卡的点赞数和评论数
+#     python -m backend.manage replay-score-ledger  按得分流水（score_ledger）重算所有用户的得分
+#     python -m backend.manage audit-routes         列出在事件循环上使用同步 Session 的 async def 路由（有问题时退出码为 1）
+#     python -m backend.manage gc-media             删除超过宽限期、无人引用的图片文件（原图和缩略图）
+# 命令直接写数据库，不经过正在运行的应用；各个 worker 进程里已经缓存的仪表盘要等缓存过期（过去日期的要重启应用）才会更新。
+import argparse
+import sys
+
+from . import crud
+from .database import SessionLocal
+
+
+def recount_reactions(args):
+    with SessionLocal() as db:
+        fixed = crud.recount_reactions(db, batch_size=args.batch_size)
+    print(f"修正了 {fixed} 条打卡的点赞数/评论数")
+
+
+def replay_score_ledger(args):
+    with SessionLocal() as db:
+        fixed = crud.replay_score_ledger(db)
+    print(f"修正了 {fixed} 个用户的得分")
+
+
+def audit_routes(args):
+    # 导入 main 才能拿到所有路由（AUTO_MIGRATE=true 时导入会顺带迁移数据库）
+    from . import loop_monitor
+    from .main import app
+
+    problems = loop_monitor.audit_routes(app)
+    for problem in problems:
+        print(problem)
+    print(f"发现 {len(problems)} 个问题")
+    if problems:
+        sys.exit(1)
+
+
+def gc_media(args):
+    from . import uploads
+
+    with SessionLocal() as db:
+        files, blobs = uploads.collect_garbage(db, grace_seconds=args.grace_hours * 3600)
+    print(f"删除了 {files} 个文件、{blobs} 条文件登记")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.manage", description="HeartBeat 后端运维命令")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    recount = commands.add_parser("recount-reactions", help="重新统计所有打卡的点赞数和评论数")
+    recount.add_argument("--batch-size", type=int, default=1000, help="每批检查的打卡条数（每批一个事务）")
+    recount.set_defaults(func=recount_reactions)
+
+    replay = commands.add_parser("replay-score-ledger", help="按得分流水重算所有用户的得分")
+    replay.set_defaults(func=replay_score_ledger)
+
+    audit = commands.add_parser("audit-routes", help="列出在事件循环上使用同步 Session 的 async def 路由")
+    audit.set_defaults(func=audit_routes)
+
+    gc = commands.add_parser("gc-media", help="删除超过宽限期、无人引用的图片文件")
+    gc.add_argument("--grace-hours", type=float, default=24, help="引用计数归零或写入后至少经过多少小时才删除")
+    gc.set_defaults(func=gc_media)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
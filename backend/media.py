@@ -0,0 +1,118 @@
+# 打卡图片的缩略图生成。
+# 手机上的时间线、仪表盘只需要几十到几百像素的小图，原图动辄几 MB。打卡接口返回之后，
+# 这里的后台线程池为每张原图生成两个 WebP 版本，连同原图尺寸记录到 check_in_images 表，接口通过 CheckIn.images 返回各尺寸地址：
+# - thumb：最长边 MEDIA_THUMB_SIZE（默认 320px），用于列表；
+# - medium：最长边 MEDIA_MEDIUM_SIZE（默认 1280px），用于预览。
+# 缩略图与原图放在同一个存储后端，key 为 <原图 key 去掉扩展名>.<尺寸名>.webp；原图按内容哈希命名，所以同一张图的缩略图只会生成一次。
+# Pillow 是可选依赖：没有安装时不生成缩略图，客户端退回使用原图。
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from . import crud
+from .database import SessionLocal
+from .storage import discard_staging_file, new_staging_file, storage
+
+try:
+    from PIL import ExifTags, Image, ImageOps
+except ImportError:  # 未安装 Pillow
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+MEDIA_VARIANTS_ENABLED = Image is not None and os.getenv("MEDIA_VARIANTS_ENABLED", "true").lower() in ("1", "true", "yes")
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "2"))
+MEDIA_WEBP_QUALITY = int(os.getenv("MEDIA_WEBP_QUALITY", "80"))
+# 尺寸名 -> 最长边像素，从大到小排列：先缩到 medium，再从 medium 缩到 thumb，只解码一次原图
+VARIANT_SIZES = {
+    "medium": int(os.getenv("MEDIA_MEDIUM_SIZE", "1280")),
+    "thumb": int(os.getenv("MEDIA_THUMB_SIZE", "320")),
+}
+
+_executor = ThreadPoolExecutor(max_workers=MEDIA_WORKERS, thread_name_prefix="media")
+_pending: set[Future] = set()  # 排队中或正在生成的任务
+
+
+def _variant_key(source_key: str, name: str) -> str:
+    stem = os.path.splitext(source_key)[0]
+    return f"{stem}.{name}.webp"
+
+
+def _save_webp(image, key: str):
+    '''先写暂存文件再交给存储后端原子地放到位，读取方不会拿到写了一半的图片'''
+    fd, tmp_path = new_staging_file(".variant-")
+    os.close(fd)
+    try:
+        image.save(tmp_path, "WEBP", quality=MEDIA_WEBP_QUALITY)
+        storage.save_file(key, tmp_path, "image/webp")
+    except BaseException:
+        discard_staging_file(tmp_path)
+        raise
+
+
+def _oriented_size(image) -> tuple[int, int]:
+    '''按 EXIF 方向摆正后的尺寸；Orientation 为 5~8 时宽高对调。只读文件头，不解码像素'''
+    width, height = image.size
+    if image.getexif().get(ExifTags.Base.Orientation, 1) in (5, 6, 7, 8):
+        width, height = height, width
+    return width, height
+
+
+def make_variants(source_key: str) -> tuple[dict[str, str], tuple[int, int]]:
+    '''
+    为一张原图生成所有尺寸的 WebP（已存在的跳过），返回 (尺寸名 -> 存储 key, 摆正后的原图尺寸)。
+    所有尺寸都已存在时（同一张图再次上传）只读取原图的文件头取尺寸，不解码。
+    '''
+    keys = {name: _variant_key(source_key, name) for name in VARIANT_SIZES}
+    missing = {name for name, key in keys.items() if not storage.exists(key)}
+
+    with storage.local_copy(source_key) as source_path, Image.open(source_path) as original:
+        size = _oriented_size(original)
+        if not missing:
+            return keys, size
+        # JPEG 可以在解码时直接按 1/2、1/4、1/8 缩小，大照片省下大部分解码时间
+        original.draft("RGB", (VARIANT_SIZES["medium"], VARIANT_SIZES["medium"]))
+        image = ImageOps.exif_transpose(original)  # 按 EXIF 方向摆正手机照片
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or "A" in image.getbands() else "RGB")
+        for name, max_side in VARIANT_SIZES.items():
+            image.thumbnail((max_side, max_side))
+            if name in missing:
+                _save_webp(image, keys[name])
+    return keys, size
+
+
+def generate_variants(check_in_id: int, image_keys: list[str]):
+    '''后台任务：为一条打卡的所有图片生成缩略图，并记录到数据库'''
+    variants = []
+    for key in image_keys:
+        try:
+            keys, size = make_variants(key)
+        except Exception:
+            logger.exception("生成缩略图失败: %s", key)
+            variants.append({})
+            continue
+        variant = {name: storage.url(variant_key) for name, variant_key in keys.items()}
+        variant["width"], variant["height"] = size
+        variants.append(variant)
+
+    db = SessionLocal()
+    try:
+        crud.set_check_in_image_variants(db, check_in_id, variants)
+    finally:
+        db.close()
+
+
+def enqueue_variants(check_in_id: int, image_keys: list[str]) -> Future | None:
+    '''把缩略图生成放进后台队列，立即返回；未启用或没有图片时返回 None'''
+    if not MEDIA_VARIANTS_ENABLED or not image_keys:
+        return None
+    future = _executor.submit(generate_variants, check_in_id, list(image_keys))
+    _pending.add(future)
+    future.add_done_callback(_pending.discard)
+    return future
+
+
+def wait_idle(timeout: float | None = None):
+    '''等待已经提交的缩略图任务全部完成（压测、脚本在退出前调用）'''
+    wait(list(_pending), timeout=timeout)
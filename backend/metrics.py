@@ -0,0 +1,193 @@
+# Prometheus 监控指标（GET /metrics）。
+# gunicorn 多 worker 部署时，每个请求只落在其中一个进程上，进程内的统计（auth_cache_stats 之类）看不到全局。
+# 这里用 prometheus_client 导出：
+# - heartbeat_http_request_duration_seconds：按 方法 + 路由模板 + 状态码 的请求耗时直方图（路由模板如 /tasks/{task_id}，不会因为 id 不同产生无数条时间序列）；
+# - heartbeat_http_requests_in_progress：正在处理的请求数（SSE 长连接也算在内）；
+# - heartbeat_db_pool_checkouts_total / heartbeat_db_pool_checkout_seconds / heartbeat_db_pool_checked_out：
+#   从连接池取连接的次数、等待时间（包括新建连接）和当前借出的连接数；
+# - heartbeat_upload_bytes：上传图片的大小（_sum 是总字节数）；
+# - heartbeat_auth_cache_requests_total：认证缓存的命中 / 未命中，命中率 = hit / (hit + miss)；
+# - heartbeat_password_hash_total：bcrypt 哈希 / 校验的次数（登录、注册）；
+# - heartbeat_event_loop_lag_seconds：事件循环的延迟（每隔 METRICS_LOOP_LAG_INTERVAL 秒 sleep 一次，实际醒来比预期晚了多少）；
+# - heartbeat_event_loop_blocks_total / heartbeat_event_loop_blocked_seconds_total：按路由统计的事件循环阻塞（见 loop_monitor）。
+#
+# 多进程：启动前把环境变量 PROMETHEUS_MULTIPROC_DIR 指向一个空目录（每次启动前清空），各 worker 把指标写进这个目录下的
+# mmap 文件，/metrics 汇总所有 worker 的数据；worker 退出时由 gunicorn.conf.py 的 child_exit 清理它的在途数据。
+# 没有设置时只导出当前进程的指标，适合单进程的 uvicorn。
+# 每次记录只是对共享内存里一个数字的加法，开销很小，可以在生产环境常开。
+# prometheus_client 是可选依赖：没有安装（或 METRICS_ENABLED=false）时不注册 /metrics，下面的 record_* 函数什么都不做。
+import asyncio
+import os
+import time
+
+from sqlalchemy import event
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import database
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # 未安装 prometheus_client
+    prometheus_client = None
+
+METRICS_ENABLED = prometheus_client is not None and os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# 设置后 /metrics 要求请求头 Authorization: Bearer <METRICS_TOKEN>；留空时不校验（由反向代理限制访问）
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+UPLOAD_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 10 * 1024 * 1024)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+if METRICS_ENABLED:
+    REQUEST_DURATION = prometheus_client.Histogram(
+        "heartbeat_http_request_duration_seconds", "HTTP 请求耗时", ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+    )
+    REQUESTS_IN_PROGRESS = prometheus_client.Gauge(
+        "heartbeat_http_requests_in_progress", "正在处理的 HTTP 请求数", multiprocess_mode="livesum",
+    )
+    DB_POOL_CHECKOUTS = prometheus_client.Counter("heartbeat_db_pool_checkouts_total", "从连接池取连接的次数")
+    DB_POOL_CHECKOUT_SECONDS = prometheus_client.Histogram(
+        "heartbeat_db_pool_checkout_seconds", "从连接池取连接的等待时间（包括新建连接）", buckets=POOL_WAIT_BUCKETS,
+    )
+    DB_POOL_CHECKED_OUT = prometheus_client.Gauge(
+        "heartbeat_db_pool_checked_out", "当前借出的数据库连接数", multiprocess_mode="livesum",
+    )
+    UPLOAD_BYTES = prometheus_client.Histogram("heartbeat_upload_bytes", "上传图片的字节数", ["source"], buckets=UPLOAD_BUCKETS)
+    AUTH_CACHE_REQUESTS = prometheus_client.Counter(
+        "heartbeat_auth_cache_requests_total", "认证缓存的查询次数", ["cache", "result"],
+    )
+    PASSWORD_HASHES = prometheus_client.Counter("heartbeat_password_hash_total", "bcrypt 哈希 / 校验次数", ["operation"])
+    EVENT_LOOP_LAG = prometheus_client.Histogram(
+        "heartbeat_event_loop_lag_seconds", "事件循环延迟", buckets=LOOP_LAG_BUCKETS,
+    )
+    EVENT_LOOP_BLOCKS = prometheus_client.Counter("heartbeat_event_loop_blocks_total", "事件循环阻塞次数", ["route"])
+    EVENT_LOOP_BLOCKED_SECONDS = prometheus_client.Counter(
+        "heartbeat_event_loop_blocked_seconds_total", "事件循环阻塞的总时长", ["route"],
+    )
+
+
+def record_upload(size: int, source: str):
+    '''记录一张上传的图片；source 是 form（经由打卡接口上传）或 direct（直传到对象存储）'''
+    if METRICS_ENABLED:
+        UPLOAD_BYTES.labels(source=source).observe(size)
+
+
+def record_auth_cache(cache: str, hit: bool):
+    if METRICS_ENABLED:
+        AUTH_CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def record_password_hash(operation: str):
+    '''operation 是 hash（注册、改密码）或 verify（登录）'''
+    if METRICS_ENABLED:
+        PASSWORD_HASHES.labels(operation=operation).inc()
+
+
+def record_loop_block(route: str, seconds: float):
+    if METRICS_ENABLED:
+        EVENT_LOOP_BLOCKS.labels(route=route).inc()
+        EVENT_LOOP_BLOCKED_SECONDS.labels(route=route).inc(seconds)
+
+
+def instrument_engine(engine):
+    '''统计连接池的借出次数、等待时间和借出中的连接数；异步引擎传入它的 sync_engine'''
+    if not METRICS_ENABLED:
+        return
+    # Connection 通过 engine.raw_connection() 从连接池取连接（AsyncConnection 也是），在这里计时就是等待连接池的时间
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection():
+        started = time.perf_counter()
+        connection = raw_connection()
+        DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+        DB_POOL_CHECKOUTS.inc()
+        return connection
+
+    engine.raw_connection = timed_raw_connection
+    event.listen(engine, "checkout", lambda *args: DB_POOL_CHECKED_OUT.inc())
+    event.listen(engine, "checkin", lambda *args: DB_POOL_CHECKED_OUT.dec())
+
+
+class MetricsMiddleware:
+    '''记录每个 HTTP 请求的耗时和在途请求数；耗时按路由模板分组，匹配不到路由的请求记为 unmatched'''
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_PROGRESS.dec()
+            route = scope.get("route")
+            REQUEST_DURATION.labels(
+                method=scope["method"],
+                route=route.path if route is not None else "unmatched",
+                status=str(status_code),
+            ).observe(time.perf_counter() - started)
+
+
+async def _monitor_event_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(METRICS_LOOP_LAG_INTERVAL)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - started - METRICS_LOOP_LAG_INTERVAL))
+
+
+_lag_monitor: asyncio.Task | None = None
+
+
+async def start():
+    '''应用启动时调用：开始测量事件循环延迟'''
+    global _lag_monitor
+    if METRICS_ENABLED and _lag_monitor is None:
+        _lag_monitor = asyncio.create_task(_monitor_event_loop_lag())
+
+
+async def stop():
+    global _lag_monitor
+    if _lag_monitor is not None:
+        _lag_monitor.cancel()
+        try:
+            await _lag_monitor
+        except asyncio.CancelledError:
+            pass
+        _lag_monitor = None
+
+
+def render() -> tuple[bytes, str]:
+    '''/metrics 的响应体和 Content-Type；多进程模式下汇总所有 worker 的数据'''
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def setup(app):
+    '''注册中间件和连接池统计；未启用时什么都不做（/metrics 路由由 main 根据 METRICS_ENABLED 注册）'''
+    if not METRICS_ENABLED:
+        return
+    instrument_engine(database.engine)
+    if database.async_engine is not None:
+        instrument_engine(database.async_engine.sync_engine)
+    app.add_middleware(MetricsMiddleware)
@@ -0,0 +1,38 @@
+# 数据库迁移入口。表结构由 Alembic 迁移脚本（backend/migrations/versions）管理，不再使用 create_all。
+# 用法（在仓库根目录执行）：python -m backend.migrate
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect
+
+from .database import engine
+
+# 为 true 时应用启动（导入 main）时自动升级到最新版本，方便本地开发；
+# 多 worker 的生产部署建议设为 false，在启动 gunicorn 之前单独执行一次 python -m backend.migrate，避免多个 worker 同时迁移。
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "true").lower() in ("1", "true", "yes")
+
+# 与引入迁移之前 create_all 建出的表结构对应的版本
+BASELINE_REVISION = "0001_baseline"
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def alembic_config() -> Config:
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    config.attributes["configure_logger"] = False
+    return config
+
+
+def upgrade_to_head():
+    '''把数据库升级到最新版本'''
+    config = alembic_config()
+    tables = set(inspect(engine).get_table_names())
+    if "users" in tables and "alembic_version" not in tables:
+        # 由 create_all 建出来的旧数据库：表已经存在但没有版本记录，先标记为基线版本，再执行后续迁移
+        command.stamp(config, BASELINE_REVISION)
+    command.upgrade(config, "head")
+
+
+if __name__ == "__main__":
+    upgrade_to_head()
@@ -0,0 +1,43 @@
+# Alembic 运行环境：复用应用自己的 engine（DATABASE_URL、连接池、SQLite PRAGMA 都与应用一致）和 models 的元数据。
+from logging.config import fileConfig
+
+from alembic import context
+
+from backend import models  # noqa: F401  导入模型，让所有表注册到 Base.metadata
+from backend.database import Base, engine
+
+target_metadata = Base.metadata
+
+# 命令行执行时按 alembic.ini 配置日志；由应用内调用（migrate.py）时不改动应用的日志配置
+if context.config.config_file_name and context.config.attributes.get("configure_logger", True):
+    fileConfig(context.config.config_file_name, disable_existing_loggers=False)
+
+
+def run_migrations_offline():
+    '''只生成 SQL 脚本、不连接数据库（alembic upgrade head --sql）'''
+    context.configure(
+        url=engine.url.render_as_string(hide_password=False),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=engine.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    with engine.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            # SQLite 不支持大部分 ALTER TABLE，用 batch 模式（建新表、拷数据、换表名）完成表结构修改
+            render_as_batch=connection.dialect.name == "sqlite",
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
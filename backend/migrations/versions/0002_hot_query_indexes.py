@@ -0,0 +1,47 @@
+"""为 crud.py 中的高频查询条件建立复合索引，并对点赞加唯一约束
+
+Revision ID: 0002_hot_query_indexes
+Revises: 0001_baseline
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002_hot_query_indexes"
+down_revision = "0001_baseline"
+branch_labels = None
+depends_on = None
+
+
+# (索引名, 表名, 列, 是否唯一)
+INDEXES = [
+    # 任务时间线游标分页；用 create_all 建库的环境里可能已经存在
+    ("ix_check_ins_task_id_timestamp_id", "check_ins", ["task_id", "timestamp", "id"], False),
+    # get_check_ins_for_user_on_date
+    ("ix_check_ins_user_id_timestamp", "check_ins", ["user_id", "timestamp"], False),
+    # get_comments_by_check_in / get_comment_by_user
+    ("ix_comments_check_in_id_user_id", "comments", ["check_in_id", "user_id"], False),
+    # create_like / delete_like，同时保证每人每条打卡只有一个赞
+    ("uq_likes_user_id_check_in_id", "likes", ["user_id", "check_in_id"], True),
+    # get_likes_by_check_in / get_like_count_by_check_in
+    ("ix_likes_check_in_id_timestamp", "likes", ["check_in_id", "timestamp"], False),
+    # get_score_requests_for_user 的 requester_id = ? OR target_id = ?
+    ("ix_score_requests_requester_id_timestamp", "score_requests", ["requester_id", "timestamp"], False),
+    ("ix_score_requests_target_id_timestamp", "score_requests", ["target_id", "timestamp"], False),
+]
+
+
+def upgrade():
+    # 之前的 create_like 是先查再插，并发请求可能留下重复点赞；建唯一索引前只保留每组里最早的一条
+    likes = sa.table("likes", sa.column("id"), sa.column("user_id"), sa.column("check_in_id"))
+    keep = sa.select(sa.func.min(likes.c.id)).group_by(likes.c.user_id, likes.c.check_in_id)
+    op.execute(likes.delete().where(likes.c.id.not_in(keep)))
+
+    for name, table, columns, unique in INDEXES:
+        op.create_index(name, table, columns, unique=unique, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
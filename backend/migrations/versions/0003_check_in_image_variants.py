@@ -0,0 +1,23 @@
+"""check_ins 增加 image_variants，记录后台生成的缩略图地址
+
+Revision ID: 0003_check_in_image_variants
+Revises: 0002_hot_query_indexes
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003_check_in_image_variants"
+down_revision = "0002_hot_query_indexes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("check_ins", sa.Column("image_variants", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("check_ins") as batch_op:
+        batch_op.drop_column("image_variants")
@@ -0,0 +1,167 @@
+"""check_in_images：每张打卡图片一行，取代 check_ins.image_url 里逗号拼接的地址和 image_variants
+
+Revision ID: 0005_check_in_images
+Revises: 0004_media_blobs
+Create Date: 2026-10-18
+"""
+import os
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005_check_in_images"
+down_revision = "0004_media_blobs"
+branch_labels = None
+depends_on = None
+
+
+# 每批转换的打卡条数：按 id 分批读取、批量插入，不会一次把整张 check_ins 读进内存
+BATCH_SIZE = 500
+
+# 迁移把 check_ins.image_url 里逗号分隔的每个地址原样复制成一行 check_in_images，缩略图地址取自 image_variants。
+# 内容寻址上传的地址是 .../<aa>/<bb>/<sha256>.<扩展名>（见 uploads 模块），文件名主干就是 sha256，据此关联 media_blobs；
+# 更早上传的 <用户id>_<时间戳>_<序号>.<扩展名> 文件没有登记，sha256、size、mime_type 留空
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+check_ins = sa.table(
+    "check_ins",
+    sa.column("id", sa.Integer),
+    sa.column("image_url", sa.String),
+    sa.column("image_variants", sa.JSON),
+)
+check_in_images = sa.table(
+    "check_in_images",
+    sa.column("check_in_id", sa.Integer),
+    sa.column("position", sa.Integer),
+    sa.column("original", sa.String),
+    sa.column("thumb", sa.String),
+    sa.column("medium", sa.String),
+    sa.column("sha256", sa.String),
+    sa.column("size", sa.Integer),
+    sa.column("mime_type", sa.String),
+)
+media_blobs = sa.table(
+    "media_blobs",
+    sa.column("sha256", sa.String),
+    sa.column("size", sa.Integer),
+    sa.column("mime_type", sa.String),
+)
+
+
+def _sha256_of(url: str) -> str | None:
+    stem = os.path.basename(url).split(".", 1)[0]
+    return stem if SHA256_PATTERN.match(stem) else None
+
+
+def upgrade():
+    op.create_table(
+        "check_in_images",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("check_in_id", sa.Integer(), nullable=False),
+        sa.Column("position", sa.Integer(), nullable=False),
+        sa.Column("original", sa.String(), nullable=False),
+        sa.Column("thumb", sa.String(), nullable=True),
+        sa.Column("medium", sa.String(), nullable=True),
+        sa.Column("sha256", sa.String(length=64), nullable=True),
+        sa.Column("size", sa.Integer(), nullable=True),
+        sa.Column("mime_type", sa.String(), nullable=True),
+        sa.Column("width", sa.Integer(), nullable=True),
+        sa.Column("height", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["check_in_id"], ["check_ins.id"]),
+        sa.ForeignKeyConstraint(["sha256"], ["media_blobs.sha256"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("uq_check_in_images_check_in_id_position", "check_in_images", ["check_in_id", "position"], unique=True)
+    op.create_index("ix_check_in_images_sha256", "check_in_images", ["sha256"])
+
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(check_ins.c.id, check_ins.c.image_url, check_ins.c.image_variants)
+            .where(check_ins.c.id > last_id, check_ins.c.image_url.is_not(None))
+            .order_by(check_ins.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        images = []
+        for row in rows:
+            urls = [url.strip() for url in row.image_url.split(",") if url.strip()]
+            variants = row.image_variants or []
+            for position, url in enumerate(urls):
+                variant = variants[position] if position < len(variants) else {}
+                images.append({
+                    "check_in_id": row.id,
+                    "position": position,
+                    "original": url,
+                    "thumb": variant.get("thumb"),
+                    "medium": variant.get("medium"),
+                    "sha256": _sha256_of(url),
+                })
+
+        # 一条查询取回这一批图片对应的文件登记
+        hashes = {image["sha256"] for image in images if image["sha256"]}
+        blobs = {}
+        if hashes:
+            blobs = {
+                blob.sha256: blob
+                for blob in conn.execute(sa.select(media_blobs).where(media_blobs.c.sha256.in_(hashes)))
+            }
+        for image in images:
+            blob = blobs.get(image["sha256"])
+            image["sha256"] = blob.sha256 if blob else None
+            image["size"] = blob.size if blob else None
+            image["mime_type"] = blob.mime_type if blob else None
+        if images:
+            conn.execute(check_in_images.insert(), images)
+
+    with op.batch_alter_table("check_ins") as batch_op:
+        batch_op.drop_column("image_variants")
+        batch_op.drop_column("image_url")
+
+
+def downgrade():
+    with op.batch_alter_table("check_ins") as batch_op:
+        batch_op.add_column(sa.Column("image_url", sa.String(), nullable=True))
+        batch_op.add_column(sa.Column("image_variants", sa.JSON(), nullable=True))
+
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        check_in_ids = conn.execute(
+            sa.select(check_in_images.c.check_in_id.distinct())
+            .where(check_in_images.c.check_in_id > last_id)
+            .order_by(check_in_images.c.check_in_id)
+            .limit(BATCH_SIZE)
+        ).scalars().all()
+        if not check_in_ids:
+            break
+        last_id = check_in_ids[-1]
+
+        grouped = {}
+        for image in conn.execute(
+            sa.select(check_in_images)
+            .where(check_in_images.c.check_in_id.in_(check_in_ids))
+            .order_by(check_in_images.c.check_in_id, check_in_images.c.position)
+        ):
+            grouped.setdefault(image.check_in_id, []).append(image)
+        for check_in_id, images in grouped.items():
+            variants = [
+                {name: getattr(image, name) for name in ("thumb", "medium") if getattr(image, name)}
+                for image in images
+            ]
+            conn.execute(
+                check_ins.update().where(check_ins.c.id == check_in_id).values(
+                    image_url=",".join(image.original for image in images),
+                    image_variants=variants if any(variants) else sa.null(),
+                )
+            )
+
+    op.drop_index("ix_check_in_images_sha256", table_name="check_in_images")
+    op.drop_index("uq_check_in_images_check_in_id_position", table_name="check_in_images")
+    op.drop_table("check_in_images")
@@ -0,0 +1,27 @@
+"""version_stamps：读接口条件请求（ETag）使用的版本号
+
+Revision ID: 0006_version_stamps
+Revises: 0005_check_in_images
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006_version_stamps"
+down_revision = "0005_check_in_images"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "version_stamps",
+        sa.Column("scope", sa.String(), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("scope"),
+    )
+
+
+def downgrade():
+    op.drop_table("version_stamps")
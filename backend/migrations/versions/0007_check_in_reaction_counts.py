@@ -0,0 +1,44 @@
+"""check_ins.like_count / comment_count：冗余存储的点赞数和评论数
+
+Revision ID: 0007_check_in_reaction_counts
+Revises: 0006_version_stamps
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007_check_in_reaction_counts"
+down_revision = "0006_version_stamps"
+branch_labels = None
+depends_on = None
+
+
+check_ins = sa.table(
+    "check_ins",
+    sa.column("id", sa.Integer),
+    sa.column("like_count", sa.Integer),
+    sa.column("comment_count", sa.Integer),
+)
+likes = sa.table("likes", sa.column("check_in_id", sa.Integer))
+comments = sa.table("comments", sa.column("check_in_id", sa.Integer))
+
+
+def upgrade():
+    with op.batch_alter_table("check_ins") as batch_op:
+        batch_op.add_column(sa.Column("like_count", sa.Integer(), server_default="0", nullable=False))
+        batch_op.add_column(sa.Column("comment_count", sa.Integer(), server_default="0", nullable=False))
+
+    # 一条 UPDATE 统计所有已有的点赞和评论（likes、comments 上都有以 check_in_id 开头的索引）
+    op.execute(check_ins.update().values(
+        like_count=sa.select(sa.func.count()).select_from(likes)
+        .where(likes.c.check_in_id == check_ins.c.id).scalar_subquery(),
+        comment_count=sa.select(sa.func.count()).select_from(comments)
+        .where(comments.c.check_in_id == check_ins.c.id).scalar_subquery(),
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table("check_ins") as batch_op:
+        batch_op.drop_column("comment_count")
+        batch_op.drop_column("like_count")
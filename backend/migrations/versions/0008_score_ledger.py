@@ -0,0 +1,78 @@
+"""score_ledger：只追加的得分流水，users.score 等于流水之和
+
+Revision ID: 0008_score_ledger
+Revises: 0007_check_in_reaction_counts
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008_score_ledger"
+down_revision = "0007_check_in_reaction_counts"
+branch_labels = None
+depends_on = None
+
+
+users = sa.table("users", sa.column("id", sa.Integer), sa.column("score", sa.Integer))
+score_requests = sa.table(
+    "score_requests",
+    sa.column("id", sa.Integer),
+    sa.column("requester_id", sa.Integer),
+    sa.column("points", sa.Integer),
+    sa.column("status", sa.String),
+    sa.column("timestamp", sa.DateTime),
+)
+score_ledger = sa.table(
+    "score_ledger",
+    sa.column("user_id", sa.Integer),
+    sa.column("delta", sa.Integer),
+    sa.column("kind", sa.String),
+    sa.column("score_request_id", sa.Integer),
+    sa.column("created_at", sa.DateTime),
+)
+
+
+def upgrade():
+    op.create_table(
+        "score_ledger",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("delta", sa.Integer(), nullable=False),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("score_request_id", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["score_request_id"], ["score_requests.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_score_ledger_id", "score_ledger", ["id"])
+    op.create_index("ix_score_ledger_user_id_id", "score_ledger", ["user_id", "id"])
+    op.create_index("uq_score_ledger_score_request_id", "score_ledger", ["score_request_id"], unique=True)
+
+    # 已经审批通过的申请各记一条流水
+    op.execute(score_ledger.insert().from_select(
+        ["user_id", "delta", "kind", "score_request_id", "created_at"],
+        sa.select(
+            score_requests.c.requester_id, score_requests.c.points, sa.literal("score_request"),
+            score_requests.c.id, score_requests.c.timestamp,
+        ).where(score_requests.c.status == "approved"),
+    ))
+    # 现有得分与流水之和不一致的部分（比如手工改过的分数）记为期初余额，保证重算后得分不变
+    ledger_sum = sa.select(sa.func.coalesce(sa.func.sum(score_ledger.c.delta), 0)).where(
+        score_ledger.c.user_id == users.c.id
+    ).scalar_subquery()
+    op.execute(score_ledger.insert().from_select(
+        ["user_id", "delta", "kind", "score_request_id", "created_at"],
+        sa.select(
+            users.c.id, users.c.score - ledger_sum, sa.literal("opening_balance"),
+            sa.null(), sa.func.current_timestamp(),
+        ).where(users.c.score != ledger_sum),
+    ))
+
+
+def downgrade():
+    op.drop_index("uq_score_ledger_score_request_id", table_name="score_ledger")
+    op.drop_index("ix_score_ledger_user_id_id", table_name="score_ledger")
+    op.drop_index("ix_score_ledger_id", table_name="score_ledger")
+    op.drop_table("score_ledger")
@@ -0,0 +1,40 @@
+"""得分申请收件箱：按 (timestamp, id) 游标分页、按状态过滤的复合索引
+
+Revision ID: 0009_score_request_inbox_indexes
+Revises: 0008_score_ledger
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+
+revision = "0009_score_request_inbox_indexes"
+down_revision = "0008_score_ledger"
+branch_labels = None
+depends_on = None
+
+
+# 以前的 (requester_id, timestamp) / (target_id, timestamp) 被下面带 id 的索引覆盖
+OLD_INDEXES = [
+    ("ix_score_requests_requester_id_timestamp", ["requester_id", "timestamp"]),
+    ("ix_score_requests_target_id_timestamp", ["target_id", "timestamp"]),
+]
+NEW_INDEXES = [
+    ("ix_score_requests_requester_id_timestamp_id", ["requester_id", "timestamp", "id"]),
+    ("ix_score_requests_target_id_timestamp_id", ["target_id", "timestamp", "id"]),
+    ("ix_score_requests_requester_id_status_timestamp_id", ["requester_id", "status", "timestamp", "id"]),
+    ("ix_score_requests_target_id_status_timestamp_id", ["target_id", "status", "timestamp", "id"]),
+]
+
+
+def upgrade():
+    for name, columns in NEW_INDEXES:
+        op.create_index(name, "score_requests", columns)
+    for name, _ in OLD_INDEXES:
+        op.drop_index(name, table_name="score_requests", if_exists=True)
+
+
+def downgrade():
+    for name, columns in OLD_INDEXES:
+        op.create_index(name, "score_requests", columns)
+    for name, _ in reversed(NEW_INDEXES):
+        op.drop_index(name, table_name="score_requests")
@@ -0,0 +1,24 @@
+"""media_blobs.released_at：引用计数减到 0 的时间，清理无人引用的文件时使用
+
+Revision ID: 0010_media_blob_released_at
+Revises: 0009_score_request_inbox_indexes
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0010_media_blob_released_at"
+down_revision = "0009_score_request_inbox_indexes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("media_blobs") as batch_op:
+        batch_op.add_column(sa.Column("released_at", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("media_blobs") as batch_op:
+        batch_op.drop_column("released_at")
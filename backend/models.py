@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text,Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Boolean, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 import datetime
@@ -46,12 +46,72 @@ class CheckIn(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False) # 打卡人
     timestamp = Column(DateTime, default=lambda: datetime.datetime.now(pytz.timezone('Asia/Shanghai')), nullable=False) # 打卡时间
     text = Column(Text, nullable=True) # 打卡信息
-    image_url = Column(String, nullable=True) # 打卡图片
+    # 点赞数和评论数：点赞/评论的增删在同一个事务里用 SQL 加减（见 crud），读取时不用再 COUNT；
+    # 不一致时可以用 python -m backend.manage recount-reactions 重新统计
+    like_count = Column(Integer, default=0, server_default="0", nullable=False)
+    comment_count = Column(Integer, default=0, server_default="0", nullable=False)
 
     task = relationship("Task", back_populates="check_ins")
     user = relationship("User", back_populates="check_ins")
-    comments = relationship("Comment", back_populates="check_in")
-    likes = relationship("Like", back_populates="check_in")
+    comments = relationship("Comment", back_populates="check_in", order_by="Comment.timestamp.asc()")
+    likes = relationship("Like", back_populates="check_in", order_by="Like.timestamp.desc()")
+    # 打卡图片按上传顺序排列；lazy="selectin"：查询打卡时总是用一条 IN 查询一并取出这一批打卡的所有图片，不会逐条懒加载
+    images = relationship(
+        "CheckInImage", back_populates="check_in", order_by="CheckInImage.position",
+        lazy="selectin", cascade="all, delete-orphan",
+    )
+
+    @property
+    def image_url(self):
+        '''兼容旧客户端：所有原图地址用逗号拼接（以前存在 check_ins.image_url 列里）'''
+        return ",".join(image.original for image in self.images) or None
+
+    __table_args__ = (
+        # 任务时间线按 (timestamp, id) 倒序做游标分页，这个复合索引让每一页都是一次索引范围扫描
+        Index("ix_check_ins_task_id_timestamp_id", "task_id", "timestamp", "id"),
+        # 每日仪表盘按 用户 + 时间范围 查询打卡
+        Index("ix_check_ins_user_id_timestamp", "user_id", "timestamp"),
+    )
+
+
+class CheckInImage(Base):
+    """打卡的一张图片：原图地址、各尺寸缩略图地址和图片元数据"""
+    __tablename__ = "check_in_images"
+
+    id = Column(Integer, primary_key=True)
+    check_in_id = Column(Integer, ForeignKey("check_ins.id"), nullable=False)
+    position = Column(Integer, nullable=False)  # 在这条打卡里的顺序，从 0 开始
+    original = Column(String, nullable=False)   # 原图地址
+    thumb = Column(String, nullable=True)       # 缩略图地址，由 media 模块在后台生成，生成之前为空
+    medium = Column(String, nullable=True)
+    # 内容寻址存储里的文件；引入内容寻址之前上传的旧图片没有对应的登记，为空
+    sha256 = Column(String(64), ForeignKey("media_blobs.sha256"), nullable=True)
+    size = Column(Integer, nullable=True)       # 字节数
+    mime_type = Column(String, nullable=True)
+    width = Column(Integer, nullable=True)      # 按 EXIF 方向摆正后的像素尺寸，生成缩略图时记录
+    height = Column(Integer, nullable=True)
+
+    check_in = relationship("CheckIn", back_populates="images")
+
+    __table_args__ = (
+        # 同一条打卡里每个位置只有一张图片，同时用于按打卡取图片
+        Index("uq_check_in_images_check_in_id_position", "check_in_id", "position", unique=True),
+        # 按文件统计被引用的次数
+        Index("ix_check_in_images_sha256", "sha256"),
+    )
+
+
+class MediaBlob(Base):
+    """内容寻址存储里的一个文件（见 uploads 模块），同样内容的图片只存一份"""
+    __tablename__ = "media_blobs"
+
+    sha256 = Column(String(64), primary_key=True)  # 文件内容的 SHA-256，同时决定存储路径
+    path = Column(String, nullable=False)           # 存储 key（本地存储时是 UPLOAD_DIR 下的相对路径）
+    size = Column(Integer, nullable=False)          # 字节数
+    mime_type = Column(String, nullable=False)
+    ref_count = Column(Integer, default=0, nullable=False)  # 被多少张打卡图片引用，为 0 时文件可以被清理
+    released_at = Column(DateTime, nullable=True)  # 引用计数最近一次减到 0 的时间，超过宽限期后由 uploads.collect_garbage 清理
+    created_at = Column(DateTime, default=lambda: datetime.datetime.now(pytz.timezone('Asia/Shanghai')), nullable=False)
 
 
 class Comment(Base):
@@ -66,6 +126,11 @@ class Comment(Base):
     check_in = relationship("CheckIn", back_populates="comments")
     user = relationship("User", back_populates="comments")
 
+    __table_args__ = (
+        # 按打卡记录列出评论、查某人对某条打卡的评论
+        Index("ix_comments_check_in_id_user_id", "check_in_id", "user_id"),
+    )
+
 
 class Like(Base):
     __tablename__ = "likes"
@@ -78,6 +143,13 @@ class Like(Base):
     check_in = relationship("CheckIn", back_populates="likes")
     user = relationship("User", back_populates="likes")
 
+    __table_args__ = (
+        # 每人对每条打卡只能点一次赞，由数据库保证（并发重复点赞会触发 IntegrityError）
+        Index("uq_likes_user_id_check_in_id", "user_id", "check_in_id", unique=True),
+        # 按打卡记录列出点赞、统计点赞数
+        Index("ix_likes_check_in_id_timestamp", "check_in_id", "timestamp"),
+    )
+
 
 class ScoreRequest(Base):
     __tablename__ = "score_requests"
@@ -91,4 +163,39 @@ class ScoreRequest(Base):
     timestamp = Column(DateTime, default=lambda: datetime.datetime.now(pytz.timezone('Asia/Shanghai')), nullable=False)
     
     requester = relationship("User", foreign_keys=[requester_id])
-    target = relationship("User", foreign_keys=[target_id])
\ No newline at end of file
+    target = relationship("User", foreign_keys=[target_id])
+
+    __table_args__ = (
+        # 得分申请列表按 申请人 / 被申请人（可选再按状态）过滤，按 (timestamp, id) 倒序做游标分页
+        Index("ix_score_requests_requester_id_timestamp_id", "requester_id", "timestamp", "id"),
+        Index("ix_score_requests_target_id_timestamp_id", "target_id", "timestamp", "id"),
+        Index("ix_score_requests_requester_id_status_timestamp_id", "requester_id", "status", "timestamp", "id"),
+        # 同时用于统计待我审批的申请数（target_id = ? AND status = 'pending'）
+        Index("ix_score_requests_target_id_status_timestamp_id", "target_id", "status", "timestamp", "id"),
+    )
+
+class ScoreLedgerEntry(Base):
+    """得分流水：只追加、不修改，每个用户的 score 始终等于他所有流水 delta 之和（可以用 python -m backend.manage replay-score-ledger 重算）"""
+    __tablename__ = "score_ledger"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    delta = Column(Integer, nullable=False)                                      # 得分变化
+    kind = Column(String, nullable=False)                                        # score_request：审批通过的得分申请；opening_balance：引入流水之前已有的得分
+    score_request_id = Column(Integer, ForeignKey("score_requests.id"), nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.datetime.now(pytz.timezone('Asia/Shanghai')), nullable=False)
+
+    __table_args__ = (
+        # 按用户汇总/列出流水
+        Index("ix_score_ledger_user_id_id", "user_id", "id"),
+        # 一条得分申请最多入账一次：即使绕过了条件更新，数据库也会拒绝重复加分
+        Index("uq_score_ledger_score_request_id", "score_request_id", unique=True),
+    )
+
+
+class VersionStamp(Base):
+    """读接口的版本号（见 etags 模块）：写操作在同一个事务里给受影响的范围加一，读接口据此生成 ETag"""
+    __tablename__ = "version_stamps"
+
+    scope = Column(String, primary_key=True)                # 范围，例如 tasks、users、couple:1-2、check_in:42
+    version = Column(Integer, default=0, nullable=False)
@@ -0,0 +1,50 @@
+# 游标分页（Keyset Pagination）工具。
+# OFFSET 分页在翻到很深的页时，数据库仍要先扫描并丢弃前面所有行；而游标分页记住“上一页最后一行”的排序键 (timestamp, id)，
+# 下一页直接用 WHERE (timestamp, id) < (上一页最后一行) 从索引里接着读，所以无论表里有 50 行还是 50 万行，每一页的代价都一样。
+# 游标对客户端是不透明的字符串（base64 编码），客户端只需要原样带回来，不应该去解析它。
+import base64
+import datetime
+import json
+import os
+
+# 每页默认条数和允许的最大条数，可通过环境变量调整
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "200"))
+
+# 下一页游标通过响应头返回，列表接口的响应体保持不变
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(timestamp: datetime.datetime, row_id: int) -> str:
+    '''把一行的排序键 (timestamp, id) 编码成不透明的游标字符串'''
+    raw = json.dumps([timestamp.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    '''解析游标，格式不合法时抛出 ValueError'''
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.datetime.fromisoformat(timestamp), int(row_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def resolve_page_size(limit: int | None) -> int:
+    '''未指定时使用默认页大小，并且不超过上限'''
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def split_page(rows: list, page_size: int) -> tuple[list, str | None]:
+    '''
+    查询时多取一行（page_size + 1），用来判断是否还有下一页。
+    返回 (本页数据, 下一页游标)，没有下一页时游标为 None。
+    '''
+    if len(rows) <= page_size:
+        return rows, None
+    page = rows[:page_size]
+    last = page[-1]
+    return page, encode_cursor(last.timestamp, last.id)
@@ -4,8 +4,8 @@
 # 比如， UserCreate 模型要求客户端必须提供 username 和 password 两个字符串字段，如果缺了或者类型不对，FastAPI 会自动返回一个清晰的 422 Unprocessable Entity 错误，根本不会进入我们的业务逻辑。
 # 输出过滤 ：当我们的 API 要返回数据给客户端时，我们可以指定一个 response_model 。FastAPI 会用这个模型来“过滤”和格式化我们返回的数据。
 # 最典型的例子就是 UserOut ，它只包含 id , username , partner_id ，而 不会 包含 hashed_password 。这保证了我们永远不会意外地把用户的密码哈希泄露给客户端。
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
 import datetime
 from datetime import date
 
@@ -66,6 +66,12 @@ class UserOut(BaseModel):
     model_config = {"from_attributes": True}
 
 
+class StreamTicket(BaseModel):
+    '''POST /events/ticket 的输出：建立 SSE 连接用的短期票据'''
+    ticket: str
+    expires_in: int  # 有效秒数
+
+
 class Token(BaseModel):
     '''
     - 用途 : 登录 ( /auth/token ) 接口的 输出模型 。
@@ -147,6 +153,46 @@ class CheckInCreate(CheckInBase):
     task_id: int
 
 
+class CheckInImage(BaseModel):
+    """一张打卡图片的各尺寸地址。列表页用 thumb，详情/预览用 medium，缩略图还没生成时退回 original"""
+    original: str
+    thumb: Optional[str] = None    # 最长边 320px 的 WebP
+    medium: Optional[str] = None   # 最长边 1280px 的 WebP
+    width: Optional[int] = None    # 原图像素尺寸，缩略图生成后才有
+    height: Optional[int] = None
+
+    model_config = {"from_attributes": True}
+
+
+class MediaUsage(BaseModel):
+    """打卡图片占用的存储"""
+    image_count: int   # 图片张数
+    total_bytes: int   # 所有图片的字节数之和
+    blob_count: int    # 不重复的文件数，内容相同的图片只存一份
+
+
+class UploadPresignRequest(BaseModel):
+    """申请直传地址：客户端先在本地算好图片的 SHA-256，对象存储据此校验上传内容"""
+    sha256: str = Field(pattern=r"^[0-9a-f]{64}$")
+    size: int = Field(gt=0)
+    content_type: str
+
+
+class PresignedUpload(BaseModel):
+    """客户端按这里的 method、url 和 headers 原样发起上传请求"""
+    method: str
+    url: str
+    headers: dict[str, str]
+    expires_in: int
+
+
+class UploadPresignResponse(BaseModel):
+    key: str                                  # 上传完成后在打卡接口的 image_keys 里提交
+    url: str                                  # 图片的访问地址
+    exists: bool                              # 同样内容的图片已经存在时为 true，不需要上传
+    upload: Optional[PresignedUpload] = None
+
+
 class CheckIn(CheckInBase):
     # 用于 返回打卡信息 的输出模型。它包含了打卡的所有详细信息，如 id , task_id , user_id , timestamp (时间戳) 和 image_url (图片链接)，同样配置了 from_attributes = True 。
     id: int
@@ -154,7 +200,10 @@ class CheckIn(CheckInBase):
     user_id: int
     user: UserOut  # 包含打卡用户的完整信息
     timestamp: datetime.datetime
-    image_url: Optional[str] = None
+    image_url: Optional[str] = None  # 兼容旧客户端：所有原图地址用逗号拼接，新代码请使用 images
+    images: list[CheckInImage] = []  # 按上传顺序排列的图片，包含各尺寸地址
+    like_count: int = 0
+    comment_count: int = 0
 
     model_config = {"from_attributes": True}
 
@@ -199,6 +248,38 @@ class Like(BaseModel):
     model_config = {"from_attributes": True}
 
 
+# 一次请求批量点赞/取消点赞，单次最多的条数
+MAX_LIKE_BATCH_SIZE = 100
+
+
+class LikeAction(BaseModel):
+    check_in_id: int
+    action: Literal["like", "unlike"]
+
+
+class LikeBatchRequest(BaseModel):
+    actions: list[LikeAction] = Field(min_length=1, max_length=MAX_LIKE_BATCH_SIZE)
+
+
+class LikeActionResult(BaseModel):
+    check_in_id: int
+    action: str
+    # liked / unliked：已生效；already_liked / not_liked：本来就是这个状态，没有改动；
+    # not_found：打卡不存在；forbidden：不是自己或伴侣的打卡
+    status: str
+
+
+# ==================================================
+# 时间线 (Timeline) 聚合模型
+# ==================================================
+
+class TimelineCheckIn(CheckIn):
+    """带评论、点赞和点赞数的打卡记录，任务详情页一次请求即可渲染整条时间线"""
+    comments: list[Comment] = []
+    likes: list[Like] = []
+    liked_by_me: bool = False
+
+
 # ==================================================
 # 仪表盘 (Dashboard) 聚合模型
 # ==================================================
@@ -0,0 +1,42 @@
+# def 列表接口的快速 JSON 响应（FAST_JSON=true 时启用）。
+# 任务列表、打卡列表、时间线这些 def 路由在线程池里执行，FastAPI 也在线程池里按 response_model 校验返回值，
+# 但最后把模型编码成 JSON 是回到事件循环上做的：一页带评论和点赞的时间线有几百 KB，编码要几毫秒，
+# 这段时间同一个 worker 上的其他请求都在等。
+# 开启后这些路由在线程池里就用按 response_model 缓存的 TypeAdapter 校验并由 pydantic-core 直接输出 JSON 字节，
+# 返回现成的 Response，事件循环上只剩发送。输出的 JSON 与默认路径逐字节相同。
+# async def 路由（评论、点赞、得分申请）本来就在事件循环上执行，返回的又是 run_db 校验好的模型，这里帮不上忙，没有使用。
+# 新版 FastAPI 默认已经用 pydantic 直接输出 JSON，不再经过 jsonable_encoder + json.dumps，
+# 换成 ORJSONResponse 反而会退回"先转成 dict 再编码"的路径，所以这里不引入 orjson。
+# 各种方式的对比见 python -m backend.benchmarks.serialization。
+import os
+from functools import lru_cache
+
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() in ("1", "true", "yes")
+
+
+@lru_cache(maxsize=None)
+def _type_adapter(response_model):
+    return TypeAdapter(response_model)
+
+
+def dump_json(content, response_model) -> bytes:
+    '''把列表输出成 JSON 字节：ORM 对象先按 response_model 校验，已经校验好的模型列表（如时间线）直接输出'''
+    adapter = _type_adapter(response_model)
+    if not all(isinstance(item, BaseModel) for item in content):
+        content = adapter.validate_python(content, from_attributes=True)
+    return adapter.dump_json(content)
+
+
+def fast_json(response: Response, content, response_model):
+    '''
+    列表接口的返回值：FAST_JSON 关闭时原样返回 content，交给 FastAPI 处理；
+    开启时直接返回序列化好的 Response，并带上路由写在 response 上的响应头（ETag、X-Next-Cursor 等）。
+    '''
+    if not FAST_JSON:
+        return content
+    json_response = Response(content=dump_json(content, response_model), media_type="application/json")
+    json_response.raw_headers.extend(response.raw_headers)
+    return json_response
@@ -0,0 +1,235 @@
+# 打卡图片的存储后端。
+# 上传、缩略图生成只通过这里的接口读写文件，不关心文件实际放在哪里：
+# - LocalStorage（默认）：文件放在本机 UPLOAD_DIR，由 FastAPI 的 /static/uploads 提供访问。只适合单台应用服务器。
+# - S3Storage：文件放在 S3 兼容的对象存储（AWS S3、MinIO、腾讯云 COS 等）。
+#   客户端可以先申请预签名地址，把图片直接 PUT 到对象存储，再用对象 key 创建打卡；
+#   读取时 /media/{key} 只返回一个重定向到预签名下载地址（或配置的公开域名/CDN），图片字节完全不经过 FastAPI worker，
+#   多台应用节点可以共用同一个存储。
+# 对象 key 就是内容寻址路径 <aa>/<bb>/<sha256>.<扩展名>（见 uploads 模块），同一个 key 的内容永不改变。
+import base64
+import os
+import tempfile
+from contextlib import contextmanager
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "static/uploads")
+UPLOAD_URL_PREFIX = "/static/uploads"
+
+# 文件名由内容决定，同一个 URL 的内容永远不会变，浏览器和 CDN 可以缓存一年且无需再验证
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+S3_BUCKET = os.getenv("S3_BUCKET", "heartbeat-media")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None  # MinIO 等 S3 兼容服务的地址；AWS S3 留空
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID") or None
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY") or None
+# 对象可以公开读取（例如前面有 CDN）时填写公开访问的域名，图片 URL 直接指向它；留空则通过 /media/{key} 重定向到预签名地址
+S3_PUBLIC_BASE_URL = (os.getenv("S3_PUBLIC_BASE_URL") or "").rstrip("/") or None
+S3_PRESIGN_EXPIRES = int(os.getenv("S3_PRESIGN_EXPIRES", "3600"))  # 预签名地址的有效秒数
+
+
+class LocalStorage:
+    '''本机磁盘存储'''
+
+    supports_direct_upload = False
+
+    def __init__(self, root: str):
+        self.root = root
+        # 暂存目录和存储目录在同一个文件系统上，os.replace 才是原子的
+        self.staging_dir = os.path.join(root, ".staging")
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def stat(self, key: str) -> dict | None:
+        '''返回 {"size": 字节数}，不存在时返回 None'''
+        try:
+            return {"size": os.path.getsize(self._path(key))}
+        except FileNotFoundError:
+            return None
+
+    def read_head(self, key: str, length: int) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read(length)
+
+    def save_file(self, key: str, local_path: str, content_type: str):
+        '''把暂存目录里已经写完的文件原子地放到 key 的位置（local_path 会被移走）'''
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(local_path, path)
+
+    def delete(self, key: str):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def iter_keys(self):
+        '''遍历所有文件，产出 (key, 修改时间戳)；跳过暂存目录'''
+        for directory, subdirectories, files in os.walk(self.root):
+            if directory == self.root and ".staging" in subdirectories:
+                subdirectories.remove(".staging")
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    modified = os.path.getmtime(path)
+                except FileNotFoundError:
+                    continue
+                yield os.path.relpath(path, self.root).replace(os.sep, "/"), modified
+
+    @contextmanager
+    def local_copy(self, key: str):
+        '''得到可以直接读取的本地文件路径（本地存储就是文件本身）'''
+        yield self._path(key)
+
+    def url(self, key: str) -> str:
+        return f"{UPLOAD_URL_PREFIX}/{key}"
+
+    def download_url(self, key: str) -> str:
+        return self.url(key)
+
+    def presign_upload(self, key: str, content_type: str, size: int, sha256: str) -> dict:
+        raise NotImplementedError("本地存储不支持直传，请通过打卡接口上传图片")
+
+
+class S3Storage:
+    '''S3 兼容的对象存储，需要安装 boto3'''
+
+    supports_direct_upload = True
+
+    def __init__(self):
+        try:
+            import boto3
+            from botocore.config import Config
+            from botocore.exceptions import ClientError
+        except ImportError as e:  # boto3 是可选依赖
+            raise RuntimeError("STORAGE_BACKEND=s3 需要安装 boto3") from e
+        self._client_error = ClientError
+        self.bucket = S3_BUCKET
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=S3_ENDPOINT_URL,
+            region_name=S3_REGION,
+            aws_access_key_id=S3_ACCESS_KEY_ID,
+            aws_secret_access_key=S3_SECRET_ACCESS_KEY,
+            config=Config(signature_version="s3v4", s3={"addressing_style": "path"}),
+        )
+        self.staging_dir = tempfile.gettempdir()
+
+    def _head(self, key: str) -> dict | None:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)
+        except self._client_error as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def exists(self, key: str) -> bool:
+        return self._head(key) is not None
+
+    def stat(self, key: str) -> dict | None:
+        head = self._head(key)
+        if head is None:
+            return None
+        return {"size": head["ContentLength"], "content_type": head.get("ContentType")}
+
+    def read_head(self, key: str, length: int) -> bytes:
+        response = self.client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes=0-{length - 1}")
+        return response["Body"].read()
+
+    def save_file(self, key: str, local_path: str, content_type: str):
+        try:
+            self.client.upload_file(
+                local_path, self.bucket, key,
+                ExtraArgs={"ContentType": content_type, "CacheControl": IMMUTABLE_CACHE_CONTROL},
+            )
+        finally:
+            os.unlink(local_path)
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def iter_keys(self):
+        '''遍历桶里所有对象，产出 (key, 修改时间戳)'''
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket):
+            for item in page.get("Contents", []):
+                yield item["Key"], item["LastModified"].timestamp()
+
+    @contextmanager
+    def local_copy(self, key: str):
+        '''下载到临时文件，用完即删'''
+        fd, path = tempfile.mkstemp(prefix="heartbeat-media-")
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, key, path)
+            yield path
+        finally:
+            os.unlink(path)
+
+    def url(self, key: str) -> str:
+        if S3_PUBLIC_BASE_URL:
+            return f"{S3_PUBLIC_BASE_URL}/{key}"
+        return f"/media/{key}"
+
+    def download_url(self, key: str) -> str:
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=S3_PRESIGN_EXPIRES
+        )
+
+    def presign_upload(self, key: str, content_type: str, size: int, sha256: str) -> dict:
+        '''
+        生成直传用的预签名 PUT 地址。大小、类型和 SHA-256 校验和都包含在签名里，
+        对象存储会拒绝内容与声明不一致的上传，所以 key（由哈希决定）与内容一定对应。
+        '''
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        url = self.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": key,
+                "ContentType": content_type,
+                "ContentLength": size,
+                "ChecksumSHA256": checksum,
+                "CacheControl": IMMUTABLE_CACHE_CONTROL,
+            },
+            ExpiresIn=S3_PRESIGN_EXPIRES,
+        )
+        return {
+            "method": "PUT",
+            "url": url,
+            "headers": {
+                "Content-Type": content_type,
+                "x-amz-checksum-sha256": checksum,
+                "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+            },
+            "expires_in": S3_PRESIGN_EXPIRES,
+        }
+
+
+def _create_storage():
+    if STORAGE_BACKEND == "s3":
+        return S3Storage()
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(UPLOAD_DIR)
+    raise RuntimeError(f"未知的 STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+
+storage = _create_storage()
+
+
+def new_staging_file(prefix: str) -> tuple[int, str]:
+    '''在存储后端的暂存目录里创建临时文件，返回 (文件描述符, 路径)'''
+    return tempfile.mkstemp(dir=storage.staging_dir, prefix=prefix, suffix=".tmp")
+
+
+def discard_staging_file(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
@@ -0,0 +1,57 @@
+'''
+点赞与计数必须在同一个事务里提交或回滚。
+
+用法（在仓库根目录执行）：
+    python -m pytest backend/tests
+'''
+import os
+
+import pytest
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+from backend import crud, models  # noqa: E402
+from backend.database import Base  # noqa: E402
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with factory() as db:
+        db.add(models.User(id=1, username="alice", hashed_password="x", score=0))
+        db.add(models.Task(id=1, title="run", description="", is_active=True, creator_id=1))
+        db.add(models.CheckIn(id=1, task_id=1, user_id=1, text="hi"))
+        db.commit()
+    yield factory
+    engine.dispose()
+
+
+def _like_state(factory):
+    with factory() as db:
+        likes = db.query(func.count(models.Like.id)).scalar()
+        like_count = db.get(models.CheckIn, 1).like_count
+    return likes, like_count
+
+
+def test_like_and_count_commit_together(session_factory):
+    with session_factory() as db:
+        assert crud.create_like(db, 1, 1) is not None
+        assert crud.create_like(db, 1, 1) is None  # 重复点赞
+    assert _like_state(session_factory) == (1, 1)
+
+
+def test_like_rolls_back_with_count(session_factory, monkeypatch):
+    # 点赞插入之后、提交之前失败：SAVEPOINT 里的点赞不能已经单独提交，要和计数一起回滚
+    with session_factory() as db:
+        def fail():
+            raise RuntimeError("commit failed")
+
+        monkeypatch.setattr(db, "commit", fail)
+        with pytest.raises(RuntimeError):
+            crud.create_like(db, 1, 1)
+        db.rollback()
+    assert _like_state(session_factory) == (0, 0)
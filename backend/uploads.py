@@ -0,0 +1,246 @@
+# 打卡图片上传。
+# 以前的实现在 async def 路由里直接用 shutil.copyfileobj 写文件、在事件循环上调用 magic.from_buffer，而且不限制大小：
+# 几张大照片就能卡住整个 worker 的事件循环，也可能写满磁盘。现在每张图片都在线程池里处理：
+# 1. 第一遍按块读取上传内容：用第一块判断 MIME 类型（不是图片返回 400），累计大小（超过 MAX_FILE_SIZE 返回 413），同时计算 sha256；
+# 2. 按内容寻址存储：key 为 <sha256 前两位>/<第 3、4 位>/<sha256>.<扩展名>，分两级子目录，单个目录不会无限膨胀；
+# 3. 同样内容的文件已经存在时直接复用，不产生任何写入；否则第二遍拷贝到暂存文件，fsync 后交给存储后端原子地放到位。
+# 文件内容与 key 一一对应、永不改变，所以图片可以带 immutable 的长期缓存头（见 ImmutableStaticFiles）。
+# 每个文件在 media_blobs 表里有一行，ref_count 记录被多少张打卡图片引用（创建打卡时加一，删除打卡时减一）。
+# 请求失败时不删除已经写入的文件：同样内容的并发请求可能已经看到它存在、跳过了写入并登记了引用。
+# 无人引用的文件（引用计数减到 0，或者写入后请求失败、从未登记）超过宽限期后，由 collect_garbage 统一清理：
+#     python -m backend.manage gc-media
+# 一次打卡的多张图片（最多 MAX_IMAGES_PER_CHECKIN 张）并发处理。
+#
+# 使用对象存储（STORAGE_BACKEND=s3）时，客户端也可以不经过 FastAPI 上传图片：
+# 先用 presign_upload 申请预签名地址直接 PUT 到对象存储，再把 key 交给打卡接口，由 save_images 校验。
+import asyncio
+import hashlib
+import mimetypes
+import os
+import re
+import time
+from collections import defaultdict
+from typing import NamedTuple
+
+import magic
+from fastapi import HTTPException, UploadFile, status
+from fastapi.staticfiles import StaticFiles
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import crud, metrics
+from .storage import (
+    IMMUTABLE_CACHE_CONTROL, UPLOAD_DIR, discard_staging_file, new_staging_file, storage,
+)
+
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", str(10 * 1024 * 1024)))  # 单张图片的字节上限
+MAX_IMAGES_PER_CHECKIN = 3
+CHUNK_SIZE = 64 * 1024
+MAGIC_HEADER_SIZE = 2048  # 判断文件类型时读取的字节数
+
+# 常见图片类型的扩展名；其他图片类型交给 mimetypes 推断
+IMAGE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/heic": ".heic",
+}
+
+# 合法的内容寻址 key：<aa>/<bb>/<64 位十六进制>.<扩展名>
+KEY_PATTERN = re.compile(r"^([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})\.[a-z0-9]+$")
+# 原图或缩略图（<原图 key 去掉扩展名>.<尺寸名>.webp）的 key
+MEDIA_KEY_PATTERN = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[a-z]+)?\.[a-z0-9]+$")
+
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+
+class StoredImage(NamedTuple):
+    '''一张已经存入存储后端的图片'''
+    sha256: str
+    path: str       # 存储 key（本地存储时就是 UPLOAD_DIR 下的相对路径）
+    size: int
+    mime_type: str
+    url: str
+
+
+class ImmutableStaticFiles(StaticFiles):
+    '''给所有响应加上 immutable 缓存头的静态文件服务，用于内容寻址的上传目录'''
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+def url_for(path: str) -> str:
+    '''存储 key -> 对外访问的 URL'''
+    return storage.url(path)
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"单张图片不能超过 {MAX_FILE_SIZE // (1024 * 1024)}MB",
+    )
+
+
+def _not_image() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid file type. Only images are allowed.",
+    )
+
+
+def key_for(sha256: str, mime_type: str) -> str:
+    '''内容寻址的存储 key'''
+    extension = IMAGE_EXTENSIONS.get(mime_type) or mimetypes.guess_extension(mime_type) or ""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+def _inspect_upload(fileobj) -> tuple[str, int, str]:
+    '''第一遍读取：校验类型和大小并计算哈希，返回 (sha256, 字节数, MIME 类型)'''
+    digest = hashlib.sha256()
+    size = 0
+    mime_type = None
+    while chunk := fileobj.read(CHUNK_SIZE):
+        if mime_type is None:
+            mime_type = magic.from_buffer(chunk, mime=True)
+            if not mime_type.startswith("image/"):
+                raise _not_image()
+        size += len(chunk)
+        if size > MAX_FILE_SIZE:
+            raise _too_large()
+        digest.update(chunk)
+    if mime_type is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty image file.")
+    return digest.hexdigest(), size, mime_type
+
+
+def _save_image(fileobj) -> tuple[StoredImage, bool]:
+    '''
+    同步地把一张上传的图片存入内容寻址存储（在线程池里调用）。
+    返回 (图片信息, 是否新建)；同样内容的图片已经存在时不产生写入，"是否新建"为 False。
+    '''
+    try:
+        sha256, size, mime_type = _inspect_upload(fileobj)
+        key = key_for(sha256, mime_type)
+        stored = StoredImage(sha256=sha256, path=key, size=size, mime_type=mime_type, url=url_for(key))
+        if storage.exists(key):
+            return stored, False
+
+        fileobj.seek(0)
+        fd, tmp_path = new_staging_file(".upload-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while chunk := fileobj.read(CHUNK_SIZE):
+                    out.write(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            storage.save_file(key, tmp_path, mime_type)
+        except BaseException:
+            discard_staging_file(tmp_path)
+            raise
+        return stored, True
+    finally:
+        fileobj.close()
+
+
+def _resolve_uploaded_key(key: str) -> tuple[StoredImage, bool]:
+    '''校验一个客户端直传到对象存储的 key：格式、是否存在、大小和文件类型'''
+    match = KEY_PATTERN.match(key)
+    if match is None or not match.group(3).startswith(match.group(1) + match.group(2)):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid image key: {key}")
+    info = storage.stat(key)
+    if info is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Image not uploaded: {key}")
+    if info["size"] > MAX_FILE_SIZE:
+        raise _too_large()
+    mime_type = magic.from_buffer(storage.read_head(key, MAGIC_HEADER_SIZE), mime=True)
+    if not mime_type.startswith("image/"):
+        raise _not_image()
+    stored = StoredImage(sha256=match.group(3), path=key, size=info["size"], mime_type=mime_type, url=url_for(key))
+    return stored, False
+
+
+async def save_images(images: list[UploadFile] | None, uploaded_keys: list[str] | None = None) -> list[StoredImage]:
+    '''
+    并发保存一次打卡的所有图片，返回按顺序排列的图片信息（先是表单上传的文件，再是直传到对象存储的 key）。
+    任何一张失败时抛出第一张失败图片的错误；已经写入的文件不删除（可能已被同样内容的并发请求引用），留给 collect_garbage。
+    '''
+    images = [image for image in images or [] if image.filename]
+    uploaded_keys = [key for key in uploaded_keys or [] if key]
+    if len(images) + len(uploaded_keys) > MAX_IMAGES_PER_CHECKIN:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"最多只能上传{MAX_IMAGES_PER_CHECKIN}张图片",
+        )
+    # 表单解析时已经知道大小的文件，不用读就可以直接拒绝
+    if any(image.size is not None and image.size > MAX_FILE_SIZE for image in images):
+        raise _too_large()
+
+    results = await asyncio.gather(
+        *(run_in_threadpool(_save_image, image.file) for image in images),
+        *(run_in_threadpool(_resolve_uploaded_key, key) for key in uploaded_keys),
+        return_exceptions=True,
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        raise errors[0]
+    for position, (stored, _) in enumerate(results):
+        metrics.record_upload(stored.size, "form" if position < len(images) else "direct")
+    return [stored for stored, _ in results]
+
+
+def presign_upload(sha256: str, size: int, content_type: str) -> dict:
+    '''为客户端直传申请预签名地址（同步，可能访问对象存储）；同样内容的图片已经存在时不需要再上传'''
+    if not storage.supports_direct_upload:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="当前存储后端不支持直传，请通过打卡接口上传图片",
+        )
+    if not content_type.startswith("image/"):
+        raise _not_image()
+    if size > MAX_FILE_SIZE:
+        raise _too_large()
+    key = key_for(sha256, content_type)
+    if storage.exists(key):
+        return {"key": key, "url": url_for(key), "exists": True, "upload": None}
+    return {
+        "key": key,
+        "url": url_for(key),
+        "exists": False,
+        "upload": storage.presign_upload(key, content_type, size, sha256),
+    }
+
+
+def collect_garbage(db: Session, grace_seconds: float) -> tuple[int, int]:
+    '''
+    清理无人引用的原图和缩略图（同步，会遍历整个存储后端，供运维命令使用），返回 (删除的文件数, 删除的登记数)：
+    - media_blobs 里引用计数为 0 且超过宽限期的文件：先删登记（删除时再确认一次计数仍为 0），再删文件；
+    - 没有登记、最后一次写入也早于宽限期的文件：上传后请求失败，或者直传之后没有创建打卡。
+    宽限期（默认一天）要远长于一次请求：刚看到文件已存在、还没来得及登记引用的请求不会被影响。
+    '''
+    keys = defaultdict(list)  # sha256 -> 原图和各尺寸缩略图的 key
+    modified = {}             # sha256 -> 其中最晚的修改时间
+    for key, mtime in storage.iter_keys():
+        match = MEDIA_KEY_PATTERN.match(key)
+        if match is None:
+            continue
+        sha256 = match.group(1)
+        keys[sha256].append(key)
+        modified[sha256] = max(mtime, modified.get(sha256, mtime))
+
+    released = set(crud.delete_released_media_blobs(db, grace_seconds))
+    cutoff = time.time() - grace_seconds
+    candidates = [sha256 for sha256 in keys if sha256 not in released and modified[sha256] < cutoff]
+    registered = set()
+    for start in range(0, len(candidates), 500):
+        registered |= crud.get_media_blob_hashes(db, candidates[start:start + 500])
+
+    removed = 0
+    for sha256 in released | (set(candidates) - registered):
+        for key in keys.get(sha256, ()):
+            storage.delete(key)
+            removed += 1
+    return removed, len(released)
@@ -0,0 +1,51 @@
+// 伴侣动态的实时推送（后端 GET /events，Server-Sent Events）
+// EventSource 不能设置请求头，而 URL 会被记进服务器的访问日志，所以不把访问令牌放进 URL：
+// 每次连接前先用 POST /events/ticket 换一张只能用来连 /events、很快就过期的票据。
+// 票据过期后浏览器自动重连会一直失败，所以断线时（包括访问令牌到期时服务端主动关闭）由这里换新票据重连。
+import apiClient from './index';
+
+const API_URL = 'http://127.0.0.1:8000';
+const RECONNECT_DELAY_MS = 3000;
+
+// handlers: { 'check_in.created': (data) => {}, 'like.created': ..., resync: () => {} }
+// 返回一个关闭连接的函数，在组件卸载时调用
+export const subscribeEvents = (handlers) => {
+  if (!localStorage.getItem('access_token') || typeof EventSource === 'undefined') {
+    return () => {};
+  }
+  let source = null;
+  let timer = null;
+  let closed = false;
+
+  const reconnect = () => {
+    if (!closed) timer = setTimeout(() => connect(true), RECONNECT_DELAY_MS);
+  };
+
+  const connect = async (isReconnect) => {
+    try {
+      // apiClient 会在访问令牌过期时先刷新令牌
+      const { data } = await apiClient.post('/events/ticket');
+      if (closed) return;
+      source = new EventSource(`${API_URL}/events?ticket=${encodeURIComponent(data.ticket)}`);
+    } catch (error) {
+      reconnect();
+      return;
+    }
+    Object.entries(handlers).forEach(([type, handler]) => {
+      source.addEventListener(type, (event) => handler(JSON.parse(event.data)));
+    });
+    source.onerror = () => {
+      source.close();
+      reconnect();
+    };
+    // 断线期间的事件收不到了，重连后重新拉取一次
+    if (isReconnect && handlers.resync) handlers.resync();
+  };
+
+  connect(false);
+  return () => {
+    closed = true;
+    clearTimeout(timer);
+    if (source) source.close();
+  };
+};